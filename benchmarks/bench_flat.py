@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_flat.py
+
+Time polls of one huge flat folder (not recursive) with the default scan,
+structure only and large_dirs: a quiet poll, a poll after adding one
+file and one after removing it, each diffed with scan_changes().
+
+Reports wall time and the number of listing/stat calls of each poll
+(counted on a separate run), and checks that every mode reports the same
+changes.
+
+    python3 benchmarks/bench_flat.py --files 300000
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from monitor_core import PathFilter, Snapshot, scan_changes, RACY_NS
+from bench_scan import SyscallCounter
+from bench_suite import _copy
+
+MODES = (
+    ("default", {}),
+    ("struct-only", {"structure_only": True}),
+    ("large-dirs", {"large_dirs": True}),
+)
+
+
+def make_flat(root, files):
+    """Create 'files' empty files in 'root', backdated an hour."""
+    for f in range(files):
+        open(os.path.join(root, "file%07d.dat" % f), "w").close()
+    old = time.time() - 3600
+    for name in os.listdir(root):
+        os.utime(os.path.join(root, name), (old, old))
+    os.utime(root, (old, old))
+
+
+def _settle():
+    """Wait out RACY_NS so the folder just changed is not listed again regardless."""
+    time.sleep(RACY_NS / 1e9 + 0.1)
+
+
+def _poll(params, snapshot, **options):
+    """One timed poll of 'snapshot'; the calls are counted on a poll of a copy."""
+    with SyscallCounter() as counter:
+        for _ in scan_changes(*params, _copy(snapshot), **options):
+            pass
+    t0 = time.perf_counter()
+    events = [sorted(kind) for changes in scan_changes(*params, snapshot, **options)
+              for kind in changes]
+    return time.perf_counter() - t0, counter, events
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=300000, help="files in the folder")
+    parser.add_argument("--path", help="poll an existing folder instead of a synthetic one "
+                                       "(files are added to and removed from it)")
+    args = parser.parse_args()
+
+    tmp = None
+    if args.path:
+        root = os.path.realpath(args.path)
+    else:
+        tmp = tempfile.mkdtemp(prefix="dirmon-flat-")
+        root = os.path.realpath(tmp)
+        make_flat(root, args.files)
+    extra = os.path.join(root, "zz-bench-flat.new")
+    params = ([root], False, False, PathFilter())
+    try:
+        print(f"{'mode':<12} {'poll':<8} {'wall (ms)':>10} {'scandir':>8} {'stat':>8}")
+        reported = {}
+        for label, options in MODES:
+            snapshot = Snapshot()
+            list(scan_changes(*params, snapshot, **options))
+            _settle()
+            polls = [("quiet", None), ("added", lambda: open(extra, "w").close()),
+                     ("removed", lambda: os.unlink(extra))]
+            for poll, change in polls:
+                if change is not None:
+                    change()
+                elapsed, counter, events = _poll(params, snapshot, **options)
+                reported.setdefault(poll, []).append(events)
+                print(f"{label:<12} {poll:<8} {elapsed * 1000:>10.1f} "
+                      f"{counter.scandir:>8} {counter.stat:>8}")
+                _settle()
+        if any(len({repr(e) for e in runs}) > 1 for runs in reported.values()):
+            print("ERROR: modes report different changes", file=sys.stderr)
+            return 1
+    finally:
+        if tmp:
+            shutil.rmtree(tmp, ignore_errors=True)
+        elif os.path.exists(extra):
+            os.unlink(extra)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
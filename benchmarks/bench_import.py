@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_import.py
+
+Measure how long importing each front-end's modules takes, using the
+interpreter's own -X importtime report in a fresh process per run. The
+core and the CLI must stay free of tkinter; the GUI row shows what that
+saves. -X importtime needs Python 3.7 or later, unlike the monitor itself.
+
+    python3 benchmarks/bench_import.py --repeat 10
+"""
+
+import os
+import sys
+import argparse
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+MODULES = (
+    ("monitor_core", "monitor_core"),
+    ("monitor_cli", "monitor_cli"),
+    ("GUI (main_eng)", "main_eng"),
+)
+
+
+def import_time(module):
+    """Cumulative import time of 'module' in microseconds, and whether tkinter came along."""
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    total, tk = None, False
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if name == module:
+            total = int(cumulative)
+        if name == "tkinter":
+            tk = True
+    return total, tk
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="runs per module, best one kept")
+    args = parser.parse_args()
+
+    # First run writes the bytecode caches so later runs measure loading only
+    for _, module in MODULES:
+        import_time(module)
+    print(f"{'module':<16} {'import (ms)':>12} {'tkinter':>8}")
+    failed = False
+    for label, module in MODULES:
+        best, tk = min(import_time(module) for _ in range(args.repeat))
+        print(f"{label:<16} {best / 1000:>12.1f} {'yes' if tk else 'no':>8}")
+        if tk and module != "main_eng":
+            failed = True
+    if failed:
+        print("ERROR: a headless module imports tkinter", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_memory.py
+
+Measure the memory held by a snapshot of N entries in the current
+Snapshot layout (one DirTable per directory) against the previous
+layout, a dict mapping "base|rel" strings to float mtimes.
+
+No files are created: both snapshots are filled with synthetic names laid
+out like benchmarks/bench_scan.py trees, and sized with tracemalloc.
+
+    python3 benchmarks/bench_memory.py --entries 1000000
+"""
+
+import sys
+import argparse
+import tracemalloc
+from array import array
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from monitor_core import F_DIR, F_DESCEND, F_MATCH, F_LISTED, DirTable, Snapshot
+
+BASE = "/home/user/projects/watched"
+
+
+def layout(entries, per_dir):
+    """Yield (prefix, [file names]) for a two-level tree of 'entries' files."""
+    dirs = max(entries // per_dir, 1)
+    for d in range(dirs):
+        prefix = "d%03d/sub%05d/" % (d % 100, d)
+        yield prefix, ["file%05d.txt" % f for f in range(per_dir)]
+
+
+def build_dict(entries, per_dir):
+    snapshot = {}
+    mtime = 1700000000.0
+    for prefix, names in layout(entries, per_dir):
+        snapshot[f"{BASE}|{prefix}"] = mtime
+        for name in names:
+            snapshot[f"{BASE}|{prefix}{name}"] = mtime + len(snapshot)
+    return snapshot
+
+
+def build_snapshot(entries, per_dir):
+    snapshot = Snapshot()
+    tables = snapshot.roots.setdefault(BASE, {})
+    ino = 1000
+    for prefix, names in layout(entries, per_dir):
+        n = len(names)
+        ino += n
+        tables[prefix] = DirTable(
+            1, ino, 1700000000 * 10**9, 1800000000 * 10**9, "\0".join(names),
+            bytes([F_MATCH | F_LISTED]) * n, array('Q', range(ino, ino + n)),
+            array('q', [1]) * n, array('q', range(n)), n)
+    # the directories themselves, listed in their parents
+    for top in {p.split('/')[0] for p in tables}:
+        subs = sorted(p.split('/')[1] for p in tables if p.startswith(top + '/'))
+        n = len(subs)
+        tables[top + '/'] = DirTable(
+            1, 0, 0, 0, "\0".join(subs), bytes([F_DIR | F_DESCEND | F_MATCH | F_LISTED]) * n,
+            array('Q', [0]) * n, array('q', [0]) * n, array('q', [0]) * n, n)
+    return snapshot
+
+
+def measure(build, *args):
+    tracemalloc.start()
+    result = build(*args)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entries", type=int, default=1000000, help="files in the snapshot")
+    parser.add_argument("--per-dir", type=int, default=100, help="files per directory")
+    args = parser.parse_args()
+
+    old_size, old = measure(build_dict, args.entries, args.per_dir)
+    del old
+    new_size, new = measure(build_snapshot, args.entries, args.per_dir)
+    print(f"entries in snapshot: {len(new)}")
+    print(f"{'layout':<20} {'MiB':>8} {'bytes/entry':>12}")
+    for label, size in (("dict of str keys", old_size), ("Snapshot", new_size)):
+        print(f"{label:<20} {size / 2**20:>8.1f} {size / len(new):>12.1f}")
+    print(f"reduction: {old_size / new_size:.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
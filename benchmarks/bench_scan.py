@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_scan.py
+
+Compare the scandir-based scan_directories() against the previous
+os.walk + pathlib implementation on a synthetic tree, and time quiet
+incremental polls (full stat pass and structure only), and a parallel
+scan with --workers threads.
+
+Reports wall time and the number of listing/stat calls issued by each
+walker, and checks that all of them return the same snapshot. --delay adds
+a fixed latency to every listing and stat call, to model a network mount.
+
+    python3 benchmarks/bench_scan.py --dirs 200 --files 50
+    python3 benchmarks/bench_scan.py --delay 0.5 --workers 8
+"""
+
+import os
+import sys
+import time
+import shutil
+import fnmatch
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from monitor_core import scan_directories, PathFilter
+
+
+def legacy_scan(bases, recursive, include_hidden, includes, excludes):
+    """The os.walk based walker scan_directories() replaced."""
+    snapshot = {}
+    for base in bases:
+        base = Path(base).resolve()
+        if recursive:
+            for root, dirs, files in os.walk(base):
+                if not include_hidden:
+                    dirs[:]  = [d for d in dirs  if not d.startswith('.')]
+                    files[:] = [f for f in files if not f.startswith('.')]
+                for name in dirs + files:
+                    full = Path(root) / name
+                    rel = full.relative_to(base).as_posix() + ('/' if full.is_dir() else '')
+                    if _legacy_filter(rel, includes, excludes):
+                        try:
+                            snapshot[f"{base}|{rel}"] = full.stat().st_mtime
+                        except OSError:
+                            pass
+        else:
+            for child in base.iterdir():
+                if not include_hidden and child.name.startswith('.'):
+                    continue
+                rel = child.name + ('/' if child.is_dir() else '')
+                if _legacy_filter(rel, includes, excludes):
+                    try:
+                        snapshot[f"{base}|{rel}"] = child.stat().st_mtime
+                    except OSError:
+                        pass
+    return snapshot
+
+
+def _legacy_filter(name, includes, excludes):
+    if includes and not any(fnmatch.fnmatch(name, pat) for pat in includes):
+        return False
+    if excludes and any(fnmatch.fnmatch(name, pat) for pat in excludes):
+        return False
+    return True
+
+
+def make_tree(root, dirs, files, hidden_every=10):
+    """Create 'dirs' directories (two levels deep) holding 'files' files each."""
+    for d in range(dirs):
+        sub = os.path.join(root, "d%03d" % (d % 20), "sub%04d" % d)
+        os.makedirs(sub, exist_ok=True)
+        for f in range(files):
+            name = ".hidden%04d" % f if f % hidden_every == 0 else "file%04d.txt" % f
+            with open(os.path.join(sub, name), "w") as fh:
+                fh.write("x")
+    # Backdate the directories so incremental scans don't treat them as racy
+    old = time.time() - 3600
+    for path, _, _ in os.walk(root):
+        os.utime(path, (old, old))
+
+
+class _CountingEntry:
+    """DirEntry proxy counting the stat() calls that reach the kernel."""
+    def __init__(self, entry, counter):
+        self._entry = entry
+        self._counter = counter
+        self._stat = {}
+
+    def __getattr__(self, name):
+        return getattr(self._entry, name)
+
+    def stat(self, *, follow_symlinks=True):
+        if follow_symlinks not in self._stat:
+            self._counter.count('stat')
+            self._stat[follow_symlinks] = self._entry.stat(follow_symlinks=follow_symlinks)
+        return self._stat[follow_symlinks]
+
+
+class _CountingScandir:
+    def __init__(self, it, counter):
+        self._it = it
+        self._counter = counter
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return _CountingEntry(next(self._it), self._counter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._it.close()
+
+    def close(self):
+        self._it.close()
+
+
+class SyscallCounter:
+    """
+    Count directory listings and stat calls made through the os module.
+    DirEntry type checks answered from d_type are free and not counted.
+    Each counted call first sleeps 'delay' seconds.
+    """
+    def __init__(self, delay=0.0):
+        self.scandir = 0
+        self.stat = 0
+        self.delay = delay
+        self._lock = threading.Lock()
+
+    def count(self, kind):
+        with self._lock:
+            setattr(self, kind, getattr(self, kind) + 1)
+        if self.delay:
+            time.sleep(self.delay)
+
+    def __enter__(self):
+        self._saved = os.scandir, os.stat, os.lstat
+        real_scandir, real_stat, real_lstat = self._saved
+
+        def scandir(path='.'):
+            self.count('scandir')
+            return _CountingScandir(real_scandir(path), self)
+
+        def stat(*args, **kwargs):
+            self.count('stat')
+            return real_stat(*args, **kwargs)
+
+        def lstat(*args, **kwargs):
+            self.count('stat')
+            return real_lstat(*args, **kwargs)
+
+        os.scandir, os.stat, os.lstat = scandir, stat, lstat
+        return self
+
+    def __exit__(self, *exc):
+        os.scandir, os.stat, os.lstat = self._saved
+
+    @property
+    def total(self):
+        return self.scandir + self.stat
+
+
+def _best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dirs", type=int, default=200, help="number of leaf directories")
+    parser.add_argument("--files", type=int, default=50, help="files per leaf directory")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per walker")
+    parser.add_argument("--hidden", action="store_true", help="include hidden entries")
+    parser.add_argument("--path", help="scan an existing tree instead of a synthetic one")
+    parser.add_argument("--workers", type=int, default=4, help="threads for the parallel scan")
+    parser.add_argument("--delay", type=float, default=0.0,
+                        help="latency added to each listing/stat call, in ms")
+    args = parser.parse_args()
+
+    tmp = None
+    if args.path:
+        root = args.path
+    else:
+        tmp = tempfile.mkdtemp(prefix="dirmon-bench-")
+        root = tmp
+        make_tree(root, args.dirs, args.files)
+    try:
+        params = ([root], True, args.hidden, PathFilter())
+        baseline = scan_directories(*params)
+        walkers = (
+            ("os.walk + pathlib", lambda *a: legacy_scan(*a[:3], [], [])),
+            ("os.scandir", scan_directories),
+            (f"parallel x{args.workers}", lambda *a: scan_directories(*a, workers=args.workers)),
+            ("quiet incremental", lambda *a: scan_directories(*a, previous=baseline)),
+            ("quiet struct-only", lambda *a: scan_directories(*a, previous=baseline, structure_only=True)),
+        )
+        delay = args.delay / 1000
+        results = {}
+        for label, fn in walkers:
+            with SyscallCounter(delay) as counter:
+                snap = fn(*params)
+            if delay:
+                with SyscallCounter(delay):
+                    elapsed, _ = _best_of(lambda: fn(*params), args.repeat)
+            else:
+                elapsed, _ = _best_of(lambda: fn(*params), args.repeat)
+            results[label] = (snap, elapsed, counter)
+
+        (old_snap, old_t, old_c), (new_snap, new_t, new_c) = list(results.values())[:2]
+        expected = set(old_snap)
+        if any({f"{base}|{rel}" for base, rel in snap} != expected
+               for snap, _, _ in list(results.values())[1:]):
+            print("ERROR: snapshots differ", file=sys.stderr)
+            return 1
+
+        print(f"entries in snapshot: {len(new_snap)}")
+        print(f"{'walker':<20} {'wall (ms)':>10} {'scandir':>8} {'stat':>8} {'total':>8}")
+        for label, (_, elapsed, c) in results.items():
+            print(f"{label:<20} {elapsed * 1000:>10.1f} {c.scandir:>8} {c.stat:>8} {c.total:>8}")
+        print(f"speed-up: {old_t / new_t:.2f}x, calls: {old_c.total / max(new_c.total, 1):.2f}x fewer")
+    finally:
+        if tmp:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_suite.py
+
+Scaling benchmarks for the scan and diff hot paths on synthetic trees
+(see treegen.py), at several sizes:
+
+  full_scan     scan_directories() without a previous snapshot
+  quiet_poll    incremental rescan of an unchanged tree
+  quiet_struct  the same, structure only
+  filter_heavy  full scan with many include/exclude globs
+  filter_match  PathFilter.matches() over every path of the tree
+  churn         churns a share of the files, then reports two results:
+                churny_poll, scan_changes() over the churned tree, and
+                compare, compare_snapshots() between before and after
+
+Each scenario runs in its own process so its peak RSS can be reported.
+Wall time is the best of --repeat runs (one run for churn); listing and
+stat calls are counted on a separate run. Results are written as JSON,
+and --compare prints the ratios against an earlier results file.
+
+    python3 benchmarks/bench_suite.py --sizes 10k,100k,1m --output before.json
+    python3 benchmarks/bench_suite.py --sizes 10k,100k,1m --compare before.json
+"""
+
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from monitor_core import PathFilter, Snapshot, scan_directories, scan_changes, compare_snapshots
+from bench_scan import SyscallCounter
+from treegen import make_tree, churn
+
+SCENARIOS = ("full_scan", "quiet_poll", "quiet_struct", "filter_heavy", "filter_match", "churn")
+
+HEAVY_FILTER = PathFilter(
+    ["*.txt", "*.log", "*.py", "*/", "dir00[0-4]/**/*.csv", "*/dir01?/*"],
+    ["*.tmp", "*~", "*/.git/*", "*/__pycache__/*", "*.pyc", "*/build/*", "*/dist/*",
+     "dir009/dir009/", "*/node_modules/", "*.[oa]", "*/cache/*", "*.bak", "*/tmp/*",
+     "*/dir005/dir001/*", "*.swp", "*/.venv/*"],
+)
+
+
+def parse_size(text):
+    text = text.strip().lower()
+    scale = {'k': 10**3, 'm': 10**6}.get(text[-1:], 1)
+    return int(float(text.rstrip('km')) * scale)
+
+
+def _copy(snapshot):
+    """Copy of a snapshot that scan_changes() can update without touching the original."""
+    copy = Snapshot(snapshot.key)
+    copy.roots = {base: dict(tables) for base, tables in snapshot.roots.items()}
+    return copy
+
+
+def _peak_rss_kb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def _measure(fn, repeat):
+    """Best wall time of 'repeat' runs, then the calls made by one more run."""
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    with SyscallCounter() as counter:
+        fn()
+    return dict(wall_s=best, scandir=counter.scandir, stat=counter.stat)
+
+
+def run_scenario(scenario, root, repeat, churn_rate, seed):
+    """Run one scenario in this process; returns a list of result dicts."""
+    params = ([root], True, False, PathFilter())
+    if scenario == "full_scan":
+        results = {"full_scan": _measure(lambda: scan_directories(*params), repeat)}
+    elif scenario in ("quiet_poll", "quiet_struct"):
+        base = scan_directories(*params)
+        struct = scenario == "quiet_struct"
+        results = {scenario: _measure(
+            lambda: scan_directories(*params, previous=base, structure_only=struct), repeat)}
+    elif scenario == "filter_heavy":
+        heavy = ([root], True, False, HEAVY_FILTER)
+        results = {scenario: _measure(lambda: scan_directories(*heavy), repeat)}
+    elif scenario == "filter_match":
+        rels = [rel for _, rel in scan_directories(*params)]
+        results = {scenario: _measure(lambda: sum(map(HEAVY_FILTER.matches, rels)), repeat)}
+    else:
+        base = scan_directories(*params)
+        churn(root, churn_rate, seed)
+        # The tree no longer changes: each run starts over from a copy of 'base'
+        results = {"churny_poll": _measure(
+            lambda: sum(1 for _ in scan_changes(*params, _copy(base))), 1)}
+        after = scan_directories(*params)
+        results["compare"] = _measure(lambda: compare_snapshots(base, after), 1)
+    entries = len(scan_directories(*params))
+    rss = _peak_rss_kb()
+    return [dict(scenario=name, entries=entries, peak_rss_kb=rss, **r)
+            for name, r in results.items()]
+
+
+def _child(args):
+    print(json.dumps(run_scenario(args.child, args.root, args.repeat, args.churn, args.seed)))
+    return 0
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE, universal_newlines=True,
+                             cwd=Path(__file__).resolve().parent)
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+
+def _compare(results, path):
+    with open(path, encoding='utf-8') as fh:
+        before = {(r["size"], r["scenario"]): r for r in json.load(fh)["results"]}
+    print(f"\nagainst {path} (ratio > 1: slower / more now)")
+    print(f"{'size':>8} {'scenario':<14} {'wall':>8} {'calls':>8} {'rss':>8}")
+    for r in results:
+        old = before.get((r["size"], r["scenario"]))
+        if old is None:
+            continue
+        def ratio(key):
+            a, b = r.get(key), old.get(key)
+            if key == "calls":
+                a, b = r["scandir"] + r["stat"], old["scandir"] + old["stat"]
+            return f"{a / b:>8.2f}" if a and b else f"{'-':>8}"
+        print(f"{r['size']:>8} {r['scenario']:<14} {ratio('wall_s')} {ratio('calls')} {ratio('peak_rss_kb')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scan/diff scaling benchmarks on synthetic trees.")
+    parser.add_argument("--sizes", default="10k,100k,1m", help="tree sizes (default: 10k,100k,1m)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help="comma-separated subset of: " + ", ".join(SCENARIOS))
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fanout", type=int, default=10)
+    parser.add_argument("--hidden-ratio", type=float, default=0.1)
+    parser.add_argument("--churn", type=float, default=0.01, help="share of files changed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per scenario")
+    parser.add_argument("--tmpdir", help="where trees are generated (default: system temp)")
+    parser.add_argument("--output", default="bench-results.json", help="JSON results file")
+    parser.add_argument("--compare", metavar="JSON", help="earlier results to compare with")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--root", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return _child(args)
+
+    scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error("unknown scenario(s): " + ", ".join(sorted(unknown)))
+    # churn changes the tree, so it always goes last
+    scenarios.sort(key=lambda s: s == "churn")
+
+    results = []
+    print(f"{'size':>8} {'scenario':<14} {'entries':>9} {'wall (ms)':>10} {'scandir':>8} "
+          f"{'stat':>9} {'rss (MiB)':>9}")
+    for text in args.sizes.split(","):
+        size = parse_size(text)
+        root = tempfile.mkdtemp(prefix="dirmon-suite-", dir=args.tmpdir)
+        try:
+            t0 = time.perf_counter()
+            make_tree(root, size, args.depth, args.fanout, args.hidden_ratio, args.seed)
+            print(f"{text:>8} {'(generate)':<14} {'':>9} {(time.perf_counter() - t0) * 1000:>10.0f}")
+            for scenario in scenarios:
+                cmd = [sys.executable, __file__, "--child", scenario, "--root", root,
+                       "--repeat", str(args.repeat), "--churn", str(args.churn),
+                       "--seed", str(args.seed)]
+                out = subprocess.run(cmd, stdout=subprocess.PIPE, universal_newlines=True,
+                                     check=True)
+                for r in json.loads(out.stdout):
+                    r["size"] = text
+                    results.append(r)
+                    rss = f"{r['peak_rss_kb'] / 1024:>9.1f}" if r["peak_rss_kb"] else f"{'-':>9}"
+                    print(f"{text:>8} {r['scenario']:<14} {r['entries']:>9} "
+                          f"{r['wall_s'] * 1000:>10.1f} {r['scandir']:>8} {r['stat']:>9} {rss}")
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+    report = dict(
+        meta=dict(python=platform.python_version(), platform=platform.platform(),
+                  commit=_git_commit(), time=time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                  args={k: v for k, v in vars(args).items() if k not in ("child", "root")}),
+        results=results,
+    )
+    with open(args.output, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, indent=2)
+    print(f"\nresults written to {args.output}")
+    if args.compare:
+        _compare(results, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
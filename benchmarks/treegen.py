@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+treegen.py
+
+Reproducible synthetic directory trees for the benchmarks. The same
+arguments and seed always produce the same names, sizes and mtimes, and
+churn() applies the same set of changes, so runs on different machines
+or commits can be compared.
+
+    python3 benchmarks/treegen.py /tmp/tree --entries 100000 --depth 3 --fanout 10
+"""
+
+import os
+import sys
+import random
+import argparse
+
+# Fixed timestamps: one hour before "now" would make runs differ, and
+# directories must be older than the scanner's racy window
+BASE_MTIME = 1600000000
+CHURN_MTIME = 1700000000
+
+
+def _dirs(depth, fanout):
+    """Relative paths of the directories of a 'depth' x 'fanout' tree, root first."""
+    level, dirs = [''], ['']
+    for _ in range(depth):
+        level = [os.path.join(parent, "dir%03d" % i) for parent in level for i in range(fanout)]
+        dirs.extend(level)
+    return dirs
+
+
+def make_tree(root, entries, depth=3, fanout=10, hidden_ratio=0.1, seed=0):
+    """
+    Fill 'root' with about 'entries' files and directories: 'depth' levels
+    of 'fanout' subdirectories each, the files spread evenly over every
+    directory, a 'hidden_ratio' share of them named with a leading dot.
+    Levels are dropped while 'entries' is too small to give every
+    directory at least one file. Returns the number of entries created.
+    """
+    rnd = random.Random(seed)
+    dirs = _dirs(depth, fanout)
+    while depth > 0 and entries - len(dirs) + 1 < len(dirs):
+        depth -= 1
+        dirs = _dirs(depth, fanout)
+    per_dir = max((entries - len(dirs) + 1) // len(dirs), 0)
+    count = 0
+    for rel in dirs:
+        path = os.path.join(root, rel)
+        os.makedirs(path, exist_ok=True)
+        count += bool(rel)
+        for f in range(per_dir):
+            hidden = rnd.random() < hidden_ratio
+            name = "%sfile%05d.%s" % ('.' if hidden else '', f, rnd.choice(("txt", "log", "py", "csv")))
+            with open(os.path.join(path, name), "wb") as fh:
+                fh.write(b"x" * rnd.randrange(64))
+            os.utime(os.path.join(path, name), (BASE_MTIME, BASE_MTIME + f))
+            count += 1
+    for rel in reversed(dirs):
+        os.utime(os.path.join(root, rel), (BASE_MTIME, BASE_MTIME))
+    return count
+
+
+def churn(root, rate, seed=0):
+    """
+    Change a 'rate' share of the files under 'root': a quarter each are
+    modified, deleted, renamed within their directory and added next to
+    an existing file. Returns a dict counting each kind of change.
+    """
+    rnd = random.Random(seed)
+    files = []
+    for path, dirs, names in os.walk(root):
+        dirs.sort()
+        files.extend(os.path.join(path, n) for n in sorted(names))
+    picked = rnd.sample(files, int(len(files) * rate))
+    counts = dict(modified=0, removed=0, renamed=0, added=0)
+    for i, path in enumerate(picked):
+        kind = ("modified", "removed", "renamed", "added")[i % 4]
+        if kind == "modified":
+            with open(path, "ab") as fh:
+                fh.write(b"y")
+            os.utime(path, (CHURN_MTIME, CHURN_MTIME + i))
+        elif kind == "removed":
+            os.unlink(path)
+        elif kind == "renamed":
+            os.rename(path, path + ".renamed")
+        else:
+            new = "%s.new%d" % (path, i)
+            with open(new, "wb"):
+                pass
+            os.utime(new, (CHURN_MTIME, CHURN_MTIME + i))
+        counts[kind] += 1
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create a reproducible synthetic tree.")
+    parser.add_argument("root", help="directory to fill (created if missing)")
+    parser.add_argument("--entries", type=int, default=10000)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fanout", type=int, default=10)
+    parser.add_argument("--hidden-ratio", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--churn", type=float, default=0.0,
+                        help="then change this share of the files")
+    args = parser.parse_args()
+    count = make_tree(args.root, args.entries, args.depth, args.fanout,
+                      args.hidden_ratio, args.seed)
+    print(f"created {count} entries under {args.root}")
+    if args.churn:
+        print(churn(args.root, args.churn, args.seed))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,11 +7,17 @@ Self-contained Python GUI tool for polling-based directory monitoring.
 Uses Tkinter and the standard library only. Features:
 
   • add/remove multiple folders to watch  
-  • configurable polling interval  
+  • configurable polling interval, optionally adaptive per folder  
   • optional recursive scan  
   • include or exclude hidden entries  
   • advanced glob filters (include/exclude)  
-  • real-time log view in GUI and optional log file  
+  • action hooks running a command for matching events, on hook threads  
+  • real-time log view in GUI, optional log file and JSON lines event file,  
+    written by a background thread and rotated by size  
+  • bursts of events on a path merged into one after a quiet window  
+  • per-poll timings in a status bar, optional metrics file  
+  • optional SQLite event history, searchable by folder and time  
+  • attach to a shared scanner daemon instead of scanning (monitor_cli.py --serve)  
   • Start/Stop controls  
 
 Requires Python 3.6+ with no external dependencies.
@@ -20,82 +26,90 @@ Requires Python 3.6+ with no external dependencies.
 import os
 import sys
 import time
-import fnmatch
+import queue
+import socket
 import logging
+from collections import deque
 from pathlib import Path
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, simpledialog, scrolledtext
 
-def scan_directories(bases, recursive, include_hidden, includes, excludes):
-    """
-    Walk each base directory and return a snapshot dict:
-      { "base|relative_path": last_mod_time }
-    Applies recursive flag, hidden filter, and glob include/exclude.
-    """
-    snapshot = {}
-    for base in bases:
-        base = Path(base).resolve()
-        if recursive:
-            for root, dirs, files in os.walk(base):
-                if not include_hidden:
-                    dirs[:]  = [d for d in dirs  if not d.startswith('.')]
-                    files[:] = [f for f in files if not f.startswith('.')]
-                for name in dirs + files:
-                    full = Path(root) / name
-                    rel = full.relative_to(base).as_posix() + ('/' if full.is_dir() else '')
-                    if _matches_filter(rel, includes, excludes):
-                        try:
-                            snapshot[f"{base}|{rel}"] = full.stat().st_mtime
-                        except OSError:
-                            pass
-        else:
-            for child in base.iterdir():
-                if not include_hidden and child.name.startswith('.'):
-                    continue
-                rel = child.name + ('/' if child.is_dir() else '')
-                if _matches_filter(rel, includes, excludes):
-                    try:
-                        snapshot[f"{base}|{rel}"] = child.stat().st_mtime
-                    except OSError:
-                        pass
-    return snapshot
-
-def _matches_filter(name, includes, excludes):
-    """
-    Return True if 'name' matches include/exclude glob lists.
-    """
-    if includes and not any(fnmatch.fnmatch(name, pat) for pat in includes):
-        return False
-    if excludes and any(fnmatch.fnmatch(name, pat) for pat in excludes):
-        return False
-    return True
+from monitor_core import (ADAPTIVE_MAX_FACTOR, MIN_INTERVAL, EventCoalescer, PathFilter, ScanStats,
+                          ScanWorker, SlicedWorker, default_state_dir, nested_roots, normalize_roots)
+from monitor_daemon import DaemonClient, default_socket_path
+from monitor_hooks import DEFAULT_HOOK_TIMEOUT, DEFAULT_HOOK_WORKERS, HOOK_KINDS, Hook, HookRunner
+from monitor_inotify import inotify_available
+from monitor_sinks import EventLog, FileSink, JsonFormatter, handle_message, log_changes
 
-def compare_snapshots(old, new):
-    """
-    Compare two snapshots and return sets: (added, removed, modified).
-    """
-    added   = set(new) - set(old)
-    removed = set(old) - set(new)
-    modified = {k for k in set(old) & set(new) if old[k] != new[k]}
-    return added, removed, modified
+# How often (ms) the GUI drains results posted by the scan worker
+POLL_DRAIN_MS = 100
+
+# Scan time (ms) per tick of the time-sliced backend, between which Tk runs
+SLICE_BUDGET_MS = 20
+
+# Upper bound for the "Scan threads" setting
+MAX_SCAN_WORKERS = 32
+
+# The log view is redrawn at most this often (ms) and keeps this many lines
+LOG_FLUSH_MS = 200
+MAX_LOG_LINES = 5000
+
+# Upper bound for the "Hook threads" setting
+MAX_HOOK_WORKERS = 16
+
+# Seconds to wait on exit for the worker to finish saving its state
+STOP_TIMEOUT = 10
 
 class TextLoggerHandler(logging.Handler):
     """
     Custom logging handler that writes log records to a Tkinter Text widget.
+
+    Records are buffered and appended in one batch every LOG_FLUSH_MS, and
+    the widget keeps only the latest 'max_lines' lines. Lines that leave
+    the view are counted in 'dropped_var' (a tk.StringVar), if given; other
+    handlers such as the log file still receive every record.
     """
-    def __init__(self, text_widget):
+    def __init__(self, text_widget, dropped_var=None, max_lines=MAX_LOG_LINES):
         super().__init__()
         self.text = text_widget
         self.text.configure(state='disabled')
+        self.dropped_var = dropped_var
+        self.max_lines = max_lines
+        self.dropped = 0
+        self._pending = deque(maxlen=max_lines)
+        self._received = 0
+        self._flush_job = None
 
     def emit(self, record):
-        msg = self.format(record)
-        def append():
+        self._pending.append(self.format(record))
+        self._received += 1
+        if self._flush_job is None:
+            self._flush_job = self.text.after(LOG_FLUSH_MS, self._flush)
+
+    def _flush(self):
+        self._flush_job = None
+        lines = list(self._pending)
+        self._pending.clear()
+        # Records pushed out of the buffer before they were ever shown
+        self.dropped += self._received - len(lines)
+        self._received = 0
+        if lines:
             self.text.configure(state='normal')
-            self.text.insert(tk.END, msg + '\n')
+            self.text.insert(tk.END, '\n'.join(lines) + '\n')
+            excess = int(self.text.index('end-1c').split('.')[0]) - 1 - self.max_lines
+            if excess > 0:
+                self.text.delete('1.0', f'{excess + 1}.0')
+                self.dropped += excess
             self.text.see(tk.END)
             self.text.configure(state='disabled')
-        self.text.after(0, append)
+        if self.dropped and self.dropped_var is not None:
+            self.dropped_var.set(f"{self.dropped} events dropped from view")
+
+    def close(self):
+        if self._flush_job is not None:
+            self.text.after_cancel(self._flush_job)
+            self._flush()
+        super().close()
 
 class DirectoryMonitorApp(tk.Tk):
     def __init__(self):
@@ -104,13 +118,28 @@ class DirectoryMonitorApp(tk.Tk):
         self.geometry("800x600")
         self._init_state()
         self._build_ui()
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
 
     def _init_state(self):
         self.watch_paths = []
+        self.roots = []   # watch_paths resolved and deduplicated at Start
+        self.limits = {}  # folder -> (min, max) interval, None for the default
         self.includes = []
         self.excludes = []
-        self.snapshot = {}
+        self.path_filter = PathFilter()
+        self.hooks = []
+        self.hook_runner = None
+        self.worker = None
+        self.coalescer = None
+        self.event_log = None
+        self.results = queue.Queue()
         self.poll_job = None
+        self.log_seconds = 0.0  # spent logging changes since the last poll's stats
+        # What _do_poll() does with the worker's messages besides logging them
+        self.handlers = {'changes': self._on_changes, 'stats': self._show_stats,
+                         'profile': self._show_profile, 'hooks': self._show_hook_stats,
+                         'attached': lambda hello: self.var_status.set("Attached to the daemon"),
+                         'detached': lambda reason: self.var_status.set("Detached")}
 
     def _build_ui(self):
         # Watch list frame
@@ -124,6 +153,7 @@ class DirectoryMonitorApp(tk.Tk):
         frame_path_buttons.pack(side='right', padx=5)
         ttk.Button(frame_path_buttons, text="Add...", command=self._add_folder).pack(fill='x', pady=2)
         ttk.Button(frame_path_buttons, text="Remove", command=self._remove_folder).pack(fill='x')
+        ttk.Button(frame_path_buttons, text="Interval...", command=self._set_folder_interval).pack(fill='x', pady=2)
 
         # Settings frame
         frame_settings = ttk.LabelFrame(self, text="Settings")
@@ -132,16 +162,55 @@ class DirectoryMonitorApp(tk.Tk):
         self.var_interval = tk.DoubleVar(value=5.0)
         self.var_recursive = tk.BooleanVar()
         self.var_hidden = tk.BooleanVar()
+        self.var_backend = tk.StringVar(value='poll')
+        self.var_structure = tk.BooleanVar()
+        self.var_workers = tk.IntVar(value=1)
+        self.var_persist = tk.BooleanVar(value=True)
+        self.var_adaptive = tk.BooleanVar()
+        self.var_window = tk.DoubleVar(value=0.0)
+        self.var_verify = tk.BooleanVar()
+        self.var_large = tk.BooleanVar()
 
         ttk.Label(frame_settings, text="Interval (s):").grid(row=0, column=0, sticky='w', padx=5, pady=2)
         ttk.Entry(frame_settings, textvariable=self.var_interval, width=8).grid(row=0, column=1, pady=2)
         ttk.Checkbutton(frame_settings, text="Recursive", variable=self.var_recursive).grid(row=0, column=2, padx=20)
         ttk.Checkbutton(frame_settings, text="Include Hidden", variable=self.var_hidden).grid(row=0, column=3)
 
+        ttk.Label(frame_settings, text="Backend:").grid(row=1, column=0, sticky='w', padx=5, pady=2)
+        ttk.Radiobutton(frame_settings, text="Polling", value='poll',
+                        variable=self.var_backend).grid(row=1, column=1, sticky='w')
+        ttk.Radiobutton(frame_settings, text="inotify (Linux)", value='inotify', variable=self.var_backend,
+                        state='normal' if inotify_available() else 'disabled').grid(row=1, column=2, sticky='w', padx=20)
+        ttk.Radiobutton(frame_settings, text="Time-sliced (no threads)", value='sliced',
+                        variable=self.var_backend).grid(row=1, column=3, sticky='w')
+        ttk.Checkbutton(frame_settings, text="Structure only (skip file stats in unchanged folders)",
+                        variable=self.var_structure).grid(row=2, column=0, columnspan=4, sticky='w', padx=5, pady=2)
+        ttk.Label(frame_settings, text="Scan threads:").grid(row=3, column=0, sticky='w', padx=5, pady=2)
+        tk.Spinbox(frame_settings, from_=1, to=MAX_SCAN_WORKERS, textvariable=self.var_workers,
+                   width=6).grid(row=3, column=1, pady=2)
+        ttk.Checkbutton(frame_settings, text="Remember state (report changes made while stopped)",
+                        variable=self.var_persist).grid(row=3, column=2, columnspan=2, sticky='w', padx=20)
+        ttk.Checkbutton(frame_settings, text="Adaptive interval (poll quiet folders less often, "
+                        f"up to {ADAPTIVE_MAX_FACTOR}x the interval)",
+                        variable=self.var_adaptive).grid(row=4, column=0, columnspan=4, sticky='w', padx=5, pady=2)
+        ttk.Label(frame_settings, text="Quiet window (s):").grid(row=5, column=0, sticky='w', padx=5, pady=2)
+        ttk.Entry(frame_settings, textvariable=self.var_window, width=8).grid(row=5, column=1, pady=2)
+        ttk.Label(frame_settings, text="merge each path's events until it has been quiet this long (0: log at once)"
+                  ).grid(row=5, column=2, columnspan=2, sticky='w', padx=20)
+        ttk.Checkbutton(frame_settings, text="Verify content (hash modified files, ignore touches "
+                        "that leave them unchanged)",
+                        variable=self.var_verify).grid(row=6, column=0, columnspan=4, sticky='w', padx=5, pady=2)
+        ttk.Checkbutton(frame_settings, text="Large folders (non-recursive, 10,000+ files: only stat new "
+                        "and recently written ones; misses in-place rewrites of older files)",
+                        variable=self.var_large).grid(row=7, column=0, columnspan=4, sticky='w', padx=5, pady=2)
+
         # Filters frame
         frame_filters = ttk.LabelFrame(self, text="Advanced Filters (glob)")
         frame_filters.pack(fill='x', padx=10, pady=5)
         ttk.Button(frame_filters, text="Manage Filters...", command=self._open_filters_window).pack(padx=5, pady=5)
+        self.var_hook_workers = tk.IntVar(value=DEFAULT_HOOK_WORKERS)
+        self.var_hook_timeout = tk.DoubleVar(value=DEFAULT_HOOK_TIMEOUT)
+        self.var_hook_policy = tk.StringVar(value='drop-oldest')
 
         # Log file frame
         frame_log = ttk.Frame(self)
@@ -150,6 +219,48 @@ class DirectoryMonitorApp(tk.Tk):
         self.entry_log = ttk.Entry(frame_log)
         self.entry_log.pack(side='left', fill='x', expand=True, padx=5)
         ttk.Button(frame_log, text="Browse...", command=self._choose_log_file).pack(side='left', padx=5)
+        ttk.Label(frame_log, text="Rotate at (MB):").pack(side='left', padx=5)
+        self.var_rotate = tk.DoubleVar(value=0.0)
+        ttk.Entry(frame_log, textvariable=self.var_rotate, width=6).pack(side='left')
+
+        # JSON events file frame
+        frame_json = ttk.Frame(self)
+        frame_json.pack(fill='x', padx=10, pady=5)
+        ttk.Label(frame_json, text="JSON Events:").pack(side='left', padx=5)
+        self.entry_json = ttk.Entry(frame_json)
+        self.entry_json.pack(side='left', fill='x', expand=True, padx=5)
+        ttk.Button(frame_json, text="Browse...", command=self._choose_json_file).pack(side='left', padx=5)
+
+        # Metrics file frame
+        frame_metrics = ttk.Frame(self)
+        frame_metrics.pack(fill='x', padx=10, pady=5)
+        ttk.Label(frame_metrics, text="Metrics File:").pack(side='left', padx=5)
+        self.entry_metrics = ttk.Entry(frame_metrics)
+        self.entry_metrics.pack(side='left', fill='x', expand=True, padx=5)
+        ttk.Button(frame_metrics, text="Browse...", command=self._choose_metrics_file).pack(side='left', padx=5)
+
+        # Event history frame
+        frame_history = ttk.Frame(self)
+        frame_history.pack(fill='x', padx=10, pady=5)
+        ttk.Label(frame_history, text="History DB:").pack(side='left', padx=5)
+        self.entry_history = ttk.Entry(frame_history)
+        self.entry_history.pack(side='left', fill='x', expand=True, padx=5)
+        ttk.Button(frame_history, text="Browse...", command=self._choose_history_file).pack(side='left', padx=5)
+        ttk.Label(frame_history, text="Keep (days):").pack(side='left', padx=5)
+        self.var_history_days = tk.DoubleVar(value=30.0)
+        ttk.Entry(frame_history, textvariable=self.var_history_days, width=6).pack(side='left')
+        ttk.Button(frame_history, text="Query...", command=self._open_history_window).pack(side='left', padx=5)
+
+        # Scanner daemon frame
+        frame_daemon = ttk.Frame(self)
+        frame_daemon.pack(fill='x', padx=10, pady=5)
+        self.var_attach = tk.BooleanVar()
+        ttk.Checkbutton(frame_daemon, text="Attach to daemon (it scans, this window only shows events):",
+                        variable=self.var_attach,
+                        state='normal' if hasattr(socket, 'AF_UNIX') else 'disabled').pack(side='left', padx=5)
+        self.entry_socket = ttk.Entry(frame_daemon)
+        self.entry_socket.insert(0, default_socket_path())
+        self.entry_socket.pack(side='left', fill='x', expand=True, padx=5)
 
         # Control buttons
         frame_controls = ttk.Frame(self)
@@ -158,8 +269,18 @@ class DirectoryMonitorApp(tk.Tk):
         self.btn_start.pack(side='left', padx=5)
         self.btn_stop = ttk.Button(frame_controls, text="Stop Monitoring", command=self._stop_monitor, state='disabled')
         self.btn_stop.pack(side='left')
-
-        # Log view
+        self.btn_profile = ttk.Button(frame_controls, text="Profile Next Poll...",
+                                      command=self._profile_poll, state='disabled')
+        self.btn_profile.pack(side='right', padx=5)
+
+        # Status bar and log view
+        self.var_status = tk.StringVar(value="Idle")
+        ttk.Label(self, textvariable=self.var_status, relief='sunken',
+                  anchor='w').pack(side='bottom', fill='x')
+        self.var_hook_status = tk.StringVar()
+        ttk.Label(self, textvariable=self.var_hook_status, anchor='w').pack(side='bottom', fill='x')
+        self.var_dropped = tk.StringVar()
+        ttk.Label(self, textvariable=self.var_dropped).pack(side='bottom', anchor='w', padx=10)
         self.text_log = scrolledtext.ScrolledText(self, height=15)
         self.text_log.pack(fill='both', expand=True, padx=10, pady=5)
 
@@ -175,9 +296,50 @@ class DirectoryMonitorApp(tk.Tk):
         selection = self.list_paths.curselection()
         if selection:
             idx = selection[0]
-            self.watch_paths.pop(idx)
+            self.limits.pop(self.watch_paths.pop(idx), None)
             self.list_paths.delete(idx)
 
+    def _set_folder_interval(self):
+        """Ask for the selected folder's own min/max interval (adaptive mode)."""
+        selection = self.list_paths.curselection()
+        if not selection:
+            messagebox.showinfo("Interval", "Select a folder first.")
+            return
+        idx = selection[0]
+        path = self.watch_paths[idx]
+        current = ",".join("" if v is None else f"{v:g}" for v in self.limits.get(path, ()))
+        answer = simpledialog.askstring(
+            "Folder Interval",
+            "Min,max seconds between polls of this folder in adaptive mode\n"
+            "(leave a value empty for the default):",
+            initialvalue=current)
+        if answer is None:
+            return
+        try:
+            values = [float(v) if v.strip() else None for v in (answer.split(",") + [""])[:2]]
+            if any(v is not None and not v >= MIN_INTERVAL for v in values):
+                raise ValueError(answer)
+        except ValueError:
+            messagebox.showwarning("Warning", f"Enter two numbers of seconds (at least {MIN_INTERVAL:g}) "
+                                   "separated by a comma.")
+            return
+        if values == [None, None]:
+            self.limits.pop(path, None)
+        else:
+            self.limits[path] = tuple(values)
+        # The list is disabled while monitoring, which also blocks edits
+        state = self.list_paths.cget('state')
+        self.list_paths.configure(state='normal')
+        self.list_paths.delete(idx)
+        self.list_paths.insert(idx, self._folder_label(path))
+        self.list_paths.configure(state=state)
+
+    def _folder_label(self, path):
+        if path not in self.limits:
+            return str(path)
+        low, high = ("default" if v is None else f"{v:g}s" for v in self.limits[path])
+        return f"{path}   [{low} – {high}]"
+
     def _choose_log_file(self):
         filename = filedialog.asksaveasfilename(
             title="Log File",
@@ -188,13 +350,148 @@ class DirectoryMonitorApp(tk.Tk):
             self.entry_log.delete(0, tk.END)
             self.entry_log.insert(0, filename)
 
+    def _choose_json_file(self):
+        filename = filedialog.asksaveasfilename(
+            title="JSON Events File",
+            defaultextension=".jsonl",
+            filetypes=[("JSON lines", "*.jsonl"), ("All files", "*.*")]
+        )
+        if filename:
+            self.entry_json.delete(0, tk.END)
+            self.entry_json.insert(0, filename)
+
+    def _choose_metrics_file(self):
+        filename = filedialog.asksaveasfilename(
+            title="Metrics File",
+            defaultextension=".prom",
+            filetypes=[("Prometheus text", "*.prom"), ("JSON lines", "*.jsonl"), ("All files", "*.*")]
+        )
+        if filename:
+            self.entry_metrics.delete(0, tk.END)
+            self.entry_metrics.insert(0, filename)
+
+    def _choose_history_file(self):
+        filename = filedialog.asksaveasfilename(
+            title="Event History Database",
+            defaultextension=".db",
+            filetypes=[("SQLite database", "*.db"), ("All files", "*.*")]
+        )
+        if filename:
+            self.entry_history.delete(0, tk.END)
+            self.entry_history.insert(0, filename)
+
+    def _open_history_window(self):
+        """Search the event history; works while monitoring, which keeps writing to it."""
+        try:
+            from monitor_history import (DEFAULT_QUERY_LIMIT, HISTORY_KINDS, event_path, event_time,
+                                         parse_time, query_history)
+        except ImportError as exc:
+            messagebox.showerror("Error", f"The event history needs the sqlite3 module:\n{exc}")
+            return
+        win = tk.Toplevel(self)
+        win.title("Event History")
+        win.geometry("900x500")
+        frame_query = ttk.Frame(win)
+        frame_query.pack(fill='x', padx=5, pady=5)
+        ttk.Label(frame_query, text="Under:").grid(row=0, column=0, sticky='w', padx=5, pady=2)
+        entry_under = ttk.Entry(frame_query, width=50)
+        entry_under.grid(row=0, column=1, columnspan=3, sticky='we', pady=2)
+        ttk.Label(frame_query, text="From:").grid(row=1, column=0, sticky='w', padx=5, pady=2)
+        entry_since = ttk.Entry(frame_query, width=20)
+        entry_since.grid(row=1, column=1, sticky='w', pady=2)
+        ttk.Label(frame_query, text="To:").grid(row=1, column=2, sticky='w', padx=5, pady=2)
+        entry_until = ttk.Entry(frame_query, width=20)
+        entry_until.grid(row=1, column=3, sticky='w', pady=2)
+        var_kind = tk.StringVar(value='any')
+        ttk.Label(frame_query, text="Event:").grid(row=0, column=4, sticky='w', padx=5, pady=2)
+        ttk.Combobox(frame_query, textvariable=var_kind, values=('any',) + HISTORY_KINDS,
+                     state='readonly', width=10).grid(row=0, column=5, sticky='w', pady=2)
+        var_limit = tk.IntVar(value=DEFAULT_QUERY_LIMIT)
+        ttk.Label(frame_query, text="Limit:").grid(row=1, column=4, sticky='w', padx=5, pady=2)
+        tk.Spinbox(frame_query, from_=1, to=1000000, textvariable=var_limit,
+                   width=8).grid(row=1, column=5, sticky='w', pady=2)
+        ttk.Label(frame_query, text="Times: 2025-06-01 02:00, 02:00 (today) or 2h (ago); "
+                  "empty fields do not restrict").grid(row=2, column=0, columnspan=6, sticky='w', padx=5)
+        frame_query.columnconfigure(1, weight=1)
+        frame_query.columnconfigure(3, weight=1)
+
+        frame_rows = ttk.Frame(win)
+        frame_rows.pack(fill='both', expand=True, padx=5)
+        tree = ttk.Treeview(frame_rows, columns=('time', 'kind', 'path', 'size'), show='headings')
+        for column, title, width in (('time', "Time", 170), ('kind', "Event", 80),
+                                     ('path', "Path", 520), ('size', "Size", 90)):
+            tree.heading(column, text=title)
+            tree.column(column, width=width, stretch=column == 'path')
+        scroll = ttk.Scrollbar(frame_rows, orient='vertical', command=tree.yview)
+        tree.configure(yscrollcommand=scroll.set)
+        scroll.pack(side='right', fill='y')
+        tree.pack(side='left', fill='both', expand=True)
+        var_result = tk.StringVar()
+        ttk.Label(win, textvariable=var_result, anchor='w').pack(fill='x', padx=5, pady=2)
+
+        def search(event=None):
+            path = self.entry_history.get().strip()
+            if not path:
+                messagebox.showwarning("Warning", "No history database given.", parent=win)
+                return
+            try:
+                since, until = parse_time(entry_since.get()), parse_time(entry_until.get())
+                limit = max(int(var_limit.get()), 1)
+            except (ValueError, tk.TclError) as exc:
+                messagebox.showwarning("Warning", str(exc), parent=win)
+                return
+            kind = var_kind.get()
+            start = time.perf_counter()
+            try:
+                events = query_history(path, since, until, entry_under.get().strip() or None,
+                                       None if kind == 'any' else [kind], limit)
+            except OSError as exc:
+                messagebox.showerror("Error", f"Cannot read the history:\n{exc}", parent=win)
+                return
+            elapsed = time.perf_counter() - start
+            tree.delete(*tree.get_children())
+            for event in events:
+                tree.insert('', tk.END, values=(event_time(event), event['kind'], event_path(event),
+                                                 '' if event['size'] is None else event['size']))
+            var_result.set(f"{len(events)} events in {elapsed * 1000:.0f} ms"
+                           + (" (limit reached)" if len(events) >= limit else ""))
+
+        ttk.Button(frame_query, text="Search", command=search).grid(row=0, column=6, rowspan=2, padx=10)
+        for entry in (entry_under, entry_since, entry_until):
+            entry.bind('<Return>', search)
+
+    def _profile_poll(self):
+        filename = filedialog.asksaveasfilename(
+            title="Save Profile",
+            defaultextension=".prof",
+            filetypes=[("cProfile stats", "*.prof"), ("All files", "*.*")]
+        )
+        if filename and self.worker:
+            self.worker.profile_path = filename
+            logging.info(f"Profiling the next poll into {filename}")
+
+    def _show_profile(self, path):
+        import io
+        import pstats
+        out = io.StringIO()
+        pstats.Stats(path, stream=out).sort_stats('cumulative').print_stats(30)
+        win = tk.Toplevel(self)
+        win.title(f"Profile – {os.path.basename(path)}")
+        win.geometry("800x500")
+        text = scrolledtext.ScrolledText(win, wrap='none', font='TkFixedFont')
+        text.pack(fill='both', expand=True)
+        text.insert('1.0', out.getvalue())
+        text.configure(state='disabled')
+
     def _open_filters_window(self):
         win = tk.Toplevel(self)
         win.title("Advanced Filters")
-        win.geometry("450x300")
+        win.geometry("600x520")
+        frame_globs = ttk.Frame(win)
+        frame_globs.pack(fill='both', expand=True)
 
         # Include patterns
-        frame_inc = ttk.LabelFrame(win, text="Include Patterns")
+        frame_inc = ttk.LabelFrame(frame_globs, text="Include Patterns")
         frame_inc.pack(side='left', fill='both', expand=True, padx=5, pady=5)
         list_inc = tk.Listbox(frame_inc)
         list_inc.pack(fill='both', expand=True, padx=5, pady=5)
@@ -208,7 +505,7 @@ class DirectoryMonitorApp(tk.Tk):
                    command=lambda: self._remove_pattern(list_inc, self.includes)).pack(side='left')
 
         # Exclude patterns
-        frame_exc = ttk.LabelFrame(win, text="Exclude Patterns")
+        frame_exc = ttk.LabelFrame(frame_globs, text="Exclude Patterns")
         frame_exc.pack(side='right', fill='both', expand=True, padx=5, pady=5)
         list_exc = tk.Listbox(frame_exc)
         list_exc.pack(fill='both', expand=True, padx=5, pady=5)
@@ -221,11 +518,71 @@ class DirectoryMonitorApp(tk.Tk):
         ttk.Button(btn_exc, text="–", width=3,
                    command=lambda: self._remove_pattern(list_exc, self.excludes)).pack(side='left')
 
+        # Action hooks
+        frame_hooks = ttk.LabelFrame(win, text="Action Hooks (event, path glob → command)")
+        frame_hooks.pack(fill='both', expand=True, padx=5, pady=5)
+        list_hooks = tk.Listbox(frame_hooks, height=5)
+        list_hooks.pack(fill='both', expand=True, padx=5, pady=5)
+        for hook in self.hooks:
+            list_hooks.insert(tk.END, str(hook))
+        btn_hooks = ttk.Frame(frame_hooks)
+        btn_hooks.pack(fill='x', padx=5, pady=5)
+        ttk.Button(btn_hooks, text="+", width=3,
+                   command=lambda: self._add_hook(list_hooks)).pack(side='left')
+        ttk.Button(btn_hooks, text="–", width=3,
+                   command=lambda: self._remove_pattern(list_hooks, self.hooks)).pack(side='left')
+        ttk.Label(btn_hooks, text="Threads:").pack(side='left', padx=(15, 2))
+        tk.Spinbox(btn_hooks, from_=1, to=MAX_HOOK_WORKERS, textvariable=self.var_hook_workers,
+                   width=4).pack(side='left')
+        ttk.Label(btn_hooks, text="Timeout (s):").pack(side='left', padx=(10, 2))
+        ttk.Entry(btn_hooks, textvariable=self.var_hook_timeout, width=6).pack(side='left')
+        ttk.Label(btn_hooks, text="When 1000 queued:").pack(side='left', padx=(10, 2))
+        ttk.Combobox(btn_hooks, textvariable=self.var_hook_policy, values=('drop-oldest', 'drop-new'),
+                     state='readonly', width=11).pack(side='left')
+
+    def _add_hook(self, listbox):
+        """Ask for a hook's event kind, glob and command."""
+        dialog = tk.Toplevel(listbox.winfo_toplevel())
+        dialog.title("New Action Hook")
+        dialog.transient(listbox.winfo_toplevel())
+        var_kind = tk.StringVar(value='any')
+        ttk.Label(dialog, text="Event:").grid(row=0, column=0, sticky='w', padx=5, pady=2)
+        ttk.Combobox(dialog, textvariable=var_kind, values=HOOK_KINDS, state='readonly',
+                     width=10).grid(row=0, column=1, sticky='w', padx=5, pady=2)
+        ttk.Label(dialog, text="Path glob:").grid(row=1, column=0, sticky='w', padx=5, pady=2)
+        entry_pattern = ttk.Entry(dialog, width=40)
+        entry_pattern.grid(row=1, column=1, sticky='we', padx=5, pady=2)
+        ttk.Label(dialog, text="Command:").grid(row=2, column=0, sticky='w', padx=5, pady=2)
+        entry_command = ttk.Entry(dialog, width=40)
+        entry_command.grid(row=2, column=1, sticky='we', padx=5, pady=2)
+        ttk.Label(dialog, text="The command gets $DIRMON_KIND, $DIRMON_ROOT, $DIRMON_PATH,\n"
+                  "$DIRMON_FULLPATH and, for moves, $DIRMON_FROM_ROOT and $DIRMON_FROM."
+                  ).grid(row=3, column=0, columnspan=2, sticky='w', padx=5, pady=5)
+
+        def add():
+            pattern = entry_pattern.get().strip()
+            command = entry_command.get().strip()
+            if not pattern or not command:
+                messagebox.showwarning("Warning", "Enter a path glob and a command.", parent=dialog)
+                return
+            hook = Hook(var_kind.get(), pattern, command)
+            self.hooks.append(hook)
+            listbox.insert(tk.END, str(hook))
+            dialog.destroy()
+
+        frame_buttons = ttk.Frame(dialog)
+        frame_buttons.grid(row=4, column=0, columnspan=2, pady=5)
+        ttk.Button(frame_buttons, text="Add", command=add).pack(side='left', padx=5)
+        ttk.Button(frame_buttons, text="Cancel", command=dialog.destroy).pack(side='left')
+        entry_pattern.focus_set()
+        dialog.grab_set()
+
     def _add_pattern(self, listbox, target):
         pat = simpledialog.askstring("New Pattern", "Enter glob pattern:")
         if pat and pat not in target:
             target.append(pat)
             listbox.insert(tk.END, pat)
+            self._rebuild_filter()
 
     def _remove_pattern(self, listbox, target):
         sel = listbox.curselection()
@@ -233,35 +590,85 @@ class DirectoryMonitorApp(tk.Tk):
             i = sel[0]
             target.pop(i)
             listbox.delete(i)
+            self._rebuild_filter()
+
+    def _rebuild_filter(self):
+        """Compile the glob lists; only done when they change."""
+        self.path_filter = PathFilter(self.includes, self.excludes)
 
     def _start_monitor(self):
-        if not self.watch_paths:
+        attach = self.var_attach.get()
+        socket_path = self.entry_socket.get().strip()
+        if attach and not socket_path:
+            messagebox.showwarning("Warning", "No daemon socket given.")
+            return
+        if not attach and not self.watch_paths:
             messagebox.showwarning("Warning", "No folders selected.")
             return
         logfile = self.entry_log.get().strip() or None
-
-        handlers = [TextLoggerHandler(self.text_log)]
-        if logfile:
-            handlers.append(logging.FileHandler(logfile, encoding='utf-8'))
-        logging.basicConfig(
-            level=logging.INFO,
-            format="%(asctime)s %(levelname)-8s %(message)s",
-            handlers=handlers
-        )
+        jsonfile = self.entry_json.get().strip() or None
+        history = self.entry_history.get().strip() or None
+        metrics = self.entry_metrics.get().strip() or None
+        try:
+            max_bytes = int(max(float(self.var_rotate.get()), 0.0) * 1024 * 1024)
+        except (tk.TclError, ValueError):
+            max_bytes = 0
+
+        # Files are written by a background thread; a fresh set each session
+        sinks = []
+        try:
+            if logfile:
+                sinks.append(FileSink(logfile, max_bytes))
+            if jsonfile:
+                sinks.append(FileSink(jsonfile, max_bytes, formatter=JsonFormatter()))
+            if history:
+                # sqlite3 is only loaded when there is a history to keep
+                from monitor_history import HistorySink
+                sinks.append(HistorySink(history, self._history_days()))
+        except (OSError, ImportError) as exc:
+            for sink in sinks:
+                sink.close()
+            messagebox.showerror("Error", f"Cannot open output file:\n{exc}")
+            return
+        self.event_log = EventLog([TextLoggerHandler(self.text_log, self.var_dropped)], sinks).start()
         logging.info("=== Monitoring Started ===")
-
-        self.snapshot = scan_directories(
-            self.watch_paths,
-            self.var_recursive.get(),
-            self.var_hidden.get(),
-            self.includes,
-            self.excludes
-        )
+        self.roots, dropped = normalize_roots(self.watch_paths)
+        if not attach:
+            for path, same in dropped:
+                logging.warning(f"{path} is the same folder as {same}, watching it once")
+            for inner, outer in nested_roots(self.roots).items():
+                logging.info(f"{inner} is inside {outer}: its changes are reported under {inner}")
+
+        # Baseline scan and polling both run on the worker thread, or in
+        # slices on this one with the time-sliced backend (see _do_poll);
+        # attached, the daemon scans with its own settings and folders
+        options = dict(structure_only=self.var_structure.get(),
+                       large_dirs=self.var_large.get(),
+                       verify_content=self.var_verify.get(),
+                       state_dir=default_state_dir() if self.var_persist.get() else None,
+                       metrics_path=metrics)
+        if attach:
+            self.worker = DaemonClient(socket_path, self.results)
+        elif self.var_backend.get() == 'sliced':
+            self.worker = SlicedWorker(self._scan_params(), self._interval(), self.results, **options)
+        else:
+            self.worker = ScanWorker(self._scan_params(), self._interval(), self.results,
+                                     backend=self.var_backend.get(),
+                                     workers=self._workers(),
+                                     adaptive=self.var_adaptive.get(),
+                                     limits=dict(self.limits), **options)
+        self.worker.start()
+        self.coalescer = EventCoalescer(self._window())
+        self._sync_hooks()
+        self.var_hook_status.set("")
+        self.log_seconds = 0.0
+        self.var_status.set("Attaching..." if attach else "Scanning...")
 
         # Disable controls
         self.list_paths.configure(state='disabled')
         self.btn_start.configure(state='disabled')
         self.btn_stop.configure(state='normal')
+        self.btn_profile.configure(state='disabled' if attach else 'normal')
 
         self._schedule_poll()
 
@@ -269,39 +676,172 @@ class DirectoryMonitorApp(tk.Tk):
         if self.poll_job:
             self.after_cancel(self.poll_job)
             self.poll_job = None
+        if self.coalescer is not None:
+            # Events still waiting for their quiet window are logged now
+            self._log_changes(self.coalescer.flush())
+            self.coalescer = None
+        if self.worker:
+            self.worker.stop()
+            self.worker = None
+        if self.hook_runner:
+            # Jobs already queued still run, on the runner's own threads
+            for message in self.hook_runner.failures():
+                logging.warning(message)
+            self.hook_runner.stop()
+            self.hook_runner = None
         logging.info("=== Monitoring Stopped ===")
+        if self.event_log:
+            # Writes out what the sinks still hold and closes the files
+            self.event_log.stop()
+            self.event_log = None
 
         # Re-enable controls
         self.list_paths.configure(state='normal')
         self.btn_start.configure(state='normal')
         self.btn_stop.configure(state='disabled')
-
-    def _schedule_poll(self):
-        ms = int(self.var_interval.get() * 1000)
-        self.poll_job = self.after(ms, self._do_poll)
-
-    def _do_poll(self):
-        new_snap = scan_directories(
-            self.watch_paths,
+        self.btn_profile.configure(state='disabled')
+
+    def _on_close(self):
+        # Give the worker a moment to save its state before the process exits
+        worker = self.worker
+        if worker:
+            self._stop_monitor()
+            worker.join(timeout=STOP_TIMEOUT)
+        self.destroy()
+
+    def _scan_params(self):
+        """Copy the current settings for use on the worker thread."""
+        return (
+            list(self.roots),
             self.var_recursive.get(),
             self.var_hidden.get(),
-            self.includes,
-            self.excludes
+            self.path_filter
         )
-        added, removed, modified = compare_snapshots(self.snapshot, new_snap)
-
-        for key in sorted(added):
-            base, rel = key.split("|", 1)
-            logging.info(f"[{base}] +Added   : {rel}")
-        for key in sorted(removed):
-            base, rel = key.split("|", 1)
-            logging.info(f"[{base}] -Removed : {rel}")
-        for key in sorted(modified):
-            base, rel = key.split("|", 1)
-            logging.info(f"[{base}] *Modified: {rel}")
-
-        self.snapshot = new_snap
-        self._schedule_poll()
+
+    def _interval(self):
+        try:
+            interval = float(self.var_interval.get())
+            if not interval >= MIN_INTERVAL:
+                raise ValueError(interval)
+            return interval
+        except (tk.TclError, ValueError):
+            return self.worker.interval if self.worker else 5.0
+
+    def _window(self):
+        try:
+            return max(float(self.var_window.get()), 0.0)
+        except (tk.TclError, ValueError):
+            return self.coalescer.window if self.coalescer is not None else 0.0
+
+    def _workers(self):
+        try:
+            return min(max(int(self.var_workers.get()), 1), MAX_SCAN_WORKERS)
+        except (tk.TclError, ValueError):
+            return self.worker.workers if self.worker else 1
+
+    def _history_days(self):
+        try:
+            return max(float(self.var_history_days.get()), 0.0)
+        except (tk.TclError, ValueError):
+            return 30.0
+
+    def _hook_workers(self):
+        try:
+            return min(max(int(self.var_hook_workers.get()), 1), MAX_HOOK_WORKERS)
+        except (tk.TclError, ValueError):
+            return DEFAULT_HOOK_WORKERS
+
+    def _hook_timeout(self):
+        try:
+            return max(float(self.var_hook_timeout.get()), 0.0)
+        except (tk.TclError, ValueError):
+            return DEFAULT_HOOK_TIMEOUT
+
+    def _sync_hooks(self):
+        """Hand the hook list to the runner, starting one when the first hook appears."""
+        if self.hook_runner is None:
+            if not self.hooks:
+                return
+            self.hook_runner = HookRunner(self.hooks, self._hook_workers(), self._hook_timeout(),
+                                          policy=self.var_hook_policy.get()).start()
+            self.worker.hooks = self.hook_runner
+        self.hook_runner.hooks = list(self.hooks)
+        self.hook_runner.timeout = self._hook_timeout() or None
+        for message in self.hook_runner.failures():
+            logging.warning(message)
+
+    def _schedule_poll(self, delay=POLL_DRAIN_MS):
+        self.poll_job = self.after(delay, self._do_poll)
+
+    def _do_poll(self):
+        delay = POLL_DRAIN_MS
+        if isinstance(self.worker, SlicedWorker):
+            # One slice of the scan, then back to Tk; come again at once while scanning
+            wait = self.worker.step(SLICE_BUDGET_MS / 1000)
+            if self.worker.scanning:
+                delay = 1
+                progress = self.worker.progress()
+                self.var_status.set(f"Scanning... {progress:.0%}" if progress is not None else
+                                    f"Scanning... {self.worker.visited()} folders")
+            elif wait is not None:
+                delay = min(max(int(wait * 1000), 1), POLL_DRAIN_MS)
+        # Drain everything the worker posted since the last tick
+        while True:
+            try:
+                worker, kind, payload = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if worker is not self.worker:
+                continue  # left over from a stopped session
+            handle_message(kind, payload, self.handlers)
+        self.coalescer.window = self._window()
+        if self.coalescer:  # events held back
+            start = time.perf_counter()
+            self._log_changes(self.coalescer.settled())
+            self.log_seconds += time.perf_counter() - start
+
+        # Settings may change while monitoring; the worker picks them up next cycle
+        self.worker.params = self._scan_params()
+        self.worker.interval = self._interval()
+        self.worker.structure_only = self.var_structure.get()
+        self.worker.large_dirs = self.var_large.get()
+        self.worker.verify_content = self.var_verify.get()
+        self.worker.workers = self._workers()
+        self.worker.adaptive = self.var_adaptive.get()
+        self.worker.limits = dict(self.limits)
+        self._sync_hooks()
+        self._schedule_poll(delay)
+
+    def _on_changes(self, changes):
+        if self.coalescer.window > 0:
+            self.coalescer.add(changes)
+        else:
+            start = time.perf_counter()
+            self._log_changes(changes)
+            self.log_seconds += time.perf_counter() - start
+
+    def _show_stats(self, payload):
+        """Put the totals of one poll, ({base: ScanStats}, seconds), in the status bar."""
+        stats, duration = payload
+        total = ScanStats.total(stats.values())
+        self.var_status.set(
+            f"Last poll {duration * 1000:.0f} ms (scan {total.scan_s * 1000:.0f}, "
+            f"diff {total.diff_s * 1000:.0f}, log {self.log_seconds * 1000:.0f}) | "
+            f"{total.visited} entries, {total.filtered} filtered, "
+            f"{total.stat_errors} stat errors | {total.events} events")
+        self.log_seconds = 0.0
+
+    def _show_hook_stats(self, metrics):
+        totals = metrics['totals']
+        self.var_hook_status.set(
+            f"Hooks: {metrics['queued']} queued, {metrics['running']} running | latency "
+            f"avg {metrics['latency_avg_s'] * 1000:.0f} ms, max {metrics['latency_max_s'] * 1000:.0f} ms | "
+            f"{totals['ok']} ok, {totals['failed']} failed, {totals['timeout']} timed out, "
+            f"{totals['dropped']} dropped")
+
+    def _log_changes(self, changes):
+        snapshot = self.worker.snapshot if self.worker else None
+        log_changes(changes, snapshot, self.hook_runner)
 
 def main():
     app = DirectoryMonitorApp()
@@ -7,11 +7,17 @@ Strumento GUI per monitorare directory via polling, interamente in Python
 (standard library only). Interfaccia basata su tkinter:
 
   • aggiungi/rimuovi più directory
-  • intervallo di polling configurabile
+  • intervallo di polling configurabile, anche adattivo per cartella
   • scansione ricorsiva opzionale
   • includi/escludi file e cartelle nascosti
   • filtri avanzati (glob include/exclude)
-  • log in tempo reale in finestra e su file
+  • azioni (hook) che eseguono un comando sugli eventi corrispondenti, in thread dedicati
+  • log in tempo reale in finestra, su file e come eventi JSON lines,
+    scritti da un thread in background con rotazione per dimensione
+  • raffiche di eventi su un percorso unite in uno dopo una finestra di quiete
+  • tempi di ogni poll nella barra di stato, file di metriche opzionale
+  • storico degli eventi opzionale in SQLite, consultabile per cartella e orario
+  • collegamento a un demone di scansione condiviso invece di scansionare (monitor_cli.py --serve)
   • controlli Start/Stop per avviare o interrompere il monitor
 
 Compatibile con Python 3.6+ senza dipendenze esterne.
@@ -20,80 +26,109 @@ Compatibile con Python 3.6+ senza dipendenze esterne.
 import os
 import sys
 import time
-import fnmatch
+import queue
+import socket
 import logging
+from collections import deque
 from pathlib import Path
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
 
-# -- Funzioni di scansione e confronto ----------------------------------------
-
-def scan_dirs(bases, recursive, include_hidden, includes, excludes):
-    """
-    Scansiona le cartelle in 'bases' e restituisce uno snapshot dict:
-      { "base|relative_path": mtime }
-    Applica opzioni: recursive, hidden, include/exclude glob.
-    """
-    snap = {}
-    for base in bases:
-        base = Path(base).resolve()
-        if recursive:
-            for root, dirs, files in os.walk(base):
-                if not include_hidden:
-                    dirs[:]  = [d for d in dirs  if not d.startswith('.')]
-                    files[:] = [f for f in files if not f.startswith('.')]
-                for name in dirs + files:
-                    full = Path(root) / name
-                    rel = full.relative_to(base).as_posix() + ('/' if full.is_dir() else '')
-                    if _match_filter(rel, includes, excludes):
-                        try:
-                            snap[f"{base}|{rel}"] = full.stat().st_mtime
-                        except OSError:
-                            pass
-        else:
-            for child in base.iterdir():
-                if not include_hidden and child.name.startswith('.'):
-                    continue
-                rel = child.name + ('/' if child.is_dir() else '')
-                if _match_filter(rel, includes, excludes):
-                    try:
-                        snap[f"{base}|{rel}"] = child.stat().st_mtime
-                    except OSError:
-                        pass
-    return snap
-
-def _match_filter(name, includes, excludes):
-    """Ritorna True se 'name' passa i filtri include/exclude."""
-    if includes and not any(fnmatch.fnmatch(name, p) for p in includes):
-        return False
-    if excludes and any(fnmatch.fnmatch(name, p) for p in excludes):
-        return False
-    return True
-
-def compare_snapshots(old, new):
-    """Confronta snapshot, ritorna tuple (added, removed, modified)."""
-    added   = set(new) - set(old)
-    removed = set(old) - set(new)
-    modified= {k for k in set(old)&set(new) if old[k] != new[k]}
-    return added, removed, modified
+from monitor_core import (ADAPTIVE_MAX_FACTOR, MIN_INTERVAL, EventCoalescer, PathFilter, ScanStats,
+                          ScanWorker, SlicedWorker, default_state_dir, nested_roots, normalize_roots)
+from monitor_daemon import DaemonClient, default_socket_path
+from monitor_hooks import DEFAULT_HOOK_TIMEOUT, DEFAULT_HOOK_WORKERS, HOOK_KINDS, Hook, HookRunner
+from monitor_inotify import inotify_available
+from monitor_sinks import EventLog, FileSink, JsonFormatter, handle_message, log_changes
+
+# Ogni quanti ms la GUI raccoglie i risultati del worker di scansione
+POLL_DRAIN_MS = 100
+
+# Tempo di scansione (ms) per tick del backend a intervalli, tra un tick e l'altro gira Tk
+SLICE_BUDGET_MS = 20
+
+# Limite massimo per l'impostazione "Thread di scansione"
+MAX_SCAN_WORKERS = 32
+
+# La vista del log si aggiorna al massimo ogni LOG_FLUSH_MS e tiene MAX_LOG_LINES righe
+LOG_FLUSH_MS = 200
+MAX_LOG_LINES = 5000
+
+# Limite massimo per l'impostazione "Thread" delle azioni
+MAX_HOOK_WORKERS = 16
+
+# Secondi di attesa in chiusura perché il worker salvi lo stato
+STOP_TIMEOUT = 10
+
+# Testi delle modifiche e dei messaggi del worker (vedi monitor_sinks.MESSAGES)
+ETICHETTE = {'added': "+Aggiunto FILE/DIR", 'removed': "-Rimosso  FILE/DIR",
+             'modified': "*Modificato FILE/DIR", 'moved': ">Spostato FILE/DIR"}
+MESSAGGI = {
+    'ready': (logging.INFO, "Snapshot iniziale pronto: {} voci"),
+    'restored': (logging.INFO, "Stato salvato ripristinato: {} voci, controllo le modifiche nel frattempo"),
+    'state_error': (logging.WARNING, "Impossibile salvare lo stato, proseguo senza: {}"),
+    'error': (logging.ERROR, "Scansione fallita: {}"),
+    'fallback': (logging.WARNING, "inotify non disponibile ({}), uso il polling"),
+    'watch_limit': (logging.WARNING, "limite di watch inotify raggiunto, polling su {}"),
+    'attached': (logging.INFO, "Collegato al demone (pid {pid}, {backend}, "
+                               "ogni {interval:g}s) che controlla: {roots}"),
+    'detached': (logging.ERROR, "Demone non disponibile: {}"),
+    'profile': (logging.INFO, "Profilo di un poll salvato in {}"),
+    'metrics_error': (logging.WARNING, "Impossibile scrivere le metriche: {}"),
+}
 
 # -- Handler di logging per inviare i messaggi alla Text widget -------------
 
 class TextHandler(logging.Handler):
-    """Logging handler che emette messaggi in una ScrolledText Tk."""
-    def __init__(self, text_widget):
+    """
+    Logging handler che emette messaggi in una ScrolledText Tk.
+
+    I record vengono accumulati e aggiunti in blocco ogni LOG_FLUSH_MS; la
+    finestra conserva solo le ultime 'max_lines' righe e conta quelle
+    uscite dalla vista in 'dropped_var' (tk.StringVar, opzionale). Gli
+    altri handler, come il file di log, ricevono comunque ogni record.
+    """
+    def __init__(self, text_widget, dropped_var=None, max_lines=MAX_LOG_LINES):
         super().__init__()
         self.text = text_widget
         self.text.configure(state='disabled')
+        self.dropped_var = dropped_var
+        self.max_lines = max_lines
+        self.dropped = 0
+        self._pending = deque(maxlen=max_lines)
+        self._received = 0
+        self._job = None
 
     def emit(self, record):
-        msg = self.format(record)
-        def append():
+        self._pending.append(self.format(record))
+        self._received += 1
+        if self._job is None:
+            self._job = self.text.after(LOG_FLUSH_MS, self._flush)
+
+    def _flush(self):
+        self._job = None
+        righe = list(self._pending)
+        self._pending.clear()
+        # record espulsi dal buffer prima ancora di essere mostrati
+        self.dropped += self._received - len(righe)
+        self._received = 0
+        if righe:
             self.text.configure(state='normal')
-            self.text.insert(tk.END, msg + '\n')
+            self.text.insert(tk.END, '\n'.join(righe) + '\n')
+            eccesso = int(self.text.index('end-1c').split('.')[0]) - 1 - self.max_lines
+            if eccesso > 0:
+                self.text.delete('1.0', f'{eccesso + 1}.0')
+                self.dropped += eccesso
             self.text.see(tk.END)
             self.text.configure(state='disabled')
-        self.text.after(0, append)
+        if self.dropped and self.dropped_var is not None:
+            self.dropped_var.set(f"{self.dropped} eventi usciti dalla vista")
+
+    def close(self):
+        if self._job is not None:
+            self.text.after_cancel(self._job)
+            self._flush()
+        super().close()
 
 # -- Classe principale dell'applicazione --------------------------------------
 
@@ -104,13 +139,28 @@ class MonitorApp(tk.Tk):
         self.geometry("800x600")
         self._build_ui()
         self._reset_state()
+        self.protocol("WM_DELETE_WINDOW", self._chiudi)
 
     def _reset_state(self):
         self.paths = []
+        self.roots = []   # paths risolti e senza doppioni, calcolati all'avvio
+        self.limits = {}  # cartella -> intervallo (min, max), None = predefinito
         self.includes = []
         self.excludes = []
-        self.snapshot = {}
+        self.path_filter = PathFilter()
+        self.hooks = []
+        self.hook_runner = None
+        self.worker = None
+        self.coalescer = None
+        self.event_log = None
+        self.results = queue.Queue()
         self.job = None
+        self.log_sec = 0.0  # tempo speso a registrare modifiche dalle ultime statistiche
+        # cosa fa _do_poll() con i messaggi del worker, oltre a registrarli
+        self.gestori = {'changes': self._on_changes, 'stats': self._show_stats,
+                        'profile': self._show_profile, 'hooks': self._show_hook_stats,
+                        'attached': lambda hello: self.var_status.set("Collegato al demone"),
+                        'detached': lambda motivo: self.var_status.set("Scollegato")}
 
     def _build_ui(self):
         # Frame directory
@@ -122,6 +172,7 @@ class MonitorApp(tk.Tk):
         btns.pack(side='right', padx=5)
         ttk.Button(btns, text="Aggiungi...", command=self._add_dir).pack(fill='x', pady=2)
         ttk.Button(btns, text="Rimuovi",  command=self._remove_dir).pack(fill='x')
+        ttk.Button(btns, text="Intervallo...", command=self._set_dir_interval).pack(fill='x', pady=2)
 
         # Frame impostazioni
         frm_cfg = ttk.LabelFrame(self, text="Impostazioni")
@@ -129,15 +180,53 @@ class MonitorApp(tk.Tk):
         self.var_interval = tk.DoubleVar(value=5.0)
         self.var_rec      = tk.BooleanVar()
         self.var_hidden   = tk.BooleanVar()
+        self.var_backend  = tk.StringVar(value='poll')
+        self.var_struct   = tk.BooleanVar()
+        self.var_workers  = tk.IntVar(value=1)
+        self.var_persist  = tk.BooleanVar(value=True)
+        self.var_adapt    = tk.BooleanVar()
+        self.var_quiete   = tk.DoubleVar(value=0.0)
+        self.var_verifica = tk.BooleanVar()
+        self.var_grandi   = tk.BooleanVar()
         ttk.Label(frm_cfg, text="Intervallo (s):").grid(row=0, column=0, sticky='w', padx=5, pady=2)
         ttk.Entry(frm_cfg, textvariable=self.var_interval, width=8).grid(row=0, column=1, pady=2)
         ttk.Checkbutton(frm_cfg, text="Ricorsivo", variable=self.var_rec).grid(row=0, column=2, padx=20)
         ttk.Checkbutton(frm_cfg, text="Includi nascosti", variable=self.var_hidden).grid(row=0, column=3)
+        ttk.Label(frm_cfg, text="Backend:").grid(row=1, column=0, sticky='w', padx=5, pady=2)
+        ttk.Radiobutton(frm_cfg, text="Polling", value='poll',
+                        variable=self.var_backend).grid(row=1, column=1, sticky='w')
+        ttk.Radiobutton(frm_cfg, text="inotify (Linux)", value='inotify', variable=self.var_backend,
+                        state='normal' if inotify_available() else 'disabled').grid(row=1, column=2, sticky='w', padx=20)
+        ttk.Radiobutton(frm_cfg, text="A intervalli (senza thread)", value='sliced',
+                        variable=self.var_backend).grid(row=1, column=3, sticky='w')
+        ttk.Checkbutton(frm_cfg, text="Solo struttura (niente stat dei file in cartelle invariate)",
+                        variable=self.var_struct).grid(row=2, column=0, columnspan=4, sticky='w', padx=5, pady=2)
+        ttk.Label(frm_cfg, text="Thread di scansione:").grid(row=3, column=0, sticky='w', padx=5, pady=2)
+        tk.Spinbox(frm_cfg, from_=1, to=MAX_SCAN_WORKERS, textvariable=self.var_workers,
+                   width=6).grid(row=3, column=1, pady=2)
+        ttk.Checkbutton(frm_cfg, text="Ricorda lo stato (segnala le modifiche fatte a monitor fermo)",
+                        variable=self.var_persist).grid(row=3, column=2, columnspan=2, sticky='w', padx=20)
+        ttk.Checkbutton(frm_cfg, text="Intervallo adattivo (cartelle inattive controllate più di rado, "
+                        f"fino a {ADAPTIVE_MAX_FACTOR}x l'intervallo)",
+                        variable=self.var_adapt).grid(row=4, column=0, columnspan=4, sticky='w', padx=5, pady=2)
+        ttk.Label(frm_cfg, text="Finestra di quiete (s):").grid(row=5, column=0, sticky='w', padx=5, pady=2)
+        ttk.Entry(frm_cfg, textvariable=self.var_quiete, width=8).grid(row=5, column=1, pady=2)
+        ttk.Label(frm_cfg, text="unisce gli eventi di un percorso finché resta fermo così a lungo (0: subito)"
+                  ).grid(row=5, column=2, columnspan=2, sticky='w', padx=20)
+        ttk.Checkbutton(frm_cfg, text="Verifica contenuto (hash dei file modificati, ignora i touch "
+                        "che non li cambiano)",
+                        variable=self.var_verifica).grid(row=6, column=0, columnspan=4, sticky='w', padx=5, pady=2)
+        ttk.Checkbutton(frm_cfg, text="Cartelle molto grandi (non ricorsivo, 10.000+ file: stat solo dei "
+                        "file nuovi o scritti di recente; non vede le riscritture dei file vecchi)",
+                        variable=self.var_grandi).grid(row=7, column=0, columnspan=4, sticky='w', padx=5, pady=2)
 
         # Frame filtri
         frm_flt = ttk.LabelFrame(self, text="Filtri avanzati (glob)")
         frm_flt.pack(fill='x', padx=10, pady=5)
         ttk.Button(frm_flt, text="Gestisci filtri...", command=self._open_filter_window).pack(padx=5, pady=5)
+        self.var_hook_thr = tk.IntVar(value=DEFAULT_HOOK_WORKERS)
+        self.var_hook_timeout = tk.DoubleVar(value=DEFAULT_HOOK_TIMEOUT)
+        self.var_hook_pol = tk.StringVar(value='drop-oldest')
 
         # Frame log file
         frm_log = ttk.Frame(self)
@@ -146,6 +235,48 @@ class MonitorApp(tk.Tk):
         self.ent_log = ttk.Entry(frm_log)
         self.ent_log.pack(side='left', fill='x', expand=True, padx=5)
         ttk.Button(frm_log, text="Sfoglia...", command=self._choose_logfile).pack(side='left', padx=5)
+        ttk.Label(frm_log, text="Ruota a (MB):").pack(side='left', padx=5)
+        self.var_ruota = tk.DoubleVar(value=0.0)
+        ttk.Entry(frm_log, textvariable=self.var_ruota, width=6).pack(side='left')
+
+        # Frame eventi JSON
+        frm_json = ttk.Frame(self)
+        frm_json.pack(fill='x', padx=10, pady=5)
+        ttk.Label(frm_json, text="Eventi JSON:").pack(side='left', padx=5)
+        self.ent_json = ttk.Entry(frm_json)
+        self.ent_json.pack(side='left', fill='x', expand=True, padx=5)
+        ttk.Button(frm_json, text="Sfoglia...", command=self._choose_json).pack(side='left', padx=5)
+
+        # Frame file metriche
+        frm_met = ttk.Frame(self)
+        frm_met.pack(fill='x', padx=10, pady=5)
+        ttk.Label(frm_met, text="File metriche:").pack(side='left', padx=5)
+        self.ent_met = ttk.Entry(frm_met)
+        self.ent_met.pack(side='left', fill='x', expand=True, padx=5)
+        ttk.Button(frm_met, text="Sfoglia...", command=self._choose_metrics).pack(side='left', padx=5)
+
+        # Frame storico eventi
+        frm_sto = ttk.Frame(self)
+        frm_sto.pack(fill='x', padx=10, pady=5)
+        ttk.Label(frm_sto, text="Storico (DB):").pack(side='left', padx=5)
+        self.ent_sto = ttk.Entry(frm_sto)
+        self.ent_sto.pack(side='left', fill='x', expand=True, padx=5)
+        ttk.Button(frm_sto, text="Sfoglia...", command=self._choose_storico).pack(side='left', padx=5)
+        ttk.Label(frm_sto, text="Conserva (giorni):").pack(side='left', padx=5)
+        self.var_giorni = tk.DoubleVar(value=30.0)
+        ttk.Entry(frm_sto, textvariable=self.var_giorni, width=6).pack(side='left')
+        ttk.Button(frm_sto, text="Cerca...", command=self._apri_storico).pack(side='left', padx=5)
+
+        # Frame demone di scansione
+        frm_dem = ttk.Frame(self)
+        frm_dem.pack(fill='x', padx=10, pady=5)
+        self.var_collega = tk.BooleanVar()
+        ttk.Checkbutton(frm_dem, text="Collegati al demone (scansiona lui, qui si vedono solo gli eventi):",
+                        variable=self.var_collega,
+                        state='normal' if hasattr(socket, 'AF_UNIX') else 'disabled').pack(side='left', padx=5)
+        self.ent_sock = ttk.Entry(frm_dem)
+        self.ent_sock.insert(0, default_socket_path())
+        self.ent_sock.pack(side='left', fill='x', expand=True, padx=5)
 
         # Pulsanti start/stop
         frm_btn = ttk.Frame(self)
@@ -154,8 +285,18 @@ class MonitorApp(tk.Tk):
         self.btn_start.pack(side='left', padx=5)
         self.btn_stop  = ttk.Button(frm_btn, text="Ferma monitor", command=self._stop, state='disabled')
         self.btn_stop.pack(side='left')
-
-        # Area di log
+        self.btn_prof = ttk.Button(frm_btn, text="Profila prossimo poll...",
+                                   command=self._profile_poll, state='disabled')
+        self.btn_prof.pack(side='right', padx=5)
+
+        # Barra di stato e area di log
+        self.var_status = tk.StringVar(value="Inattivo")
+        ttk.Label(self, textvariable=self.var_status, relief='sunken',
+                  anchor='w').pack(side='bottom', fill='x')
+        self.var_hook_stato = tk.StringVar()
+        ttk.Label(self, textvariable=self.var_hook_stato, anchor='w').pack(side='bottom', fill='x')
+        self.var_dropped = tk.StringVar()
+        ttk.Label(self, textvariable=self.var_dropped).pack(side='bottom', anchor='w', padx=10)
         self.txt_log = scrolledtext.ScrolledText(self, height=15)
         self.txt_log.pack(fill='both', expand=True, padx=10, pady=5)
 
@@ -173,9 +314,50 @@ class MonitorApp(tk.Tk):
         sel = self.lst_dirs.curselection()
         if sel:
             idx = sel[0]
-            self.paths.pop(idx)
+            self.limits.pop(self.paths.pop(idx), None)
             self.lst_dirs.delete(idx)
 
+    def _set_dir_interval(self):
+        """Chiede min/max dell'intervallo della cartella selezionata (modo adattivo)."""
+        sel = self.lst_dirs.curselection()
+        if not sel:
+            messagebox.showinfo("Intervallo", "Seleziona prima una cartella.")
+            return
+        idx = sel[0]
+        p = self.paths[idx]
+        attuale = ",".join("" if v is None else f"{v:g}" for v in self.limits.get(p, ()))
+        risp = tk.simpledialog.askstring(
+            "Intervallo cartella",
+            "Secondi min,max tra due poll di questa cartella in modo adattivo\n"
+            "(lascia vuoto un valore per il predefinito):",
+            initialvalue=attuale)
+        if risp is None:
+            return
+        try:
+            valori = [float(v) if v.strip() else None for v in (risp.split(",") + [""])[:2]]
+            if any(v is not None and not v >= MIN_INTERVAL for v in valori):
+                raise ValueError(risp)
+        except ValueError:
+            messagebox.showwarning("Attenzione", f"Inserisci due numeri di secondi (almeno {MIN_INTERVAL:g}) "
+                                   "separati da una virgola.")
+            return
+        if valori == [None, None]:
+            self.limits.pop(p, None)
+        else:
+            self.limits[p] = tuple(valori)
+        # la lista è disabilitata durante il monitor, il che blocca anche le modifiche
+        stato = self.lst_dirs.cget('state')
+        self.lst_dirs.configure(state='normal')
+        self.lst_dirs.delete(idx)
+        self.lst_dirs.insert(idx, self._dir_label(p))
+        self.lst_dirs.configure(state=stato)
+
+    def _dir_label(self, p):
+        if p not in self.limits:
+            return str(p)
+        lo, hi = ("predefinito" if v is None else f"{v:g}s" for v in self.limits[p])
+        return f"{p}   [{lo} – {hi}]"
+
     def _choose_logfile(self):
         f = filedialog.asksaveasfilename(title="File di log",
                                          defaultextension=".log",
@@ -184,12 +366,140 @@ class MonitorApp(tk.Tk):
             self.ent_log.delete(0, tk.END)
             self.ent_log.insert(0, f)
 
+    def _choose_json(self):
+        f = filedialog.asksaveasfilename(title="File eventi JSON",
+                                         defaultextension=".jsonl",
+                                         filetypes=[("JSON lines", "*.jsonl"), ("All files", "*.*")])
+        if f:
+            self.ent_json.delete(0, tk.END)
+            self.ent_json.insert(0, f)
+
+    def _choose_metrics(self):
+        f = filedialog.asksaveasfilename(title="File metriche",
+                                         defaultextension=".prom",
+                                         filetypes=[("Prometheus", "*.prom"), ("JSON lines", "*.jsonl"),
+                                                    ("All files", "*.*")])
+        if f:
+            self.ent_met.delete(0, tk.END)
+            self.ent_met.insert(0, f)
+
+    def _choose_storico(self):
+        f = filedialog.asksaveasfilename(title="Database dello storico eventi",
+                                         defaultextension=".db",
+                                         filetypes=[("Database SQLite", "*.db"), ("All files", "*.*")])
+        if f:
+            self.ent_sto.delete(0, tk.END)
+            self.ent_sto.insert(0, f)
+
+    def _apri_storico(self):
+        """Ricerca nello storico eventi; funziona anche durante il monitor, che continua a scriverci."""
+        try:
+            from monitor_history import (DEFAULT_QUERY_LIMIT, HISTORY_KINDS, event_path, event_time,
+                                         parse_time, query_history)
+        except ImportError as exc:
+            messagebox.showerror("Errore", f"Lo storico eventi richiede il modulo sqlite3:\n{exc}")
+            return
+        win = tk.Toplevel(self)
+        win.title("Storico eventi")
+        win.geometry("900x500")
+        frm_q = ttk.Frame(win)
+        frm_q.pack(fill='x', padx=5, pady=5)
+        ttk.Label(frm_q, text="Sotto:").grid(row=0, column=0, sticky='w', padx=5, pady=2)
+        ent_sotto = ttk.Entry(frm_q, width=50)
+        ent_sotto.grid(row=0, column=1, columnspan=3, sticky='we', pady=2)
+        ttk.Label(frm_q, text="Dalle:").grid(row=1, column=0, sticky='w', padx=5, pady=2)
+        ent_da = ttk.Entry(frm_q, width=20)
+        ent_da.grid(row=1, column=1, sticky='w', pady=2)
+        ttk.Label(frm_q, text="Alle:").grid(row=1, column=2, sticky='w', padx=5, pady=2)
+        ent_a = ttk.Entry(frm_q, width=20)
+        ent_a.grid(row=1, column=3, sticky='w', pady=2)
+        var_tipo = tk.StringVar(value='any')
+        ttk.Label(frm_q, text="Evento:").grid(row=0, column=4, sticky='w', padx=5, pady=2)
+        ttk.Combobox(frm_q, textvariable=var_tipo, values=('any',) + HISTORY_KINDS,
+                     state='readonly', width=10).grid(row=0, column=5, sticky='w', pady=2)
+        var_max = tk.IntVar(value=DEFAULT_QUERY_LIMIT)
+        ttk.Label(frm_q, text="Massimo:").grid(row=1, column=4, sticky='w', padx=5, pady=2)
+        tk.Spinbox(frm_q, from_=1, to=1000000, textvariable=var_max,
+                   width=8).grid(row=1, column=5, sticky='w', pady=2)
+        ttk.Label(frm_q, text="Orari: 2025-06-01 02:00, 02:00 (oggi) o 2h (fa); "
+                  "i campi vuoti non filtrano").grid(row=2, column=0, columnspan=6, sticky='w', padx=5)
+        frm_q.columnconfigure(1, weight=1)
+        frm_q.columnconfigure(3, weight=1)
+
+        frm_righe = ttk.Frame(win)
+        frm_righe.pack(fill='both', expand=True, padx=5)
+        tree = ttk.Treeview(frm_righe, columns=('time', 'kind', 'path', 'size'), show='headings')
+        for col, titolo, larg in (('time', "Ora", 170), ('kind', "Evento", 80),
+                                  ('path', "Percorso", 520), ('size', "Dimensione", 90)):
+            tree.heading(col, text=titolo)
+            tree.column(col, width=larg, stretch=col == 'path')
+        scroll = ttk.Scrollbar(frm_righe, orient='vertical', command=tree.yview)
+        tree.configure(yscrollcommand=scroll.set)
+        scroll.pack(side='right', fill='y')
+        tree.pack(side='left', fill='both', expand=True)
+        var_esito = tk.StringVar()
+        ttk.Label(win, textvariable=var_esito, anchor='w').pack(fill='x', padx=5, pady=2)
+
+        def cerca(event=None):
+            db = self.ent_sto.get().strip()
+            if not db:
+                messagebox.showwarning("Attenzione", "Nessun database dello storico indicato.", parent=win)
+                return
+            try:
+                da, a = parse_time(ent_da.get()), parse_time(ent_a.get())
+                massimo = max(int(var_max.get()), 1)
+            except (ValueError, tk.TclError) as exc:
+                messagebox.showwarning("Attenzione", str(exc), parent=win)
+                return
+            tipo = var_tipo.get()
+            t0 = time.perf_counter()
+            try:
+                eventi = query_history(db, da, a, ent_sotto.get().strip() or None,
+                                       None if tipo == 'any' else [tipo], massimo)
+            except OSError as exc:
+                messagebox.showerror("Errore", f"Impossibile leggere lo storico:\n{exc}", parent=win)
+                return
+            durata = time.perf_counter() - t0
+            tree.delete(*tree.get_children())
+            for ev in eventi:
+                tree.insert('', tk.END, values=(event_time(ev), ev['kind'], event_path(ev),
+                                                 '' if ev['size'] is None else ev['size']))
+            var_esito.set(f"{len(eventi)} eventi in {durata * 1000:.0f} ms"
+                          + (" (raggiunto il massimo)" if len(eventi) >= massimo else ""))
+
+        ttk.Button(frm_q, text="Cerca", command=cerca).grid(row=0, column=6, rowspan=2, padx=10)
+        for ent in (ent_sotto, ent_da, ent_a):
+            ent.bind('<Return>', cerca)
+
+    def _profile_poll(self):
+        f = filedialog.asksaveasfilename(title="Salva profilo",
+                                         defaultextension=".prof",
+                                         filetypes=[("cProfile", "*.prof"), ("All files", "*.*")])
+        if f and self.worker:
+            self.worker.profile_path = f
+            logging.info(f"Profilo del prossimo poll in {f}")
+
+    def _show_profile(self, path):
+        import io
+        import pstats
+        out = io.StringIO()
+        pstats.Stats(path, stream=out).sort_stats('cumulative').print_stats(30)
+        win = tk.Toplevel(self)
+        win.title(f"Profilo – {os.path.basename(path)}")
+        win.geometry("800x500")
+        txt = scrolledtext.ScrolledText(win, wrap='none', font='TkFixedFont')
+        txt.pack(fill='both', expand=True)
+        txt.insert('1.0', out.getvalue())
+        txt.configure(state='disabled')
+
     def _open_filter_window(self):
         win = tk.Toplevel(self)
         win.title("Filtri Avanzati")
-        win.geometry("400x300")
+        win.geometry("600x520")
+        frm_glob = ttk.Frame(win)
+        frm_glob.pack(fill='both', expand=True)
         # Include
-        frm_inc = ttk.LabelFrame(win, text="Include patterns")
+        frm_inc = ttk.LabelFrame(frm_glob, text="Include patterns")
         frm_inc.pack(fill='both', expand=True, side='left', padx=5, pady=5)
         lst_inc = tk.Listbox(frm_inc)
         lst_inc.pack(fill='both', expand=True, padx=5, pady=5)
@@ -202,7 +512,7 @@ class MonitorApp(tk.Tk):
                    command=lambda: self._remove_pattern(lst_inc, self.includes)).pack(side='left')
 
         # Exclude
-        frm_exc = ttk.LabelFrame(win, text="Exclude patterns")
+        frm_exc = ttk.LabelFrame(frm_glob, text="Exclude patterns")
         frm_exc.pack(fill='both', expand=True, side='right', padx=5, pady=5)
         lst_exc = tk.Listbox(frm_exc)
         lst_exc.pack(fill='both', expand=True, padx=5, pady=5)
@@ -214,11 +524,71 @@ class MonitorApp(tk.Tk):
         ttk.Button(btns_e, text="–", width=3,
                    command=lambda: self._remove_pattern(lst_exc, self.excludes)).pack(side='left')
 
+        # Azioni
+        frm_hook = ttk.LabelFrame(win, text="Azioni (evento, glob del percorso → comando)")
+        frm_hook.pack(fill='both', expand=True, padx=5, pady=5)
+        lst_hook = tk.Listbox(frm_hook, height=5)
+        lst_hook.pack(fill='both', expand=True, padx=5, pady=5)
+        for h in self.hooks: lst_hook.insert(tk.END, str(h))
+        btns_h = ttk.Frame(frm_hook)
+        btns_h.pack(fill='x', padx=5, pady=5)
+        ttk.Button(btns_h, text="+", width=3,
+                   command=lambda: self._add_hook(lst_hook)).pack(side='left')
+        ttk.Button(btns_h, text="–", width=3,
+                   command=lambda: self._remove_pattern(lst_hook, self.hooks)).pack(side='left')
+        ttk.Label(btns_h, text="Thread:").pack(side='left', padx=(15, 2))
+        tk.Spinbox(btns_h, from_=1, to=MAX_HOOK_WORKERS, textvariable=self.var_hook_thr,
+                   width=4).pack(side='left')
+        ttk.Label(btns_h, text="Timeout (s):").pack(side='left', padx=(10, 2))
+        ttk.Entry(btns_h, textvariable=self.var_hook_timeout, width=6).pack(side='left')
+        ttk.Label(btns_h, text="Con 1000 in coda:").pack(side='left', padx=(10, 2))
+        ttk.Combobox(btns_h, textvariable=self.var_hook_pol, values=('drop-oldest', 'drop-new'),
+                     state='readonly', width=11).pack(side='left')
+
+    def _add_hook(self, listbox):
+        """Chiede tipo di evento, glob e comando di una nuova azione."""
+        top = listbox.winfo_toplevel()
+        dlg = tk.Toplevel(top)
+        dlg.title("Nuova azione")
+        dlg.transient(top)
+        var_tipo = tk.StringVar(value='any')
+        ttk.Label(dlg, text="Evento:").grid(row=0, column=0, sticky='w', padx=5, pady=2)
+        ttk.Combobox(dlg, textvariable=var_tipo, values=HOOK_KINDS, state='readonly',
+                     width=10).grid(row=0, column=1, sticky='w', padx=5, pady=2)
+        ttk.Label(dlg, text="Glob del percorso:").grid(row=1, column=0, sticky='w', padx=5, pady=2)
+        ent_pat = ttk.Entry(dlg, width=40)
+        ent_pat.grid(row=1, column=1, sticky='we', padx=5, pady=2)
+        ttk.Label(dlg, text="Comando:").grid(row=2, column=0, sticky='w', padx=5, pady=2)
+        ent_cmd = ttk.Entry(dlg, width=40)
+        ent_cmd.grid(row=2, column=1, sticky='we', padx=5, pady=2)
+        ttk.Label(dlg, text="Il comando riceve $DIRMON_KIND, $DIRMON_ROOT, $DIRMON_PATH,\n"
+                  "$DIRMON_FULLPATH e, per gli spostamenti, $DIRMON_FROM_ROOT e $DIRMON_FROM."
+                  ).grid(row=3, column=0, columnspan=2, sticky='w', padx=5, pady=5)
+
+        def aggiungi():
+            pat = ent_pat.get().strip()
+            cmd = ent_cmd.get().strip()
+            if not pat or not cmd:
+                messagebox.showwarning("Attenzione", "Inserisci un glob e un comando.", parent=dlg)
+                return
+            h = Hook(var_tipo.get(), pat, cmd)
+            self.hooks.append(h)
+            listbox.insert(tk.END, str(h))
+            dlg.destroy()
+
+        frm_b = ttk.Frame(dlg)
+        frm_b.grid(row=4, column=0, columnspan=2, pady=5)
+        ttk.Button(frm_b, text="Aggiungi", command=aggiungi).pack(side='left', padx=5)
+        ttk.Button(frm_b, text="Annulla", command=dlg.destroy).pack(side='left')
+        ent_pat.focus_set()
+        dlg.grab_set()
+
     def _add_pattern(self, listbox, target):
         pat = tk.simpledialog.askstring("Nuovo pattern", "Inserisci pattern glob:")
         if pat and pat not in target:
             target.append(pat)
             listbox.insert(tk.END, pat)
+            self._rebuild_filter()
 
     def _remove_pattern(self, listbox, target):
         sel = listbox.curselection()
@@ -226,70 +596,253 @@ class MonitorApp(tk.Tk):
             idx = sel[0]
             target.pop(idx)
             listbox.delete(idx)
+            self._rebuild_filter()
+
+    def _rebuild_filter(self):
+        """Ricompila i pattern glob; solo quando le liste cambiano."""
+        self.path_filter = PathFilter(self.includes, self.excludes)
 
     def _start(self):
-        if not self.paths:
+        collega = self.var_collega.get()
+        sock = self.ent_sock.get().strip()
+        if collega and not sock:
+            messagebox.showwarning("Attenzione", "Nessun socket del demone indicato.")
+            return
+        if not collega and not self.paths:
             messagebox.showwarning("Attenzione", "Nessuna cartella selezionata.")
             return
-        # configura logger
+        # configura logger: i file li scrive un thread in background, nuovi a ogni avvio
         logfile = self.ent_log.get().strip() or None
-        handlers = [TextHandler(self.txt_log)]
-        if logfile:
-            handlers.append(logging.FileHandler(logfile, encoding='utf-8'))
-        logging.basicConfig(level=logging.INFO,
-                            format="%(asctime)s %(levelname)-8s %(message)s",
-                            handlers=handlers)
+        jsonfile = self.ent_json.get().strip() or None
+        storico = self.ent_sto.get().strip() or None
+        metrics = self.ent_met.get().strip() or None
+        try:
+            max_bytes = int(max(float(self.var_ruota.get()), 0.0) * 1024 * 1024)
+        except (tk.TclError, ValueError):
+            max_bytes = 0
+        sinks = []
+        try:
+            if logfile:
+                sinks.append(FileSink(logfile, max_bytes))
+            if jsonfile:
+                sinks.append(FileSink(jsonfile, max_bytes, formatter=JsonFormatter()))
+            if storico:
+                # sqlite3 viene caricato solo se c'è uno storico da tenere
+                from monitor_history import HistorySink
+                sinks.append(HistorySink(storico, self._giorni()))
+        except (OSError, ImportError) as exc:
+            for sink in sinks:
+                sink.close()
+            messagebox.showerror("Errore", f"Impossibile aprire il file:\n{exc}")
+            return
+        self.event_log = EventLog([TextHandler(self.txt_log, self.var_dropped)], sinks).start()
         logging.info("=== Monitor Avviato ===")
-        # snapshot iniziale
-        self.snapshot = scan_dirs(
-            self.paths,
-            self.var_rec.get(),
-            self.var_hidden.get(),
-            self.includes,
-            self.excludes
-        )
-        # disabilita controlli
+        self.roots, doppi = normalize_roots(self.paths)
+        if not collega:
+            for p, uguale in doppi:
+                logging.warning(f"{p} è la stessa cartella di {uguale}, la controllo una volta sola")
+            for interna, esterna in nested_roots(self.roots).items():
+                logging.info(f"{interna} è dentro {esterna}: le sue modifiche sono segnalate sotto {interna}")
+        # snapshot iniziale e polling girano nel thread worker, oppure a fette
+        # in questo thread con il backend a intervalli (vedi _do_poll);
+        # da collegati scansiona il demone, con cartelle e impostazioni sue
+        opz = dict(structure_only=self.var_struct.get(),
+                   large_dirs=self.var_grandi.get(),
+                   verify_content=self.var_verifica.get(),
+                   state_dir=default_state_dir() if self.var_persist.get() else None,
+                   metrics_path=metrics)
+        if collega:
+            self.worker = DaemonClient(sock, self.results)
+        elif self.var_backend.get() == 'sliced':
+            self.worker = SlicedWorker(self._scan_params(), self._interval(), self.results, **opz)
+        else:
+            self.worker = ScanWorker(self._scan_params(), self._interval(), self.results,
+                                     backend=self.var_backend.get(),
+                                     workers=self._workers(),
+                                     adaptive=self.var_adapt.get(),
+                                     limits=dict(self.limits), **opz)
+        self.worker.start()
+        self.coalescer = EventCoalescer(self._quiete())
+        self._sync_hooks()
+        self.var_hook_stato.set("")
+        self.log_sec = 0.0
+        self.var_status.set("Collegamento in corso..." if collega else "Scansione in corso...")
+        # disabilita controlli, Stop subito disponibile
         for w in (self.lst_dirs, self.btn_start):
             w.configure(state='disabled')
-        # avvia polling
+        self.btn_stop.configure(state='normal')
+        self.btn_prof.configure(state='disabled' if collega else 'normal')
+        # avvia lettura dei risultati
         self._schedule_poll()
 
     def _stop(self):
         if self.job:
             self.after_cancel(self.job)
             self.job = None
+        if self.coalescer is not None:
+            # gli eventi ancora in attesa della finestra di quiete vengono registrati ora
+            self._log_changes(self.coalescer.flush())
+            self.coalescer = None
+        if self.worker:
+            self.worker.stop()
+            self.worker = None
+        if self.hook_runner:
+            # le azioni già in coda vengono eseguite comunque, nei thread del runner
+            for msg in self.hook_runner.failures():
+                logging.warning(msg)
+            self.hook_runner.stop()
+            self.hook_runner = None
         logging.info("=== Monitor Interrotto ===")
+        if self.event_log:
+            # scrive quanto resta nei sink e chiude i file
+            self.event_log.stop()
+            self.event_log = None
         # ripristina controlli
         for w in (self.lst_dirs, self.btn_start):
             w.configure(state='normal')
-        self.btn_stop.configure(state='disabled')
-
-    def _schedule_poll(self):
-        interval = int(self.var_interval.get() * 1000)
-        self.job = self.after(interval, self._do_poll)
+        for w in (self.btn_stop, self.btn_prof):
+            w.configure(state='disabled')
 
-    def _do_poll(self):
-        new_snap = scan_dirs(
-            self.paths,
+    def _chiudi(self):
+        # lascia al worker il tempo di salvare lo stato prima di uscire
+        worker = self.worker
+        if worker:
+            self._stop()
+            worker.join(timeout=STOP_TIMEOUT)
+        self.destroy()
+
+    def _scan_params(self):
+        """Copia delle impostazioni correnti da passare al worker."""
+        return (
+            list(self.roots),
             self.var_rec.get(),
             self.var_hidden.get(),
-            self.includes,
-            self.excludes
+            self.path_filter
         )
-        added, removed, modified = compare_snapshots(self.snapshot, new_snap)
-        for key in sorted(added):
-            base, rel = key.split("|", 1)
-            logging.info(f"[{base}] +Aggiunto FILE/DIR: {rel}")
-        for key in sorted(removed):
-            base, rel = key.split("|", 1)
-            logging.info(f"[{base}] -Rimosso  FILE/DIR: {rel}")
-        for key in sorted(modified):
-            base, rel = key.split("|", 1)
-            logging.info(f"[{base}] *Modificato FILE/DIR: {rel}")
-        self.snapshot = new_snap
-        # riabilita Stop, programma nuova tick
-        self.btn_stop.configure(state='normal')
-        self._schedule_poll()
+
+    def _interval(self):
+        try:
+            interval = float(self.var_interval.get())
+            if not interval >= MIN_INTERVAL:
+                raise ValueError(interval)
+            return interval
+        except (tk.TclError, ValueError):
+            return self.worker.interval if self.worker else 5.0
+
+    def _giorni(self):
+        try:
+            return max(float(self.var_giorni.get()), 0.0)
+        except (tk.TclError, ValueError):
+            return 30.0
+
+    def _quiete(self):
+        try:
+            return max(float(self.var_quiete.get()), 0.0)
+        except (tk.TclError, ValueError):
+            return self.coalescer.window if self.coalescer is not None else 0.0
+
+    def _workers(self):
+        try:
+            return min(max(int(self.var_workers.get()), 1), MAX_SCAN_WORKERS)
+        except (tk.TclError, ValueError):
+            return self.worker.workers if self.worker else 1
+
+    def _hook_thr(self):
+        try:
+            return min(max(int(self.var_hook_thr.get()), 1), MAX_HOOK_WORKERS)
+        except (tk.TclError, ValueError):
+            return DEFAULT_HOOK_WORKERS
+
+    def _hook_timeout(self):
+        try:
+            return max(float(self.var_hook_timeout.get()), 0.0)
+        except (tk.TclError, ValueError):
+            return DEFAULT_HOOK_TIMEOUT
+
+    def _sync_hooks(self):
+        """Passa le azioni al runner, avviandolo alla prima azione configurata."""
+        if self.hook_runner is None:
+            if not self.hooks:
+                return
+            self.hook_runner = HookRunner(self.hooks, self._hook_thr(), self._hook_timeout(),
+                                          policy=self.var_hook_pol.get()).start()
+            self.worker.hooks = self.hook_runner
+        self.hook_runner.hooks = list(self.hooks)
+        self.hook_runner.timeout = self._hook_timeout() or None
+        for msg in self.hook_runner.failures():
+            logging.warning(msg)
+
+    def _schedule_poll(self, ritardo=POLL_DRAIN_MS):
+        self.job = self.after(ritardo, self._do_poll)
+
+    def _do_poll(self):
+        ritardo = POLL_DRAIN_MS
+        if isinstance(self.worker, SlicedWorker):
+            # una fetta di scansione, poi si torna a Tk; durante la scansione si riparte subito
+            attesa = self.worker.step(SLICE_BUDGET_MS / 1000)
+            if self.worker.scanning:
+                ritardo = 1
+                prog = self.worker.progress()
+                self.var_status.set(f"Scansione in corso... {prog:.0%}" if prog is not None else
+                                    f"Scansione in corso... {self.worker.visited()} cartelle")
+            elif attesa is not None:
+                ritardo = min(max(int(attesa * 1000), 1), POLL_DRAIN_MS)
+        # raccoglie tutto ciò che il worker ha prodotto dall'ultima tick
+        while True:
+            try:
+                worker, kind, payload = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if worker is not self.worker:
+                continue  # residuo di una sessione già fermata
+            handle_message(kind, payload, self.gestori, MESSAGGI)
+        self.coalescer.window = self._quiete()
+        if self.coalescer:  # eventi trattenuti
+            t0 = time.perf_counter()
+            self._log_changes(self.coalescer.settled())
+            self.log_sec += time.perf_counter() - t0
+        # le impostazioni possono cambiare durante il monitor: il worker le legge al prossimo ciclo
+        self.worker.params = self._scan_params()
+        self.worker.interval = self._interval()
+        self.worker.structure_only = self.var_struct.get()
+        self.worker.large_dirs = self.var_grandi.get()
+        self.worker.verify_content = self.var_verifica.get()
+        self.worker.workers = self._workers()
+        self.worker.adaptive = self.var_adapt.get()
+        self.worker.limits = dict(self.limits)
+        self._sync_hooks()
+        self._schedule_poll(ritardo)
+
+    def _on_changes(self, changes):
+        if self.coalescer.window > 0:
+            self.coalescer.add(changes)
+        else:
+            t0 = time.perf_counter()
+            self._log_changes(changes)
+            self.log_sec += time.perf_counter() - t0
+
+    def _show_stats(self, payload):
+        """Mostra nella barra di stato i totali di un poll, ({base: ScanStats}, secondi)."""
+        stats, duration = payload
+        tot = ScanStats.total(stats.values())
+        self.var_status.set(
+            f"Ultimo poll {duration * 1000:.0f} ms (scansione {tot.scan_s * 1000:.0f}, "
+            f"diff {tot.diff_s * 1000:.0f}, log {self.log_sec * 1000:.0f}) | "
+            f"{tot.visited} voci, {tot.filtered} filtrate, "
+            f"{tot.stat_errors} errori di stat | {tot.events} eventi")
+        self.log_sec = 0.0
+
+    def _show_hook_stats(self, m):
+        tot = m['totals']
+        self.var_hook_stato.set(
+            f"Azioni: {m['queued']} in coda, {m['running']} in esecuzione | latenza "
+            f"media {m['latency_avg_s'] * 1000:.0f} ms, max {m['latency_max_s'] * 1000:.0f} ms | "
+            f"{tot['ok']} ok, {tot['failed']} fallite, {tot['timeout']} scadute, "
+            f"{tot['dropped']} scartate")
+
+    def _log_changes(self, changes):
+        snap = self.worker.snapshot if self.worker else None
+        log_changes(changes, snap, self.hook_runner, ETICHETTE)
 
 # -- Punto di ingresso --------------------------------------------------------
 
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+monitor_cli.py
+
+Headless front-end to the directory monitor, for machines without a
+display. Runs the same ScanWorker as the GUIs and streams its events to
+stdout or to a log file, and optionally to a JSON lines file, until
+interrupted (Ctrl+C or SIGTERM). Output is written by a background
+thread (see monitor_sinks).
+
+    python3 monitor_cli.py ~/projects -r --exclude 'node_modules/' --interval 2
+    python3 monitor_cli.py /srv/data -r --backend inotify --log /var/log/dirmon.log
+    python3 monitor_cli.py /srv/in --hook added '*.csv' 'import.sh "$DIRMON_FULLPATH"'
+    python3 monitor_cli.py /mnt/share -r --serve /run/dirmon/share.sock
+    python3 monitor_cli.py /data -r --history ~/dirmon.db
+    python3 monitor_cli.py --query --history ~/dirmon.db --under /data/incoming --since 02:00 --until 03:00
+
+Standard library only; tkinter is never imported.
+"""
+
+import os
+import sys
+import queue
+import signal
+import socket
+import logging
+import argparse
+
+from monitor_core import (ADAPTIVE_MAX_FACTOR, MIN_INTERVAL, EventCoalescer, PathFilter, ScanStats,
+                          ScanWorker, default_state_dir, nested_roots, normalize_roots)
+from monitor_daemon import DaemonServer, default_socket_path
+from monitor_hooks import (DEFAULT_HOOK_TIMEOUT, DEFAULT_HOOK_WORKERS, HOOK_KINDS, HOOK_POLICIES,
+                           HOOK_QUEUE_SIZE, Hook, HookRunner)
+from monitor_sinks import DEFAULT_BACKUPS, EventLog, FileSink, JsonFormatter, handle_message, log_changes
+
+# Seconds to wait on exit for the worker to finish saving its state
+STOP_TIMEOUT = 10
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Watch directories for changes and log them (no GUI).")
+    parser.add_argument("paths", nargs='*', help="directories to watch")
+    parser.add_argument("-i", "--interval", type=float, default=5.0,
+                        help="seconds between polls, at least %g (default: 5)" % MIN_INTERVAL)
+    parser.add_argument("--adaptive", action="store_true",
+                        help="poll each directory on its own schedule, less often while it "
+                             "stays quiet (up to %d times --interval)" % ADAPTIVE_MAX_FACTOR)
+    parser.add_argument("--root-interval", action="append", default=[], metavar="PATH=MIN[:MAX]",
+                        help="with --adaptive, interval limits in seconds for one of the "
+                             "paths (repeatable)")
+    parser.add_argument("-r", "--recursive", action="store_true", help="watch subdirectories too")
+    parser.add_argument("--hidden", action="store_true", help="include hidden entries")
+    parser.add_argument("--include", action="append", default=[], metavar="GLOB",
+                        help="only report paths matching GLOB (repeatable)")
+    parser.add_argument("--exclude", action="append", default=[], metavar="GLOB",
+                        help="ignore paths matching GLOB; a trailing '/' skips the "
+                             "whole folder (repeatable)")
+    parser.add_argument("--backend", choices=("poll", "inotify"), default="poll",
+                        help="change detection backend (default: poll)")
+    parser.add_argument("--structure-only", action="store_true",
+                        help="skip file stats in folders whose mtime did not change")
+    parser.add_argument("--large-dirs", action="store_true",
+                        help="tune the scan for folders of hundreds of thousands of files: diff "
+                             "sorted listings and, without --recursive, only stat new and "
+                             "recently written files in folders of 10,000+ entries (an "
+                             "in-place rewrite of a file settled over a minute goes unseen)")
+    parser.add_argument("--verify-content", action="store_true",
+                        help="hash files reported modified and drop the change when their "
+                             "content is the same (touch, identical rewrite)")
+    parser.add_argument("--workers", type=int, default=1, help="scan threads (default: 1)")
+    parser.add_argument("--no-state", action="store_true",
+                        help="do not save or restore the snapshot between runs")
+    parser.add_argument("--state-dir", default=None,
+                        help="where snapshots are saved (default: %s)" % default_state_dir())
+    parser.add_argument("--quiet-window", type=float, default=0.0, metavar="SECONDS",
+                        help="hold each path's events until it has been quiet this long and "
+                             "log one merged event (default: 0, log at once)")
+    parser.add_argument("--log", metavar="FILE", help="append events to FILE instead of stdout")
+    parser.add_argument("--json-events", metavar="FILE",
+                        help="also append each event to FILE as a JSON object per line")
+    parser.add_argument("--rotate-mb", type=float, default=0.0, metavar="MB",
+                        help="rotate --log and --json-events files at this size, keeping "
+                             "%d old ones (default: 0, never)" % DEFAULT_BACKUPS)
+    parser.add_argument("--history", metavar="DB", nargs='?', const='',
+                        help="also record each event in the SQLite database DB, which --query "
+                             "searches (default: %s)" % os.path.join(default_state_dir(), 'history.db'))
+    parser.add_argument("--history-days", type=float, default=30.0, metavar="DAYS",
+                        help="delete recorded events older than this, 0 for never (default: 30)")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="write per-poll metrics to FILE: Prometheus text if it ends "
+                             "in .prom, JSON lines otherwise")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="save a cProfile of the first poll to FILE")
+    parser.add_argument("--hook", nargs=3, action="append", default=[],
+                        metavar=("KIND", "GLOB", "COMMAND"),
+                        help="run COMMAND through the shell for each KIND (%s) event whose "
+                             "path matches GLOB; the event is in $DIRMON_KIND, $DIRMON_ROOT, "
+                             "$DIRMON_PATH, $DIRMON_FULLPATH, $DIRMON_FROM_ROOT and $DIRMON_FROM "
+                             "(repeatable)" % ", ".join(HOOK_KINDS))
+    parser.add_argument("--hook-workers", type=int, default=DEFAULT_HOOK_WORKERS,
+                        help="hook commands run at once (default: %d)" % DEFAULT_HOOK_WORKERS)
+    parser.add_argument("--hook-timeout", type=float, default=DEFAULT_HOOK_TIMEOUT,
+                        help="kill hook commands after this many seconds, 0 for never "
+                             "(default: %g)" % DEFAULT_HOOK_TIMEOUT)
+    parser.add_argument("--hook-policy", choices=HOOK_POLICIES, default='drop-oldest',
+                        help="what to do with new hook jobs when %d are waiting "
+                             "(default: drop-oldest)" % HOOK_QUEUE_SIZE)
+    parser.add_argument("--serve", nargs='?', const='', metavar="SOCKET",
+                        help="also publish the events on the Unix socket SOCKET, for GUIs "
+                             "to attach to instead of scanning (default: %s)"
+                             % default_socket_path())
+    query = parser.add_argument_group(
+        "history queries", "With --query, print the events recorded in the --history database "
+        "instead of watching anything, newest first. Times are a date and time "
+        "(2025-06-01 02:00), a time of today (02:00) or an age (90s, 15m, 2h, 7d).")
+    query.add_argument("--query", action="store_true", help="search the history")
+    query.add_argument("--under", metavar="PATH", help="only events at or below PATH")
+    query.add_argument("--since", metavar="TIME", help="only events from TIME on")
+    query.add_argument("--until", metavar="TIME", help="only events before TIME")
+    query.add_argument("--kind", action="append", choices=("added", "removed", "modified", "moved"),
+                       help="only events of this kind (repeatable)")
+    query.add_argument("--limit", type=int, default=1000, help="at most this many events (default: 1000)")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="also log the timings of each poll and of the hooks")
+    return parser
+
+
+def parse_limits(parser, specs):
+    """Turn --root-interval PATH=MIN[:MAX] options into {path: (min, max)}."""
+    limits = {}
+    for spec in specs:
+        path, _, values = spec.rpartition('=')
+        low, _, high = values.partition(':')
+        try:
+            low, high = (float(v) if v else None for v in (low, high))
+        except ValueError:
+            low = high = -1
+        if not path or any(v is not None and not v >= MIN_INTERVAL for v in (low, high)):
+            parser.error(f"--root-interval expects PATH=MIN[:MAX] in seconds of at least "
+                         f"{MIN_INTERVAL:g}, got {spec!r}")
+        limits[path] = (low, high)
+    return limits
+
+
+def _handlers(coalescer, worker):
+    """What the CLI does with the worker's messages besides logging them, see handle_message()."""
+    def changes(payload):
+        if coalescer.window > 0:
+            coalescer.add(payload)
+        else:
+            log_changes(payload, worker.snapshot, worker.hooks)
+
+    def stats(payload):
+        stats, duration = payload
+        total = ScanStats.total(stats.values())
+        logging.debug(f"Poll of {len(stats)} root(s) {duration * 1000:.0f} ms (scan {total.scan_s * 1000:.0f}, "
+                      f"diff {total.diff_s * 1000:.0f}): {total.visited} entries, "
+                      f"{total.filtered} filtered, {total.stat_errors} stat errors, "
+                      f"{total.events} events")
+
+    def hooks(payload):
+        if payload['finished'] or payload['queued'] or payload['running']:
+            logging.debug(f"Hooks: {payload['queued']} queued, {payload['running']} running, "
+                          f"{payload['finished']} finished, latency avg "
+                          f"{payload['latency_avg_s'] * 1000:.0f} ms, max "
+                          f"{payload['latency_max_s'] * 1000:.0f} ms, totals {payload['totals']}")
+        for message in worker.hooks.failures():
+            logging.warning(message)
+
+    return {'changes': changes, 'stats': stats, 'hooks': hooks}
+
+
+def run_query(parser, args):
+    """Print the events of the history that --under, --since, --until and --kind select."""
+    try:
+        from monitor_history import (default_history_path, event_path, event_time, parse_time,
+                                     query_history)
+    except ImportError as exc:
+        parser.error(f"the event history needs the sqlite3 module: {exc}")
+    try:
+        since, until = parse_time(args.since or ''), parse_time(args.until or '')
+    except ValueError as exc:
+        parser.error(str(exc))
+    path = args.history or default_history_path()
+    try:
+        events = query_history(path, since, until, args.under, args.kind, args.limit)
+    except OSError as exc:
+        print(f"Cannot read the history: {exc}", file=sys.stderr)
+        return 1
+    for event in events:
+        size = f" ({event['size']} bytes)" if event['size'] is not None else ""
+        print(f"{event_time(event)} {event['kind']:<8} {event_path(event)}{size}")
+    return 0
+
+
+def _terminate(signum, frame):
+    raise KeyboardInterrupt
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.query:
+        return run_query(parser, args)
+    if not args.paths:
+        parser.error("no directories to watch")
+    for path in args.paths:
+        if not os.path.isdir(path):
+            parser.error(f"not a directory: {path}")
+    if not args.interval >= MIN_INTERVAL:
+        parser.error(f"--interval must be at least {MIN_INTERVAL:g}")
+    if args.workers < 1 or args.quiet_window < 0 or args.rotate_mb < 0 or args.history_days < 0:
+        parser.error("--quiet-window, --rotate-mb and --history-days must be >= 0, --workers >= 1")
+    if args.hook_workers < 1 or args.hook_timeout < 0:
+        parser.error("--hook-workers must be >= 1, --hook-timeout >= 0")
+    if args.serve is not None and not hasattr(socket, 'AF_UNIX'):
+        parser.error("--serve needs Unix domain sockets, not available on this platform")
+    try:
+        hooks = [Hook(kind, pattern, command) for kind, pattern, command in args.hook]
+    except ValueError as exc:
+        parser.error(f"--hook: {exc}")
+
+    max_bytes = int(args.rotate_mb * 1024 * 1024)
+    try:
+        sinks = [FileSink(args.log, max_bytes) if args.log else logging.StreamHandler(sys.stdout)]
+        if args.json_events:
+            sinks.append(FileSink(args.json_events, max_bytes, formatter=JsonFormatter()))
+        if args.history is not None:
+            # sqlite3 is only loaded when there is a history to keep
+            from monitor_history import HistorySink, default_history_path
+            sinks.append(HistorySink(args.history or default_history_path(), args.history_days))
+    except ImportError as exc:
+        parser.error(f"the event history needs the sqlite3 module: {exc}")
+    except OSError as exc:
+        parser.error(f"cannot open output file: {exc}")
+    event_log = EventLog(sinks=sinks, level=logging.DEBUG if args.verbose else logging.INFO)
+    event_log.start()
+
+    limits = parse_limits(parser, args.root_interval)
+    roots, dropped = normalize_roots(args.paths)
+    params = (roots, args.recursive, args.hidden,
+              PathFilter(args.include, args.exclude))
+    state_dir = None if args.no_state else (args.state_dir or default_state_dir())
+    results = queue.Queue()
+    runner = (HookRunner(hooks, args.hook_workers, args.hook_timeout, policy=args.hook_policy).start()
+              if hooks else None)
+    worker = ScanWorker(params, args.interval, results, backend=args.backend,
+                        structure_only=args.structure_only, large_dirs=args.large_dirs,
+                        workers=args.workers, state_dir=state_dir, metrics_path=args.metrics,
+                        adaptive=args.adaptive, limits=limits, hooks=runner,
+                        verify_content=args.verify_content)
+    worker.profile_path = args.profile
+    server = None
+    if args.serve is not None:
+        try:
+            server = DaemonServer(args.serve or default_socket_path(), worker).start()
+        except OSError as exc:
+            event_log.stop()
+            parser.error(f"cannot serve on {args.serve or default_socket_path()}: {exc}")
+    coalescer = EventCoalescer(args.quiet_window)
+    handlers = _handlers(coalescer, worker)
+    signal.signal(signal.SIGTERM, _terminate)
+    logging.info("=== Monitoring Started ===")
+    for path, same in dropped:
+        logging.warning(f"{path} is the same directory as {same}, watching it once")
+    for inner, outer in nested_roots(roots).items():
+        logging.info(f"{inner} is inside {outer}: its changes are reported under {inner}")
+    if server is not None:
+        logging.info(f"Serving events on {server.path}")
+    worker.start()
+    ok = True
+    try:
+        while ok and worker.is_alive():
+            try:
+                _, kind, payload = results.get(timeout=0.5)
+            except queue.Empty:
+                pass
+            else:
+                handle_message(kind, payload, handlers)
+                ok = kind != 'error'
+                if server is not None:
+                    server.publish(kind, payload)
+            if server is not None:
+                for message in server.notices():
+                    logging.info(message)
+            if coalescer:
+                log_changes(coalescer.settled(), worker.snapshot, runner)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        worker.stop()
+        worker.join(STOP_TIMEOUT)
+        while ok:
+            try:
+                _, kind, payload = results.get_nowait()
+            except queue.Empty:
+                break
+            handle_message(kind, payload, handlers)
+            ok = kind != 'error'
+        log_changes(coalescer.flush(), worker.snapshot, runner)
+        if server is not None:
+            server.stop(STOP_TIMEOUT)
+        if runner is not None:
+            # Let the queued hook jobs finish, within reason
+            runner.stop()
+            runner.join(STOP_TIMEOUT)
+            for message in runner.failures():
+                logging.warning(message)
+        logging.info("=== Monitoring Stopped ===")
+        event_log.stop()
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
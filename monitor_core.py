@@ -0,0 +1,1745 @@
+# -*- coding: utf-8 -*-
+"""
+monitor_core.py
+
+Scanning and diff engine shared by the English and Italian GUIs.
+Standard library only and free of tkinter, so it can be used from
+worker threads and by the optional event backends.
+"""
+
+import os
+import sys
+import time
+import heapq
+import struct
+import threading
+from array import array
+from operator import attrgetter
+from collections import deque
+
+# Per-entry flags stored in a DirTable
+F_DIR     = 0x01    # entry is a directory (or a symlink to one)
+F_DESCEND = 0x02    # directory the walk descends into
+F_MATCH   = 0x04    # passes the include/exclude globs
+F_LISTED  = 0x08    # part of the snapshot: matched and stat() succeeded
+
+# Entries a structure-only pass must still stat: directories, and matching
+# entries whose stat failed last time
+_RESTAT_MASK = bytes(1 if (f & F_DIR or (f & F_MATCH and not f & F_LISTED)) else 0
+                     for f in range(256))
+
+# Flags of a file whose stat a large_dirs listing may carry over
+_REUSABLE = F_MATCH | F_LISTED
+
+# Directories modified this close to the moment they were listed may have
+# changed again within the same timestamp tick, so they are always re-listed
+RACY_NS = 2 * 10**9
+
+# In large_dirs mode, files modified less than this long ago are still
+# being written to: they are stat'ed on every poll until they settle
+SETTLE_NS = 60 * 10**9
+
+# large_dirs only skips the stat of settled files in the directories of a
+# non-recursive root holding at least this many entries
+LARGE_DIR_ENTRIES = 10000
+
+# Shortest poll interval the front-ends accept (s); 0 would poll in a busy loop
+MIN_INTERVAL = 0.1
+
+# While changes keep coming, the worker saves its snapshot at most this often (s)
+SAVE_INTERVAL = 60.0
+
+# Adaptive polling: a quiet root's interval grows by ADAPTIVE_BACKOFF per
+# poll up to ADAPTIVE_MAX_FACTOR times the base interval, and each due time
+# is moved by up to +-ADAPTIVE_JITTER of the interval
+ADAPTIVE_BACKOFF = 2.0
+ADAPTIVE_MAX_FACTOR = 12
+ADAPTIVE_JITTER = 0.1
+
+# A path that keeps changing is reported after being held this many quiet
+# windows at most (see EventCoalescer)
+COALESCE_MAX_HOLD = 10
+
+class ScanCancelled(Exception):
+    """Raised inside a scan when its cancel event has been set."""
+
+class DirTable:
+    """
+    The entries of one directory in compact form.
+
+    Entry names are joined with NUL into a single string, with one flags
+    byte per entry and array columns for st_ino, st_size and st_mtime_ns.
+    The directory's own device, inode and mtime are kept so an unchanged
+    directory does not have to be listed again.
+    """
+    __slots__ = ('dev', 'ino', 'mtime_ns', 'listed_ns', 'names', 'flags',
+                 'inos', 'sizes', 'mtimes', 'count')
+
+    def __init__(self, dev, ino, mtime_ns, listed_ns, names, flags, inos, sizes, mtimes, count):
+        self.dev = dev
+        self.ino = ino
+        self.mtime_ns = mtime_ns
+        self.listed_ns = listed_ns
+        self.names = names          # 'a\0b\0c'
+        self.flags = flags          # bytes
+        self.inos = inos            # array('Q')
+        self.sizes = sizes          # array('q')
+        self.mtimes = mtimes        # array('q')
+        self.count = count          # entries with F_LISTED
+
+    def unchanged(self, st):
+        """True if 'st' (the directory's stat) shows no entry can have changed."""
+        return (st.st_ino == self.ino and st.st_mtime_ns == self.mtime_ns
+                and self.mtime_ns < self.listed_ns - RACY_NS)
+
+    def name_list(self):
+        return self.names.split('\0') if self.names else []
+
+    def index(self, name):
+        """Position of entry 'name', or -1."""
+        names, pos = self.names, 0
+        while True:
+            pos = names.find(name, pos)
+            if pos < 0:
+                return -1
+            end = pos + len(name)
+            if (pos == 0 or names[pos - 1] == '\0') and (end == len(names) or names[end] == '\0'):
+                return names.count('\0', 0, pos)
+            pos = end
+
+    def listed(self):
+        """Yield (name, is_dir, index) for every entry in the snapshot."""
+        flags = self.flags
+        for i, name in enumerate(self.name_list()):
+            if flags[i] & F_LISTED:
+                yield name, flags[i] & F_DIR, i
+
+class Snapshot:
+    """
+    Compact scan result. 'roots' maps each resolved base path to a dict
+    from relative directory prefix ('' for the base itself, 'a/b/' below
+    it) to the DirTable of that directory. Entries are addressed as
+    (base, rel) pairs, rel being '/' separated with directories ending in
+    '/', and carry (st_ino, st_size, st_mtime_ns).
+    """
+    def __init__(self, key=None):
+        self.key = key
+        self.roots = {}
+
+    def __len__(self):
+        return sum(t.count for tables in self.roots.values() for t in tables.values())
+
+    def __iter__(self):
+        for base, rel, _ in self.items():
+            yield base, rel
+
+    def __contains__(self, entry):
+        return self.get(*entry) is not None
+
+    def items(self):
+        """Yield (base, rel, (ino, size, mtime_ns)) for every entry."""
+        for base, tables in self.roots.items():
+            for prefix, table in tables.items():
+                for name, is_dir, i in table.listed():
+                    rel = prefix + name + '/' if is_dir else prefix + name
+                    yield base, rel, (table.inos[i], table.sizes[i], table.mtimes[i])
+
+    def get(self, base, rel):
+        """Return (ino, size, mtime_ns) for one entry, or None."""
+        is_dir = rel.endswith('/')
+        path = rel[:-1] if is_dir else rel
+        cut = path.rfind('/') + 1
+        table = self.roots.get(base, {}).get(path[:cut])
+        if table is None:
+            return None
+        i = table.index(path[cut:])
+        if i < 0 or not table.flags[i] & F_LISTED or bool(table.flags[i] & F_DIR) != is_dir:
+            return None
+        return table.inos[i], table.sizes[i], table.mtimes[i]
+
+class ScanStats:
+    """
+    What one scan_changes() pass cost for one base directory: directories
+    listed and re-stat'ed without listing, entries looked at, entries left
+    out by the hidden flag or the globs, failed stat calls, the seconds
+    spent waiting on the scan and diffing, and the events reported.
+    Scan threads add to the counters concurrently, through add().
+    """
+    __slots__ = ('dirs_listed', 'dirs_restat', 'visited', 'filtered', 'stat_errors',
+                 'scan_s', 'diff_s', 'events', '_lock')
+    FIELDS = __slots__[:-1]
+
+    def __init__(self):
+        for name in self.FIELDS:
+            setattr(self, name, 0)
+        self._lock = threading.Lock()
+
+    def add(self, listed=0, restat=0, visited=0, filtered=0, stat_errors=0):
+        with self._lock:
+            self.dirs_listed += listed
+            self.dirs_restat += restat
+            self.visited += visited
+            self.filtered += filtered
+            self.stat_errors += stat_errors
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    @classmethod
+    def total(cls, many):
+        """A ScanStats summing the counters of each one in 'many'."""
+        total = cls()
+        for stats in many:
+            for name in cls.FIELDS:
+                setattr(total, name, getattr(total, name) + getattr(stats, name))
+        return total
+
+def count_events(changes, stats):
+    """Add the entries of a changes tuple to the 'events' of each base's ScanStats."""
+    added, removed, modified, moved = changes
+    for base, _ in (*added, *removed, *modified, *(new for _, new in moved)):
+        if base not in stats:
+            stats[base] = ScanStats()
+        stats[base].events += 1
+
+def _changed_roots(changes):
+    """The bases a changes tuple has entries in, counted as count_events() does; () for None."""
+    if changes is None:
+        return ()
+    added, removed, modified, moved = changes
+    return {base for base, _ in (*added, *removed, *modified, *(new for _, new in moved))}
+
+# fnmatch.fnmatch() normalises case (and separators) on Windows; do the same
+_NORMCASE = os.path.normcase('A/') != 'A/'
+
+def _compile_globs(patterns):
+    """Compile fnmatch patterns into one regex; returns its match() or None."""
+    if not patterns:
+        return None
+    # fnmatch pulls in re, the bulk of this module's import time; only
+    # filters that have patterns need it
+    import re
+    import fnmatch
+    if _NORMCASE:
+        patterns = [os.path.normcase(p) for p in patterns]
+    return re.compile('|'.join(fnmatch.translate(p) for p in patterns)).match
+
+class PathFilter:
+    """
+    Include/exclude glob lists compiled once into a single regex each.
+
+    Patterns use fnmatch syntax and are matched against the relative path
+    ('/' separated, directories ending in '/'). An exclude pattern that
+    ends in '/' also prunes the directories it matches: nothing below them
+    is listed, stat'ed or reported. Filters are immutable; build a new one
+    when the pattern lists change.
+    """
+    def __init__(self, includes=(), excludes=()):
+        self.includes = tuple(includes)
+        self.excludes = tuple(excludes)
+        self._inc = _compile_globs(self.includes)
+        self._exc = _compile_globs(self.excludes)
+        self._prune = _compile_globs([p for p in self.excludes if p.endswith('/')])
+        self.prunes_dirs = self._prune is not None
+
+    def __eq__(self, other):
+        return (isinstance(other, PathFilter)
+                and (self.includes, self.excludes) == (other.includes, other.excludes))
+
+    def __hash__(self):
+        return hash((self.includes, self.excludes))
+
+    def __repr__(self):
+        return f"PathFilter(includes={list(self.includes)}, excludes={list(self.excludes)})"
+
+    def matches(self, rel):
+        """Return True if 'rel' passes the include and exclude lists."""
+        if _NORMCASE:
+            rel = os.path.normcase(rel)
+        if self._inc is not None and self._inc(rel) is None:
+            return False
+        return self._exc is None or self._exc(rel) is None
+
+    def prunes(self, rel):
+        """Return True if directory 'rel' (ending in '/') is excluded with its subtree."""
+        if self._prune is None:
+            return False
+        if _NORMCASE:
+            rel = os.path.normcase(rel)
+        return self._prune(rel) is not None
+
+def normalize_roots(paths):
+    """
+    Resolve the watched 'paths' and drop those naming a directory already
+    in the list: listed twice, reached through a symlink, or the same
+    directory seen through a bind mount. Returns (roots, dropped), the
+    latter as (path, root it duplicates) pairs. Paths that cannot be
+    stat'ed are kept, compared by resolved path only.
+    """
+    roots, dropped, seen = [], [], {}
+    for path in paths:
+        real = os.path.realpath(path)
+        try:
+            st = os.stat(real)
+            identity = (st.st_dev, st.st_ino)
+        except OSError:
+            identity = real
+        if identity in seen:
+            dropped.append((path, seen[identity]))
+            continue
+        seen[identity] = real
+        roots.append(real)
+    return roots, dropped
+
+def nested_roots(roots):
+    """
+    Map each of the resolved 'roots' lying below another one to the
+    closest root containing it. Walks of the outer root leave the inner
+    one out, so its entries are scanned once and reported under it.
+    """
+    nested = {}
+    for root in roots:
+        for other in roots:
+            if (other != root and root.startswith(other.rstrip(os.sep) + os.sep)
+                    and len(other) > len(nested.get(root, ''))):
+                nested[root] = other
+    return nested
+
+def scan_directories(bases, recursive, include_hidden, path_filter, cancel=None,
+                     previous=None, structure_only=False, workers=1, large_dirs=False):
+    """
+    Walk each base directory and return a Snapshot of every entry that
+    passes the recursive flag, hidden filter and PathFilter globs.
+
+    Traversal uses os.scandir so the entry type and stat data cached on
+    each DirEntry are reused instead of issuing extra syscalls per file.
+    If 'cancel' (a threading.Event) gets set, ScanCancelled is raised
+    before the next directory is listed.
+
+    Given the 'previous' Snapshot taken with the same settings, directories
+    whose mtime is unchanged are not listed again: their entries are just
+    stat'ed, or, with 'structure_only', keep their previous values so only
+    directories are stat'ed. Tables that did not change are shared with
+    'previous', never modified.
+
+    'large_dirs' tunes the scan for folders of hundreds of thousands of
+    files. Directories are listed with their entries sorted by name, and
+    sorted tables are diffed by merging their name lists (see
+    diff_tables()). In a non-recursive scan, a directory of at least
+    LARGE_DIR_ENTRIES entries also skips the stat of settled files: if
+    unchanged, it is handled as with 'structure_only', except that files
+    modified less than SETTLE_NS ago are still stat'ed; if it changed, a
+    file found again under the same name and inode keeps its previous
+    values without a stat, unless it is settling as well. A file rewritten
+    in place more than SETTLE_NS after its last write then goes unnoticed.
+
+    With 'workers' > 1 the bases, and the top-level subdirectories of each
+    base, are scanned concurrently by that many threads, which pays off
+    when listing and stat latency dominate (network mounts, several
+    disks). Results are merged in a fixed order, base by base.
+
+    A base below another one is left out of the outer base's walk (see
+    nested_roots()), and a directory reached a second time in one walk,
+    through a bind mount, is not descended into again.
+    """
+    bases = list(dict.fromkeys(os.path.realpath(base) for base in bases))
+    walker = _Walker(recursive, include_hidden, path_filter, cancel, previous, structure_only,
+                     skip=nested_roots(bases), large_dirs=large_dirs)
+    for base, found in walker.bases(bases, workers):
+        tables = walker.snapshot.roots.setdefault(base, {})
+        for prefix, table in found:
+            tables[prefix] = table
+    return walker.snapshot
+
+def scan_changes(bases, recursive, include_hidden, path_filter, snapshot, cancel=None,
+                 structure_only=False, workers=1, detect_moves=True, stats=None, only=None,
+                 idle=False, large_dirs=False):
+    """
+    Rescan the bases and bring 'snapshot' up to date in place, yielding
+    the changes as they are found as (added, removed, modified, moved)
+    tuples, in the form compare_snapshots() returns.
+
+    Each directory is diffed against its previous table as soon as it has
+    been listed, so only one copy of the snapshot is kept and the first
+    changes are known before a long scan finishes. Directories no longer
+    reached are reported removed once their base has been walked. With
+    'detect_moves', added and removed entries are held back until then as
+    well, so that renames within the base can be paired up. The other
+    arguments are those of scan_directories(); stopping early (or
+    ScanCancelled) leaves a snapshot that the next call fully re-lists.
+
+    Given a dict as 'stats', it receives a ScanStats per base. Given
+    'only', a collection of resolved base paths, just those bases are
+    rescanned; the others keep their tables, which must have been taken
+    with the same settings. With 'idle', None is yielded for each
+    directory that brought nothing to report, so a caller can suspend the
+    scan between any two directories (see SlicedWorker).
+    """
+    bases = list(dict.fromkeys(os.path.realpath(base) for base in bases))
+    walker = _Walker(recursive, include_hidden, path_filter, cancel, snapshot, structure_only,
+                     skip=nested_roots(bases), large_dirs=large_dirs)
+    snapshot.key = None
+    scanned = bases if only is None else [base for base in bases if base in only]
+    if stats is not None:
+        for base in scanned:
+            stats[base] = ScanStats()
+        walker.stats = stats
+    clock = time.perf_counter
+    for base, found in walker.bases(scanned, workers):
+        tables = snapshot.roots.setdefault(base, {})
+        base_stats = stats[base] if stats is not None else ScanStats()
+        seen = set()
+        held = set(), set(), {}  # added, removed, identities
+        for prefix, table in _timed(found, base_stats):
+            seen.add(prefix)
+            old = tables.get(prefix)
+            if table is old:
+                if idle:
+                    yield None
+                continue
+            tables[prefix] = table
+            t0 = clock()
+            if detect_moves:
+                modified = set()
+                diff_tables(base, prefix, old, table, held[0], held[1], modified, held[2])
+                base_stats.diff_s += clock() - t0
+                if modified:
+                    base_stats.events += len(modified)
+                    yield set(), set(), modified, set()
+                elif idle:
+                    yield None
+            else:
+                changes = set(), set(), set(), set()
+                diff_tables(base, prefix, old, table, *changes[:3])
+                base_stats.diff_s += clock() - t0
+                if any(changes):
+                    base_stats.events += sum(map(len, changes))
+                    yield changes
+                elif idle:
+                    yield None
+        t0 = clock()
+        added, removed, identities = held
+        if not detect_moves:
+            identities = None
+        for prefix in [p for p in tables if p not in seen]:
+            diff_tables(base, prefix, tables.pop(prefix), None, added, removed, set(), identities)
+        modified = set()
+        moved = pair_moves(added, removed, modified, identities) if detect_moves else set()
+        base_stats.diff_s += clock() - t0
+        if added or removed or modified or moved:
+            base_stats.events += len(added) + len(removed) + len(modified) + len(moved)
+            yield added, removed, modified, moved
+    for base in [b for b in snapshot.roots if b not in bases]:
+        removed = set()
+        for prefix, table in snapshot.roots.pop(base).items():
+            diff_tables(base, prefix, table, None, set(), removed, set())
+        if removed:
+            yield set(), removed, set(), set()
+    snapshot.key = walker.key
+
+def _timed(items, stats):
+    """Iterate over 'items', adding the time spent waiting on each to stats.scan_s."""
+    clock = time.perf_counter
+    items = iter(items)
+    while True:
+        t0 = clock()
+        item = next(items, None)
+        stats.scan_s += clock() - t0
+        if item is None:
+            return
+        yield item
+
+class PollScheduler:
+    """
+    Decides which watch roots are due for a poll, for ScanWorker's
+    adaptive mode. Each root has its own interval between a minimum and a
+    maximum: a poll that finds changes puts it back to the minimum, a
+    quiet one multiplies it by ADAPTIVE_BACKOFF. A busy root is thus
+    polled as often as configured while a tree that never changes settles
+    at the maximum. Due times sit in a heap, with jitter so that roots
+    added together drift apart.
+    """
+    def __init__(self, seed=None):
+        # Only the adaptive mode needs random; keep it off the import path
+        import random
+        self._random = random.Random(seed)
+        self._heap = []     # (due, root), stale entries skipped
+        self._roots = {}    # root -> [interval, min, max, due]
+
+    def configure(self, roots, interval, limits=None, now=None):
+        """
+        Set the roots to schedule and their limits: 'limits' maps a root
+        to its own (min, max), either of which may be None; by default a
+        root polls every 'interval' seconds at most and every
+        ADAPTIVE_MAX_FACTOR times that at least. New roots are due at
+        once, roots no longer listed are dropped.
+        """
+        now = time.monotonic() if now is None else now
+        limits = limits or {}
+        for root in [r for r in self._roots if r not in roots]:
+            del self._roots[root]
+        for root in roots:
+            low, high = limits.get(root) or (None, None)
+            low = interval if low is None else low
+            high = max(interval * ADAPTIVE_MAX_FACTOR if high is None else high, low)
+            state = self._roots.get(root)
+            if state is None:
+                self._roots[root] = [low, low, high, now]
+                heapq.heappush(self._heap, (now, root))
+            elif state[1:3] != [low, high]:
+                state[1:3] = low, high
+                current = min(max(state[0], low), high)
+                if current != state[0]:
+                    # Bring the next poll forward (or back) to the new limits
+                    self._push(root, state, current, state[3] - state[0])
+
+    def wait(self, now=None):
+        """Seconds until the next root is due (0 if one already is), or None."""
+        now = time.monotonic() if now is None else now
+        heap = self._heap
+        while heap and self._stale(*heap[0]):
+            heapq.heappop(heap)
+        return max(heap[0][0] - now, 0.0) if heap else None
+
+    def due(self, now=None):
+        """Take the roots due by 'now' off the heap and return them."""
+        now = time.monotonic() if now is None else now
+        heap, roots = self._heap, []
+        while heap and heap[0][0] <= now:
+            due, root = heapq.heappop(heap)
+            if not self._stale(due, root):
+                roots.append(root)
+        return roots
+
+    def done(self, root, changed, now=None):
+        """Schedule the next poll of 'root' after one that did or did not find changes."""
+        state = self._roots.get(root)
+        if state is None:
+            return
+        now = time.monotonic() if now is None else now
+        interval, low, high, _ = state
+        interval = low if changed else min(max(interval * ADAPTIVE_BACKOFF, low), high)
+        self._push(root, state, interval, now)
+
+    def _push(self, root, state, interval, start):
+        jitter = interval * ADAPTIVE_JITTER * self._random.uniform(-1.0, 1.0)
+        state[0] = interval
+        state[3] = start + interval + jitter
+        heapq.heappush(self._heap, (state[3], root))
+
+    def _stale(self, due, root):
+        state = self._roots.get(root)
+        return state is None or state[3] != due
+
+    def intervals(self):
+        """Current interval of each root, in seconds."""
+        return {root: state[0] for root, state in self._roots.items()}
+
+def scan_subtree(base, path, prefix, recursive, include_hidden, path_filter, cancel=None,
+                 previous=None, skip=()):
+    """
+    Scan only the directory 'path', found at relative path 'prefix' below
+    the resolved 'base'. The Snapshot returned holds just the tables of
+    that subtree, filtered as a full scan_directories() of 'base' would;
+    'skip' holds the other watched roots not to descend into.
+    """
+    walker = _Walker(recursive, include_hidden, path_filter, cancel, previous, skip=skip)
+    walker.walk(base, path, prefix)
+    return walker.snapshot
+
+def list_directory(path, prefix, st, recursive, include_hidden, path_filter, skip=()):
+    """
+    List the single directory 'path' (relative 'prefix', stat result 'st')
+    into a DirTable. Returns (table, subdirs) as _Walker.list_dir() does.
+    """
+    return _Walker(recursive, include_hidden, path_filter, skip=skip).list_dir(path, prefix, st)
+
+def _in_order(names):
+    """True if the list 'names' is sorted, as tables listed with large_dirs are."""
+    return all(map(str.__lt__, names, names[1:]))
+
+class _Walker:
+    """One scan pass over one or more trees, see scan_directories()."""
+    def __init__(self, recursive, include_hidden, path_filter, cancel=None,
+                 previous=None, structure_only=False, skip=(), large_dirs=False):
+        self.recursive = recursive
+        self.include_hidden = include_hidden
+        self.path_filter = path_filter
+        self.cancel = cancel
+        self.structure_only = structure_only
+        self.large_dirs = large_dirs
+        self.key = (recursive, include_hidden, path_filter)
+        self.stats = None   # {base: ScanStats} to count into, see scan_changes()
+        self.skip = frozenset(skip)  # directories never descended into: nested roots
+        self._seen = {}     # base -> {(st_dev, st_ino): prefix} of the directories walked
+        if previous is not None and previous.key == self.key:
+            self.previous = previous.roots
+        else:
+            self.previous = {}
+        self.snapshot = Snapshot(self.key)
+
+    def walk(self, base, path, prefix):
+        tables = self.snapshot.roots.setdefault(base, {})
+        for prefix, table in self.tables(base, path, prefix):
+            tables[prefix] = table
+
+    def bases(self, bases, workers=1):
+        """
+        Yield (base, tables) for each base in order, 'tables' iterating
+        over its (prefix, table) pairs. With several workers the bases and
+        their top-level subdirectories are walked on a thread pool.
+        """
+        if workers <= 1:
+            for base in bases:
+                yield base, self.tables(base, base, '')
+            return
+        # Imported here: it costs more than the rest of this module to load
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan") as pool:
+            roots = [pool.submit(self._split_root, pool, base) for base in bases]
+            for base, root in zip(bases, roots):
+                yield base, self._merge(base, root)
+
+    def _split_root(self, pool, base):
+        """
+        Pool job: visit a base and submit one job per subdirectory, each
+        with its own copy of the directories seen so far (see _merge()).
+        """
+        self._check_cancel()
+        seen = self._seen.setdefault(base, {})
+        visit = self.visit(base, '', None, self.previous.get(base, {}), self._stats(base), seen)
+        if visit is None:
+            return None, []
+        table, subdirs = visit
+        jobs = [pool.submit(lambda args: list(self.tables(base, *args, seen=dict(seen))), sub)
+                for sub in subdirs]
+        return table, jobs
+
+    def _merge(self, base, root):
+        """
+        Yield the tables of a base walked on the pool in the order one
+        thread walks them: the subdirectory jobs last to first, as they
+        come off the stack in tables(). A directory that several jobs
+        reached (a bind mount) is kept under the prefix met first in that
+        order, as in a single-threaded walk, whichever job ran first.
+        """
+        table, jobs = root.result()
+        if table is not None:
+            yield '', table
+        seen = self._seen.setdefault(base, {})
+        dropped = ()
+        for job in reversed(jobs):
+            for prefix, table in job.result():
+                if prefix.startswith(dropped):
+                    continue
+                if seen.setdefault((table.dev, table.ino), prefix) != prefix:
+                    dropped += (prefix,)
+                    continue
+                yield prefix, table
+
+    def _stats(self, base):
+        return self.stats.get(base) if self.stats is not None else None
+
+    def _check_cancel(self):
+        if self.cancel is not None and self.cancel.is_set():
+            raise ScanCancelled()
+
+    def tables(self, base, path, prefix, st=None, seen=None):
+        """
+        Yield (prefix, table) for 'path' and each directory walked below it;
+        'seen' holds the directories already walked, by default the base's.
+        """
+        old_tables = self.previous.get(base, {})
+        stats = self._stats(base)
+        if seen is None:
+            seen = self._seen.setdefault(base, {})
+        stack = [(path, prefix, st)]
+        while stack:
+            self._check_cancel()
+            path, prefix, st = stack.pop()
+            visit = self.visit(path, prefix, st, old_tables, stats, seen)
+            if visit is None:
+                continue
+            table, subdirs = visit
+            # Read the subdirectories before the caller may replace 'old'
+            stack.extend(subdirs)
+            yield prefix, table
+
+    def visit(self, path, prefix, st, old_tables, stats=None, seen=None):
+        """
+        Refresh one directory; returns (table, subdirs), or None if it is
+        unreadable or, per 'seen', already walked under another prefix.
+        """
+        try:
+            if st is None:
+                st = os.stat(path)
+        except OSError:
+            if stats is not None:
+                stats.add(stat_errors=1)
+            return None
+        # A bind mount of a directory of the tree, or one looping back to
+        # an ancestor, is left out rather than walked again (or forever)
+        if seen is not None and seen.setdefault((st.st_dev, st.st_ino), prefix) != prefix:
+            return None
+        old = old_tables.get(prefix)
+        if old is not None and old.unchanged(st):
+            return self.restat_dir(old, path, prefix, stats)
+        table, subdirs = self.list_dir(path, prefix, st, stats, old if self._skips_settled(old) else None)
+        if table is None:
+            return None
+        return table, subdirs
+
+    def _skips_settled(self, old):
+        """True if the settled files of table 'old' are not stat'ed again (large_dirs)."""
+        return (self.large_dirs and not self.recursive
+                and old is not None and len(old.flags) >= LARGE_DIR_ENTRIES)
+
+    def list_dir(self, path, prefix, st, stats=None, old=None):
+        """
+        List directory 'path' (stat result 'st') into a new DirTable.
+        Returns (table, subdirs) with subdirs as (path, prefix, stat) to
+        descend into; table is None if the directory cannot be read. The
+        work done is added to 'stats', a ScanStats, if given.
+
+        In large_dirs mode the entries are sorted by name and, given 'old',
+        its previous table, settled files that kept their inode reuse the
+        values in 'old' instead of being stat'ed.
+        """
+        include_hidden, recursive, skip = self.include_hidden, self.recursive, self.skip
+        matches = self.path_filter.matches
+        prunes = self.path_filter.prunes if self.path_filter.prunes_dirs else None
+        names, flags = [], bytearray()
+        inos, sizes, mtimes = array('Q'), array('q'), array('q')
+        subdirs = []
+        count = filtered = failed = lost = 0
+        listed_ns = int(time.time() * 1e9)
+        try:
+            it = os.scandir(path)
+        except OSError:
+            if stats is not None:
+                stats.add(stat_errors=1)
+            return None, subdirs
+        with it:
+            if self.large_dirs:
+                it = sorted(it, key=attrgetter('name'))
+            if old is not None:
+                old_names = old.name_list()
+                if not _in_order(old_names):
+                    old = None  # listed without large_dirs: stat everything this once
+            if old is not None:
+                old_flags, old_inos = old.flags, old.inos
+                old_sizes, old_mtimes = old.sizes, old.mtimes
+                settled = listed_ns - SETTLE_NS
+                j, n_old = 0, len(old_names)
+            for entry in it:
+                name = entry.name
+                if old is not None:
+                    # Both name lists are sorted: step through the old one. A
+                    # settled file with the same inode passed the filters before
+                    while j < n_old and old_names[j] < name:
+                        j += 1
+                    if (j < n_old and old_names[j] == name and old_flags[j] == _REUSABLE
+                            and old_mtimes[j] <= settled and old_inos[j] == entry.inode()
+                            and not entry.is_dir()):
+                        names.append(name)
+                        flags.append(_REUSABLE)
+                        inos.append(old_inos[j])
+                        sizes.append(old_sizes[j])
+                        mtimes.append(old_mtimes[j])
+                        count += 1
+                        continue
+                if not include_hidden and name.startswith('.'):
+                    filtered += 1
+                    continue
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    rel = prefix + name + '/'
+                    if prunes is not None and prunes(rel):
+                        filtered += 1
+                        continue
+                    flag = F_DIR
+                    # like os.walk(): list symlinked dirs, don't descend;
+                    # nor into another watched root, which is walked itself
+                    if recursive and not entry.is_symlink() and not (skip and entry.path in skip):
+                        flag |= F_DESCEND
+                else:
+                    rel = prefix + name
+                    flag = 0
+                if matches(rel):
+                    flag |= F_MATCH
+                elif not flag & F_DESCEND:
+                    filtered += 1
+                    continue
+                try:
+                    est = entry.stat()
+                except OSError:
+                    failed += 1
+                    if not flag & F_MATCH:
+                        lost += 1
+                        continue
+                    est = None
+                names.append(name)
+                if est is None:
+                    flags.append(flag)
+                    inos.append(0)
+                    sizes.append(0)
+                    mtimes.append(0)
+                    continue
+                if flag & F_MATCH:
+                    flag |= F_LISTED
+                    count += 1
+                if flag & F_DESCEND:
+                    subdirs.append((entry.path, rel, est))
+                flags.append(flag)
+                inos.append(est.st_ino)
+                sizes.append(est.st_size)
+                mtimes.append(est.st_mtime_ns)
+        if stats is not None:
+            visited = len(names) + filtered + lost
+            stats.add(listed=1, visited=visited, filtered=filtered, stat_errors=failed)
+        table = DirTable(st.st_dev, st.st_ino, st.st_mtime_ns, listed_ns, '\0'.join(names), bytes(flags), inos, sizes, mtimes, count)
+        return table, subdirs
+
+    def restat_dir(self, old, path, prefix, stats=None):
+        """
+        Refresh an unchanged directory's entries without listing it. Returns
+        (table, subdirs) as list_dir() does; 'old' itself is returned when
+        nothing changed.
+        """
+        skips_settled = self._skips_settled(old)
+        if self.structure_only or skips_settled:
+            mask = old.flags.translate(_RESTAT_MASK)
+            todo = []
+            i = mask.find(1)
+            while i >= 0:
+                todo.append(i)
+                i = mask.find(1, i + 1)
+            if skips_settled:
+                settled = int(time.time() * 1e9) - SETTLE_NS
+                if max(old.mtimes, default=0) > settled:
+                    recent = [i for i, mtime in enumerate(old.mtimes) if mtime > settled]
+                    todo = sorted(set(todo).union(recent))
+            if not todo:
+                if stats is not None:
+                    stats.add(restat=1)
+                return old, []
+        else:
+            todo = range(len(old.flags))
+        names = old.name_list()
+        flags = bytearray(old.flags)
+        inos, sizes, mtimes = array('Q', old.inos), array('q', old.sizes), array('q', old.mtimes)
+        count = old.count
+        subdirs = []
+        sep = os.sep
+        skip = self.skip  # tables saved before a root was added may still descend into it
+        failed = 0
+        for i in todo:
+            name = names[i]
+            flag = flags[i]
+            try:
+                est = os.stat(path + sep + name)
+            except OSError:
+                failed += 1
+                if flag & F_LISTED:
+                    flags[i] = flag & ~F_LISTED
+                    count -= 1
+                continue
+            if flag & F_MATCH and not flag & F_LISTED:
+                flags[i] = flag | F_LISTED
+                count += 1
+            if flag & F_DESCEND and not (skip and path + sep + name in skip):
+                subdirs.append((path + sep + name, prefix + name + '/', est))
+            inos[i] = est.st_ino
+            sizes[i] = est.st_size
+            mtimes[i] = est.st_mtime_ns
+        if stats is not None:
+            stats.add(restat=1, visited=len(todo), stat_errors=failed)
+        if (count == old.count and mtimes == old.mtimes and sizes == old.sizes
+                and inos == old.inos and flags == old.flags):
+            return old, subdirs
+        table = DirTable(old.dev, old.ino, old.mtime_ns, old.listed_ns, old.names, bytes(flags), inos, sizes, mtimes, count)
+        return table, subdirs
+
+def compare_snapshots(old, new, detect_moves=True):
+    """
+    Compare two Snapshots and return (added, removed, modified, moved).
+    The first three are sets of (base, rel) pairs; an entry is modified
+    when its mtime or size changed. 'moved' holds ((base, old_rel), (base, new_rel))
+    pairs for removed and added entries found to be the same file or
+    directory (see pair_moves()); without 'detect_moves' it stays empty.
+    """
+    added, removed, modified = set(), set(), set()
+    identities = {} if detect_moves else None
+    for base in old.roots.keys() | new.roots.keys():
+        old_tables = old.roots.get(base, {})
+        new_tables = new.roots.get(base, {})
+        for prefix in old_tables.keys() | new_tables.keys():
+            diff_tables(base, prefix, old_tables.get(prefix), new_tables.get(prefix),
+                        added, removed, modified, identities)
+    moved = pair_moves(added, removed, modified, identities) if detect_moves else set()
+    return added, removed, modified, moved
+
+def diff_tables(base, prefix, old, new, added, removed, modified, identities=None):
+    """
+    Add the differences between two versions of one directory to the sets.
+    An entry is modified when its mtime (in nanoseconds) or its size
+    changed, which catches rewrites within the timestamp granularity of
+    coarse filesystems as long as the size differs. If 'identities' is a dict, it also receives the identity (see
+    pair_moves()) of every entry put in 'added' or 'removed'. Tables whose
+    names are both sorted (large_dirs) are diffed by merging the two lists.
+    """
+    if old is new:
+        return
+    if old is not None and new is not None and old.names == new.names:
+        # Same entries in the same order: compare column by column
+        if old.flags == new.flags and old.mtimes == new.mtimes and old.sizes == new.sizes:
+            return
+        names = new.name_list()
+        for i, name in enumerate(names):
+            was, now = old.flags[i] & F_LISTED, new.flags[i] & F_LISTED
+            if not (was or now):
+                continue
+            is_dir = new.flags[i] & F_DIR
+            if was and now and old.flags[i] & F_DIR == is_dir:
+                if old.mtimes[i] != new.mtimes[i] or old.sizes[i] != new.sizes[i]:
+                    modified.add((base, prefix + name + '/' if is_dir else prefix + name))
+                continue
+            # Appeared, disappeared, or a file replaced by a directory (or back)
+            if was:
+                rel = prefix + name + '/' if old.flags[i] & F_DIR else prefix + name
+                removed.add((base, rel))
+                if identities is not None:
+                    identities[base, rel] = _identity(old, i)
+            if now:
+                rel = prefix + name + '/' if is_dir else prefix + name
+                added.add((base, rel))
+                if identities is not None:
+                    identities[base, rel] = _identity(new, i)
+        return
+    if old is not None and new is not None:
+        old_names, new_names = old.name_list(), new.name_list()
+        if _in_order(new_names) and _in_order(old_names):
+            _merge_tables(base, prefix, old, new, old_names, new_names,
+                          added, removed, modified, identities)
+            return
+    before = {}
+    if old is not None:
+        for name, is_dir, i in old.listed():
+            before[name + '/' if is_dir else name] = i
+    if new is not None:
+        for name, is_dir, i in new.listed():
+            key = name + '/' if is_dir else name
+            j = before.pop(key, None)
+            if j is None:
+                added.add((base, prefix + key))
+                if identities is not None:
+                    identities[base, prefix + key] = _identity(new, i)
+            elif old.mtimes[j] != new.mtimes[i] or old.sizes[j] != new.sizes[i]:
+                modified.add((base, prefix + key))
+    for key, j in before.items():
+        removed.add((base, prefix + key))
+        if identities is not None:
+            identities[base, prefix + key] = _identity(old, j)
+
+def _merge_tables(base, prefix, old, new, old_names, new_names, added, removed, modified,
+                  identities):
+    """diff_tables() of two tables whose name lists are sorted, in one pass over both."""
+    def report(name, table, i, into):
+        rel = prefix + name + '/' if table.flags[i] & F_DIR else prefix + name
+        into.add((base, rel))
+        if identities is not None:
+            identities[base, rel] = _identity(table, i)
+
+    old_flags, new_flags = old.flags, new.flags
+    i = j = 0
+    n_old, n_new = len(old_names), len(new_names)
+    while i < n_old or j < n_new:
+        if j == n_new or (i < n_old and old_names[i] < new_names[j]):
+            name = old_names[i]
+            if old_flags[i] & F_LISTED:
+                report(name, old, i, removed)
+            i += 1
+        elif i == n_old or new_names[j] < old_names[i]:
+            name = new_names[j]
+            if new_flags[j] & F_LISTED:
+                report(name, new, j, added)
+            j += 1
+        else:
+            name = new_names[j]
+            was, now = old_flags[i] & F_LISTED, new_flags[j] & F_LISTED
+            if was and now and old_flags[i] & F_DIR == new_flags[j] & F_DIR:
+                if old.mtimes[i] != new.mtimes[j] or old.sizes[i] != new.sizes[j]:
+                    rel = prefix + name + '/' if new_flags[j] & F_DIR else prefix + name
+                    modified.add((base, rel))
+            else:
+                if was:
+                    report(name, old, i, removed)
+                if now:
+                    report(name, new, j, added)
+            i += 1
+            j += 1
+
+def _identity(table, i):
+    """
+    What a rename keeps: device and inode, plus size and mtime for files
+    so that a new file reusing a deleted file's inode is not taken for it.
+    The directory's device stands in for its entries', so mount points
+    are not told apart.
+    """
+    if table.flags[i] & F_DIR:
+        return table.dev, table.inos[i]
+    return table.dev, table.inos[i], table.sizes[i], table.mtimes[i]
+
+def pair_moves(added, removed, modified, identities):
+    """
+    Take the entries of 'added' and 'removed' that share an identity out of
+    both sets and return them as a set of (old, new) moves. A directory
+    moved with its contents is reported once: moves of descendants that
+    kept their place under it are dropped, and descendants that changed on
+    the way are reported modified under their new path.
+    """
+    sources = {}
+    for entry in sorted(removed, reverse=True):
+        sources.setdefault(identities[entry], []).append(entry)
+    if not sources:
+        return set()
+    moved = set()
+    for entry in sorted(added):
+        candidates = sources.get(identities[entry])
+        if candidates:
+            old = candidates.pop()
+            moved.add((old, entry))
+            added.discard(entry)
+            removed.discard(old)
+    # Collapse the contents of moved directories into the directory's move
+    dir_moves = {old: new for old, new in moved if old[1].endswith('/')}
+    if dir_moves:
+        for old, new in list(moved):
+            if _under_moved_dir(old, new, dir_moves):
+                moved.discard((old, new))
+        for old_dir, new_dir in dir_moves.items():
+            if (old_dir, new_dir) not in moved:
+                continue
+            base, old_rel = old_dir
+            for entry in [e for e in removed if e[0] == base and e[1].startswith(old_rel)]:
+                twin = (new_dir[0], new_dir[1] + entry[1][len(old_rel):])
+                if twin in added:
+                    removed.discard(entry)
+                    added.discard(twin)
+                    modified.add(twin)  # changed on the way, or would have paired
+    return moved
+
+def _under_moved_dir(old, new, dir_moves):
+    """True if the move old -> new follows from moving a parent directory."""
+    base, rel = old
+    cut = rel.rstrip('/').rfind('/')
+    while cut >= 0:
+        parent = (base, rel[:cut + 1])
+        target = dir_moves.get(parent)
+        if target is not None and new == (target[0], target[1] + rel[cut + 1:]):
+            return True
+        cut = rel.rfind('/', 0, cut)
+    return False
+
+class EventCoalescer:
+    """
+    Holds change events back until their path has been quiet for 'window'
+    seconds, and merges what happened to it meanwhile into one event:
+    added then modified is added, added then removed is nothing, removed
+    then added is modified, and moves chain (a -> b then b -> c is a -> c,
+    a path added then moved is added at its new place, a move then a
+    removal is the removal of the original). A path that keeps changing
+    is released once it has been held COALESCE_MAX_HOLD windows anyway.
+    add() takes and settled() returns (added, removed, modified, moved)
+    tuples as compare_snapshots() builds them. Not thread-safe.
+    """
+    def __init__(self, window):
+        self.window = window
+        self._pending = {}      # (base, rel) -> [kind, origin, first, last], oldest 'last' first
+        self._firsts = deque()  # (first, entry) in the order entries arrived
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, changes, now=None):
+        now = time.monotonic() if now is None else now
+        added, removed, modified, moved = changes
+        for old, new in sorted(moved):
+            self._move(old, new, now)
+        for entry in removed:
+            self._merge(entry, 'removed', now)
+        for entry in added:
+            self._merge(entry, 'added', now)
+        for entry in modified:
+            self._merge(entry, 'modified', now)
+
+    def settled(self, now=None):
+        """Release the events whose path has been quiet long enough."""
+        now = time.monotonic() if now is None else now
+        pending, quiet = self._pending, now - self.window
+        ready = []
+        for entry, state in pending.items():
+            if state[3] > quiet:
+                break
+            ready.append(entry)
+        # Paths that never stay quiet, by the time they were first held
+        stale = now - self.window * COALESCE_MAX_HOLD
+        firsts = self._firsts
+        while firsts and (firsts[0][0] <= stale or firsts[0][1] not in pending):
+            first, entry = firsts.popleft()
+            state = pending.get(entry)
+            if state is not None and state[2] == first and state[3] > quiet:
+                ready.append(entry)
+        return self._release(ready)
+
+    def flush(self):
+        """Release every event held."""
+        return self._release(list(self._pending))
+
+    def _release(self, entries):
+        changes = set(), set(), set(), set()
+        index = {'added': 0, 'removed': 1, 'modified': 2}
+        for entry in entries:
+            state = self._pending.pop(entry, None)
+            if state is None:
+                continue
+            kind, origin = state[0], state[1]
+            if kind == 'moved':
+                changes[3].add((origin, entry))
+            else:
+                changes[index[kind]].add(entry)
+        if not self._pending:
+            self._firsts.clear()
+        return changes
+
+    def _put(self, entry, kind, origin, first, now):
+        # Re-inserted so that the dict stays ordered by last change
+        if self._pending.pop(entry, None) is None:
+            self._firsts.append((first, entry))
+        self._pending[entry] = [kind, origin, first, now]
+
+    def _merge(self, entry, kind, now):
+        state = self._pending.get(entry)
+        if state is None:
+            self._put(entry, kind, None, now, now)
+            return
+        before, origin, first = state[0], state[1], state[2]
+        if kind == 'removed':
+            if before == 'added':
+                del self._pending[entry]
+                return
+            if before == 'moved':
+                # What was moved here is gone: its original path was removed
+                del self._pending[entry]
+                entry = origin
+                replaced = self._pending.get(entry)
+                if replaced is not None and replaced[0] == 'added':
+                    self._put(entry, 'modified', None, min(first, replaced[2]), now)
+                    return
+            self._put(entry, 'removed', None, first, now)
+        elif before == 'removed':
+            self._put(entry, 'modified', None, first, now)
+        else:
+            self._put(entry, before, origin, first, now)
+
+    def _move(self, old, new, now):
+        if old[1].endswith('/'):
+            # Events held for paths inside a moved directory follow it
+            base, prefix = old
+            for entry in [e for e in self._pending if e[0] == base and e[1].startswith(prefix)]:
+                state = self._pending.pop(entry)
+                self._put((new[0], new[1] + entry[1][len(prefix):]), *state[:3], now)
+        source = self._pending.pop(old, None)
+        first = now if source is None else source[2]
+        if source is not None and source[0] == 'added':
+            kind, origin = 'added', None
+        elif source is not None and source[0] == 'moved':
+            kind, origin = 'moved', source[1]
+            if origin == new:
+                return  # moved back where it was
+        else:
+            kind, origin = 'moved', old
+        target = self._pending.get(new)
+        if target is not None:
+            first = min(first, target[2])
+            if kind == 'added' and target[0] == 'removed':
+                kind = 'modified'  # written elsewhere, then renamed over the original
+        self._put(new, kind, origin, first, now)
+
+# -- Saved snapshots ---------------------------------------------------------
+#
+# File layout: _STATE_MAGIC, the 32-byte digest of the configuration, then
+# one record per base (b'B', length, UTF-8 path) followed by its tables
+# (b'T', _TABLE_HEAD, names, flags and the three arrays in native byte
+# order). The digest covers the byte order and the array item sizes too,
+# so a file written by another platform is simply not used.
+
+_STATE_MAGIC = b'DIRMON-SNAPSHOT\x01'
+_TABLE_HEAD = struct.Struct('<QQqqIII')  # dev ino mtime_ns listed_ns count entries names_len
+_LEN = struct.Struct('<I')
+
+def default_state_dir():
+    """Per-user directory where saved snapshots are kept."""
+    if os.name == 'nt':
+        root = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        root = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(root, 'directory-monitor')
+
+def _config_digest(params):
+    import hashlib
+    bases, recursive, include_hidden, path_filter = params
+    config = (
+        [os.path.realpath(b) for b in bases], bool(recursive), bool(include_hidden),
+        path_filter.includes, path_filter.excludes,
+        sys.byteorder, array('Q').itemsize, array('q').itemsize,
+    )
+    return hashlib.sha256(repr(config).encode('utf-8', 'surrogateescape')).digest()
+
+def state_file(state_dir, params):
+    """Path of the saved snapshot for the (bases, recursive, ...) 'params'."""
+    return os.path.join(state_dir, _config_digest(params).hex()[:24] + '.snap')
+
+def save_snapshot(snapshot, path, params):
+    """
+    Write 'snapshot', taken with 'params', to 'path'. The file is replaced
+    atomically, so a crash leaves the previous version in place.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, 'wb') as fh:
+            _write_snapshot(fh, snapshot, params)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+def dump_snapshot(snapshot, params):
+    """'snapshot', taken with 'params', as bytes in the state file format."""
+    import io
+    buffer = io.BytesIO()
+    _write_snapshot(buffer, snapshot, params)
+    return buffer.getvalue()
+
+def _write_snapshot(fh, snapshot, params):
+    fh.write(_STATE_MAGIC + _config_digest(params))
+    for base, tables in snapshot.roots.items():
+        raw = base.encode('utf-8', 'surrogateescape')
+        fh.write(b'B' + _LEN.pack(len(raw)) + raw)
+        for prefix, table in tables.items():
+            raw_prefix = prefix.encode('utf-8', 'surrogateescape')
+            names = table.names.encode('utf-8', 'surrogateescape')
+            fh.write(b'T' + _LEN.pack(len(raw_prefix)) + raw_prefix)
+            fh.write(_TABLE_HEAD.pack(table.dev, table.ino, table.mtime_ns,
+                                      table.listed_ns, table.count,
+                                      len(table.flags), len(names)))
+            fh.write(names)
+            fh.write(table.flags)
+            for column in (table.inos, table.sizes, table.mtimes):
+                column.tofile(fh)
+
+def load_snapshot(path, params):
+    """
+    Read the snapshot saved at 'path' for 'params'. Returns None if there
+    is none, or it was saved for another configuration or is damaged.
+    """
+    try:
+        with open(path, 'rb') as fh:
+            data = fh.read()
+    except OSError:
+        return None
+    return parse_snapshot(data, params)
+
+def parse_snapshot(data, params):
+    """Snapshot from dump_snapshot() bytes taken with 'params', or None (see load_snapshot())."""
+    head = len(_STATE_MAGIC) + 32
+    if data[:head] != _STATE_MAGIC + _config_digest(params):
+        return None
+    bases, recursive, include_hidden, path_filter = params
+    snapshot = Snapshot((recursive, include_hidden, path_filter))
+    view = memoryview(data)
+    pos, tables = head, None
+    try:
+        while pos < len(data):
+            kind = data[pos:pos + 1]
+            (size,) = _LEN.unpack_from(data, pos + 1)
+            text = bytes(view[pos + 5:pos + 5 + size]).decode('utf-8', 'surrogateescape')
+            pos += 5 + size
+            if kind == b'B':
+                tables = snapshot.roots.setdefault(text, {})
+                continue
+            if kind != b'T' or tables is None:
+                return None
+            dev, ino, mtime_ns, listed_ns, count, n, names_len = _TABLE_HEAD.unpack_from(data, pos)
+            pos += _TABLE_HEAD.size
+            names = bytes(view[pos:pos + names_len]).decode('utf-8', 'surrogateescape')
+            pos += names_len
+            flags = bytes(view[pos:pos + n])
+            pos += n
+            columns = []
+            for code in 'Qqq':
+                column = array(code)
+                column.frombytes(view[pos:pos + n * column.itemsize])
+                pos += n * column.itemsize
+                columns.append(column)
+            if len(flags) != n or any(len(c) != n for c in columns):
+                return None
+            tables[text] = DirTable(dev, ino, mtime_ns, listed_ns, names, flags, *columns, count)
+    except (struct.error, ValueError, UnicodeError):
+        return None
+    return snapshot
+
+class ScanWorker(threading.Thread):
+    """
+    Background thread running the scan-and-diff cycle.
+
+    The first scan builds the baseline; afterwards the worker sleeps
+    'interval' seconds between the end of one scan and the start of the
+    next, so scans never overlap however long they take. With backend
+    'inotify' kernel events replace the periodic scans (see
+    monitor_inotify). Each message put on 'results' is a
+    (worker, kind, payload) tuple:
+      ('ready',       entry_count)
+      ('restored',    entry_count)  baseline loaded from the state file
+      ('changes',     (added, removed, modified, moved))
+      ('error',       exception)
+      ('fallback',    reason)   inotify unusable, polling instead
+      ('watch_limit', path)     watch limit hit, 'path' is polled instead
+      ('state_error', exception) state file not written, saving disabled
+      ('stats',       ({base: ScanStats}, seconds))  after each poll
+      ('profile',     path)     profile of one cycle written to 'path'
+      ('metrics_error', exception) metrics or profile not written
+      ('hooks',       dict)     HookRunner.metrics() after each poll
+      ('snapshot',    bytes)    asked for by request_snapshot()
+    Each poll rescans incrementally from the previous Snapshot, updating
+    it in place and posting changes while the scan is still running;
+    'structure_only' skips the stat of files in directories whose mtime
+    did not change, and 'large_dirs' tunes the scan for folders of
+    hundreds of thousands of files. 'workers' is the number of scan
+    threads (see scan_directories()).
+    With a 'state_dir' the snapshot is saved there (see state_file()) when
+    the worker stops and, while changes keep coming, every SAVE_INTERVAL
+    seconds. A later worker with the same configuration starts from it
+    and first reports what changed while nothing was watching.
+    With 'adaptive' set, each root is polled on its own schedule (see
+    PollScheduler), 'interval' being the shortest; 'limits' maps a watched
+    path to its own (min, max) interval.
+    With a 'metrics_path' the statistics of each poll are also written to
+    that file (see monitor_metrics). 'hooks', a monitor_hooks.HookRunner
+    fed by the front-end, has its queue depth and latency reported with
+    them. Setting 'profile_path' runs the next
+    cycle under cProfile and saves its stats there; scan threads other
+    than the worker's own are not profiled.
+    With 'verify_content', files reported modified are hashed and the
+    change is dropped when their content is the one hashed last time (see
+    monitor_hashing); this costs a read of each file that changes.
+    'params', 'interval', 'structure_only', 'large_dirs', 'workers',
+    'adaptive', 'limits' and 'verify_content' may be replaced from another
+    thread; they are read once per cycle.
+    request_snapshot() has the worker post the snapshot in dump_snapshot()
+    form between two scans, so that it reflects exactly the changes posted
+    before it (this is how monitor_daemon serves newly attached clients).
+    """
+    def __init__(self, params, interval, results, backend='poll', structure_only=False,
+                 workers=1, state_dir=None, metrics_path=None, adaptive=False, limits=None,
+                 hooks=None, verify_content=False, large_dirs=False):
+        super().__init__(name="scan-worker", daemon=True)
+        self.params = params
+        self.interval = interval
+        self.results = results
+        self.backend = backend
+        self.structure_only = structure_only
+        self.large_dirs = large_dirs
+        self.workers = workers
+        self.state_dir = state_dir
+        self.metrics_path = metrics_path
+        self.adaptive = adaptive
+        self.limits = limits or {}
+        self.hooks = hooks
+        self.verify_content = verify_content
+        self.profile_path = None
+        self.snapshot = Snapshot()
+        self._cancel = threading.Event()
+        self._dirty = True      # snapshot differs from the saved one
+        self._saved_at = 0.0    # monotonic time of the last save
+        self._metrics = None    # MetricsWriter, once there is a poll to record
+        self._verifier = None   # ContentVerifier, once 'verify_content' is set
+        self._wake = threading.Event()
+        self._snapshot_wanted = False
+
+    def stop(self):
+        """Ask the worker to finish; an in-flight scan is abandoned."""
+        self._cancel.set()
+        self._wake.set()
+
+    def request_snapshot(self):
+        """Ask for a ('snapshot', bytes) message, posted once the scan in progress ends."""
+        self._snapshot_wanted = True
+        self._wake.set()
+
+    def run(self):
+        try:
+            if self.backend == 'inotify' and self._run_inotify():
+                return
+            self._run_polling()
+        except ScanCancelled:
+            pass
+        except Exception as exc:
+            self.results.put((self, 'error', exc))
+
+    def _run_polling(self):
+        params = self.params
+        saved = self._load(params)
+        if saved is None:
+            self.snapshot = scan_directories(*params, cancel=self._cancel,
+                                             workers=self.workers)
+            self.results.put((self, 'ready', len(self.snapshot)))
+            self._save(params)
+        else:
+            # Diff against the saved state straight away, not after 'interval'
+            self.snapshot = saved
+            self.results.put((self, 'restored', len(saved)))
+            params = self._cycle(self._poll)
+        scheduler = None
+        while True:
+            if self.adaptive:
+                scheduler = scheduler or PollScheduler()
+                scheduler.configure([os.path.realpath(p) for p in self.params[0]], self.interval,
+                                    {os.path.realpath(p): v for p, v in self.limits.items()})
+                timeout = scheduler.wait()
+                if timeout is None:
+                    timeout = self.interval
+            else:
+                scheduler, timeout = None, self.interval
+            if self._sleep(timeout, params):
+                break
+            params = self._cycle(self._poll, scheduler)
+            self._save(params, throttle=True)
+        self._save(params)
+
+    def _sleep(self, timeout, params):
+        """
+        Wait 'timeout' seconds between scans, posting the snapshot (taken
+        with 'params') when asked; returns True if the worker was stopped.
+        """
+        deadline = time.monotonic() + timeout
+        while not self._cancel.is_set():
+            self._send_snapshot(params)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self._wake.wait(remaining)
+            self._wake.clear()
+        return True
+
+    def _send_snapshot(self, params):
+        """Post the snapshot if request_snapshot() asked for it and it is complete."""
+        if not self._snapshot_wanted or self.snapshot.key is None:
+            return
+        self._snapshot_wanted = False
+        self.results.put((self, 'snapshot', dump_snapshot(self.snapshot, params)))
+
+    def _poll(self, scheduler=None):
+        """
+        One scan_changes() pass, over the roots 'scheduler' says are due
+        if given; returns the params it scanned with.
+        """
+        params = self.params
+        only = None
+        # New settings invalidate every table, so all roots are rescanned
+        if scheduler is not None and self.snapshot.key == tuple(params[1:]):
+            only = scheduler.due()
+            if not only:
+                return params
+        stats = {}
+        active = set()  # roots with changes posted, after the content checks
+        start = time.perf_counter()
+        for changes in scan_changes(*params, self.snapshot, cancel=self._cancel,
+                                    structure_only=self.structure_only,
+                                    large_dirs=self.large_dirs,
+                                    workers=self.workers, stats=stats, only=only):
+            active.update(_changed_roots(self._post(changes)))
+        active.update(_changed_roots(self._recheck()))
+        self._report(stats, time.perf_counter() - start)
+        if scheduler is not None:
+            for base in stats:
+                scheduler.done(base, base in active)
+        return params
+
+    def _post(self, changes):
+        """
+        Post a batch of changes, less the modifications content checks
+        rule out; returns what was posted, or None if nothing was left.
+        """
+        if any(changes):
+            # The snapshot already holds the new values, whether or not they get reported
+            self._dirty = True
+        if self.verify_content:
+            if self._verifier is None:
+                from monitor_hashing import ContentVerifier
+                self._verifier = ContentVerifier()
+            changes = self._verifier.confirm(changes, self.snapshot)
+            if not any(changes):
+                return None
+        self.results.put((self, 'changes', changes))
+        return changes
+
+    def _recheck(self):
+        """
+        Post files rewritten unnoticed by the stat data, in verify mode (see
+        ContentVerifier); returns what was posted, or None.
+        """
+        if self.verify_content and self._verifier is not None:
+            modified = self._verifier.recheck(self.snapshot)
+            if modified:
+                changes = (set(), set(), modified, set())
+                self.results.put((self, 'changes', changes))
+                return changes
+        return None
+
+    def _cycle(self, fn, *args):
+        """Call fn(*args), under cProfile if 'profile_path' asks for it."""
+        path, self.profile_path = self.profile_path, None
+        if path is None:
+            return fn(*args)
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(fn, *args)
+        finally:
+            try:
+                profiler.dump_stats(path)
+            except OSError as exc:
+                self.results.put((self, 'metrics_error', exc))
+            else:
+                self.results.put((self, 'profile', path))
+
+    def _report(self, stats, duration):
+        """Post the statistics of a poll and write them to the metrics file."""
+        if duration is not None:
+            self.results.put((self, 'stats', (stats, duration)))
+        hooks = self.hooks.metrics() if self.hooks is not None else None
+        if hooks is not None:
+            self.results.put((self, 'hooks', hooks))
+        if self.metrics_path is None:
+            return
+        if self._metrics is None:
+            from monitor_metrics import MetricsWriter
+            self._metrics = MetricsWriter(self.metrics_path)
+        try:
+            self._metrics.record(stats, duration, hooks)
+        except (OSError, ValueError) as exc:
+            self.results.put((self, 'metrics_error', exc))
+            self.metrics_path = None
+
+    def _load(self, params):
+        if self.state_dir is None:
+            return None
+        return load_snapshot(state_file(self.state_dir, params), params)
+
+    def _save(self, params, throttle=False):
+        """Save the snapshot if it changed since the last save."""
+        if self.state_dir is None or self.snapshot.key is None or not self._dirty:
+            return
+        now = time.monotonic()
+        if throttle and now - self._saved_at < SAVE_INTERVAL:
+            return
+        try:
+            save_snapshot(self.snapshot, state_file(self.state_dir, params), params)
+        except OSError as exc:
+            self.results.put((self, 'state_error', exc))
+            self.state_dir = None
+            return
+        self._dirty = False
+        self._saved_at = now
+
+    def _run_inotify(self):
+        """Event-driven loop; returns False if inotify cannot be used."""
+        from monitor_inotify import InotifyWatcher, InotifyUnavailable
+        try:
+            watcher = InotifyWatcher(self.params, cancel=self._cancel)
+        except InotifyUnavailable as exc:
+            self.results.put((self, 'fallback', exc))
+            return False
+        with watcher:
+            params = self.params
+            watcher.rescan_interval = self.interval
+            watcher.workers = self.workers
+            saved = watcher.snapshot = self._load(params)
+            self.snapshot = watcher.start()
+            if saved is None:
+                self.results.put((self, 'ready', len(self.snapshot)))
+                self._save(params)
+            else:
+                self.results.put((self, 'restored', len(saved)))
+                changes = compare_snapshots(saved, self.snapshot)
+                if any(changes):
+                    self._post(changes)
+            reported = 0
+            while not self._cancel.is_set():
+                for path in watcher.limited[reported:]:
+                    self.results.put((self, 'watch_limit', path))
+                reported = len(watcher.limited)
+                watcher.rescan_interval = self.interval
+                watcher.workers = self.workers
+                if self.params != params:
+                    params = self.params
+                    changes = self._cycle(watcher.resync, params)
+                else:
+                    changes = self._cycle(watcher.poll, 0.5)
+                changes = self._post(changes) if any(changes) else None
+                if changes:
+                    stats = {}
+                    count_events(changes, stats)
+                    self._report(stats, None)
+                self._recheck()
+                self._send_snapshot(params)
+                self._save(params, throttle=True)
+            self._save(params)
+        return True
+
+class SlicedWorker(ScanWorker):
+    """
+    ScanWorker's polling cycle without a thread, for a caller that stays
+    single-threaded (the GUIs' time-sliced backend). The caller invokes
+    step() from its event loop; each call scans for about 'budget'
+    seconds and returns. A scan in progress is a scan_changes() generator
+    left suspended between calls, so changes are posted, on 'results' as
+    usual, slice by slice; the baseline is built the same way from an
+    empty Snapshot. Messages and attributes are those of ScanWorker,
+    except that scans always run on the caller's thread alone ('workers'
+    and 'backend' are ignored) and 'adaptive' is not supported. A cycle
+    under 'profile_path' is profiled slice by slice, until it ends.
+    """
+    def __init__(self, params, interval, results, **kwargs):
+        super().__init__(params, interval, results, **kwargs)
+        self._scan = None       # scan_changes() generator in progress
+        self._scan_params = params
+        self._stats = {}
+        self._started = 0.0     # perf_counter() when the scan began
+        self._expected = None   # directories the scan should visit, None if unknown
+        self._due = 0.0         # monotonic time of the next scan
+        self._baseline = True
+        self._profiler = None   # cProfile.Profile of the cycle profiled
+        self._profile_to = None
+        self._stopped = False
+
+    def start(self):
+        """Nothing runs until the first step()."""
+
+    def is_alive(self):
+        return not self._stopped
+
+    def join(self, timeout=None):
+        """There is no thread to wait for: stop() has already saved the state."""
+
+    def stop(self):
+        if self._stopped:
+            return
+        self._stopped = True
+        if self._scan is not None:
+            self._scan.close()
+            self._scan = None
+        # A scan cut short leaves snapshot.key unset, and nothing is saved
+        self._save(self._scan_params)
+
+    @property
+    def scanning(self):
+        return self._scan is not None
+
+    def progress(self):
+        """Share of the scan in progress done, from 0 to 1, or None if unknown."""
+        if self._scan is None or not self._expected:
+            return None
+        done = sum(s.dirs_listed + s.dirs_restat for s in self._stats.values())
+        return min(done / self._expected, 1.0)
+
+    def visited(self):
+        """Directories visited so far by the scan in progress."""
+        return sum(s.dirs_listed + s.dirs_restat for s in self._stats.values())
+
+    def step(self, budget):
+        """
+        Scan for about 'budget' seconds, if a scan is in progress or due.
+        Returns the seconds until step() has work to do again, 0 while a
+        scan is in progress, or None once stopped or failed.
+        """
+        if self._stopped:
+            return None
+        if self._scan is None:
+            self._send_snapshot(self._scan_params)
+            wait = self._due - time.monotonic()
+            if wait > 0:
+                return wait
+            self._begin()
+        deadline = time.perf_counter() + budget
+        if self._profiler is not None:
+            self._profiler.enable()
+        try:
+            for changes in self._scan:
+                if changes is not None and not self._baseline:
+                    self._post(changes)
+                if time.perf_counter() >= deadline:
+                    return 0.0
+        except Exception as exc:
+            self._scan = None
+            self.results.put((self, 'error', exc))
+            self.stop()
+            return None
+        finally:
+            if self._profiler is not None:
+                self._profiler.disable()
+        self._finish()
+        return self.interval
+
+    def _begin(self):
+        params = self._scan_params = self.params
+        self._stats = {}
+        if self._baseline:
+            saved = self._load(params)
+            if saved is not None:
+                # Diff against the saved state straight away
+                self._baseline = False
+                self.snapshot = saved
+                self.results.put((self, 'restored', len(saved)))
+        # Every table of the last scan, if it used the same settings, is visited again
+        same = self.snapshot.key == tuple(params[1:])
+        self._expected = sum(map(len, self.snapshot.roots.values())) if same else None
+        path, self.profile_path = self.profile_path, None
+        if path is not None:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profile_to = path
+        self._started = time.perf_counter()
+        # The baseline's changes (everything added) are dropped, so moves need not be paired
+        self._scan = scan_changes(*params, self.snapshot, structure_only=self.structure_only,
+                                  large_dirs=self.large_dirs, detect_moves=not self._baseline,
+                                  stats=self._stats, idle=True)
+
+    def _finish(self):
+        self._scan = None
+        duration = time.perf_counter() - self._started
+        if self._baseline:
+            self._baseline = False
+            self.results.put((self, 'ready', len(self.snapshot)))
+            self._save(self._scan_params)
+        else:
+            self._recheck()
+            self._report(self._stats, duration)
+            self._save(self._scan_params, throttle=True)
+        if self._profiler is not None:
+            profiler, self._profiler = self._profiler, None
+            try:
+                profiler.dump_stats(self._profile_to)
+            except OSError as exc:
+                self.results.put((self, 'metrics_error', exc))
+            else:
+                self.results.put((self, 'profile', self._profile_to))
+        self._due = time.monotonic() + self.interval
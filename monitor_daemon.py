@@ -0,0 +1,488 @@
+# -*- coding: utf-8 -*-
+"""
+monitor_daemon.py
+
+One scan shared by many viewers. DaemonServer publishes the messages of
+a ScanWorker on a Unix domain socket (monitor_cli.py --serve runs one),
+and DaemonClient attaches to it in place of a worker of its own, so N
+open GUIs cost a single scan of the watched folders. Standard library
+only; needs a platform with AF_UNIX sockets.
+
+Protocol: every frame is a one-byte type, the payload length as a
+big-endian 32-bit integer, then the payload. On connecting, the client
+receives HELLO; it then sends SUBSCRIBE_SNAPSHOT, to be sent the
+current snapshot followed by the changes made after it, or
+SUBSCRIBE_CHANGES for the changes alone.
+
+  HELLO     JSON object: protocol, roots (resolved paths), recursive,
+            hidden, include, exclude, interval, backend, pid
+  SNAPSHOT  zlib-compressed dump_snapshot() bytes
+  CHANGES   JSON [added, removed, modified, moved]; an entry is
+            [root, rel] with [ino, size, mtime_ns] appended when known,
+            a move is [old_root, old_rel, root, rel, ...]; roots are
+            indexes into HELLO's list
+  STATS     JSON [seconds, {root path: ScanStats.as_dict()}]
+  MESSAGE   JSON [kind, value]: the worker's other messages (ready,
+            restored, error, fallback, watch_limit, state_error)
+"""
+
+import os
+import json
+import stat
+import zlib
+import errno
+import socket
+import struct
+import selectors
+import threading
+from collections import OrderedDict, deque
+
+from monitor_core import PathFilter, ScanStats, Snapshot, default_state_dir, parse_snapshot
+from monitor_sinks import StatLookup
+
+PROTOCOL = 1
+
+# Frame types
+HELLO = b'H'
+SNAPSHOT = b'S'
+CHANGES = b'C'
+STATS = b'T'
+MESSAGE = b'M'
+SUBSCRIBE_SNAPSHOT = b's'
+SUBSCRIBE_CHANGES = b'c'
+
+_HEAD = struct.Struct('>cI')
+
+# Largest frame a client accepts, and a server accepts from a client
+MAX_FRAME = 1 << 30
+MAX_REQUEST = 64
+
+# Bytes queued for a client before it is dropped as too slow to keep up
+CLIENT_BACKLOG = 64 * 1024 * 1024
+
+# Worker messages passed on to clients as MESSAGE frames
+_FORWARDED = ('ready', 'restored', 'error', 'fallback', 'watch_limit', 'state_error')
+
+# Entries whose stat data a client keeps from the changes it was sent
+RECENT_ENTRIES = 100000
+
+def default_socket_path():
+    """Per-user socket path, for a daemon that only its owner attaches to."""
+    runtime = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime:
+        return os.path.join(runtime, 'directory-monitor.sock')
+    return os.path.join(default_state_dir(), 'daemon.sock')
+
+def frame(kind, payload=b''):
+    return _HEAD.pack(kind, len(payload)) + payload
+
+def _json(value):
+    # ASCII escapes keep file names that are not valid UTF-8 intact
+    return json.dumps(value, separators=(',', ':')).encode('ascii')
+
+class DaemonServer:
+    """
+    Serve the messages of 'worker' to clients of the Unix socket 'path'.
+    Whoever reads the worker's results queue passes every message on to
+    publish(), in order; a server thread does the socket work. Clients
+    asking for the snapshot get the one the worker posts on request (see
+    ScanWorker.request_snapshot()), after which they get the changes, so
+    nothing is missed or sent twice. A client with more than
+    CLIENT_BACKLOG bytes waiting is disconnected. notices() hands out
+    what happened to clients, for the owner to log. start() replaces a
+    socket left at 'path' by a daemon that died, and refuses to replace
+    anything else found there.
+    """
+    def __init__(self, path, worker):
+        self.path = path
+        self.worker = worker
+        self._inbox = deque()
+        self._notices = deque(maxlen=100)
+        self._clients = {}
+        self._next_id = 1
+        self._stopping = False
+        self._thread = None
+        bases, recursive, include_hidden, path_filter = worker.params
+        self.roots = list(dict.fromkeys(os.path.realpath(b) for b in bases))
+        self._index = {root: i for i, root in enumerate(self.roots)}
+        self._hello = frame(HELLO, _json({
+            'protocol': PROTOCOL, 'roots': self.roots, 'recursive': bool(recursive),
+            'hidden': bool(include_hidden), 'include': list(path_filter.includes),
+            'exclude': list(path_filter.excludes), 'interval': worker.interval,
+            'backend': worker.backend, 'pid': os.getpid()}))
+
+    def __len__(self):
+        return len(self._clients)
+
+    def start(self):
+        """Bind the socket and start serving; raises OSError if the path is taken."""
+        self._listener = self._bind()
+        self._listener.setblocking(False)
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._listener, selectors.EVENT_READ)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        self._thread = threading.Thread(target=self._serve, name="daemon-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Disconnect every client and remove the socket."""
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wake()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def publish(self, kind, payload):
+        """Pass on one (kind, payload) message of the worker."""
+        if kind == 'changes':
+            item = ('live', frame(CHANGES, self._encode_changes(payload)))
+        elif kind == 'stats':
+            stats, duration = payload
+            item = ('live', frame(STATS, _json(
+                [duration, {base: s.as_dict() for base, s in stats.items()}])))
+        elif kind in _FORWARDED:
+            value = payload if isinstance(payload, int) else str(payload)
+            item = ('live', frame(MESSAGE, _json([kind, value])))
+        elif kind == 'snapshot':
+            item = ('snapshot', payload)
+        else:
+            return
+        self._inbox.append(item)
+        self._wake()
+
+    def notices(self):
+        """Messages about clients since the last call."""
+        messages = []
+        while self._notices:
+            messages.append(self._notices.popleft())
+        return messages
+
+    def _bind(self):
+        try:
+            mode = os.lstat(self.path).st_mode
+        except FileNotFoundError:
+            mode = None
+        if mode is not None:
+            if not stat.S_ISSOCK(mode):
+                raise OSError(errno.EEXIST, "exists and is not a socket", self.path)
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except OSError:
+                os.unlink(self.path)  # left behind by a daemon that died
+            else:
+                raise OSError(errno.EADDRINUSE, "another daemon is serving on", self.path)
+            finally:
+                probe.close()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            listener.bind(self.path)
+            listener.listen()
+        except OSError:
+            listener.close()
+            raise
+        return listener
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b'\0')
+        except OSError:
+            pass  # buffer full: a wake-up is pending anyway
+
+    def _encode_changes(self, changes):
+        """CHANGES payload, with the stat data of entries still in the worker's snapshot."""
+        snapshot = self.worker.snapshot
+        index = self._index
+        lookup = StatLookup()  # the entries come sorted: one name index per directory
+
+        def entry(base, rel, stat=True):
+            found = lookup(snapshot, base, rel) if stat else None
+            return [index.get(base, base), rel, *found] if found else [index.get(base, base), rel]
+
+        added, removed, modified, moved = changes
+        return _json([[entry(*e) for e in sorted(added)],
+                      [entry(*e, stat=False) for e in sorted(removed)],
+                      [entry(*e) for e in sorted(modified)],
+                      [[index.get(old[0], old[0]), old[1], *entry(*new)]
+                       for old, new in sorted(moved)]])
+
+    # -- server thread -----------------------------------------------------
+
+    def _serve(self):
+        try:
+            while not self._stopping:
+                for key, events in self._selector.select():
+                    if key.fileobj is self._listener:
+                        self._accept()
+                    elif key.fileobj is self._wake_r:
+                        try:
+                            while self._wake_r.recv(4096):
+                                pass
+                        except BlockingIOError:
+                            pass
+                    elif key.data.sock.fileno() >= 0:
+                        if events & selectors.EVENT_READ:
+                            self._read(key.data)
+                        if events & selectors.EVENT_WRITE and key.data.sock.fileno() >= 0:
+                            self._write(key.data)
+                self._dispatch()
+        finally:
+            for client in list(self._clients.values()):
+                self._drop(client)
+            self._selector.close()
+            self._listener.close()
+            self._wake_r.close()
+            self._wake_w.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def _accept(self):
+        try:
+            sock, _ = self._listener.accept()
+        except OSError:
+            return
+        sock.setblocking(False)
+        client = _Client(self._next_id, sock)
+        self._next_id += 1
+        self._clients[client.id] = client
+        self._selector.register(sock, selectors.EVENT_READ, client)
+        self._send(client, self._hello)
+        self._notices.append(f"Client {client.id} attached ({len(self._clients)} attached)")
+
+    def _read(self, client):
+        try:
+            data = client.sock.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._drop(client, "detached")
+            return
+        client.inbuf += data
+        while len(client.inbuf) >= _HEAD.size:
+            kind, size = _HEAD.unpack_from(client.inbuf)
+            if size > MAX_REQUEST:
+                self._drop(client, "sent an oversized request, disconnected")
+                return
+            if len(client.inbuf) < _HEAD.size + size:
+                break
+            del client.inbuf[:_HEAD.size + size]
+            if kind == SUBSCRIBE_SNAPSHOT and client.state == 'new':
+                client.state = 'waiting'
+                self.worker.request_snapshot()
+            elif kind == SUBSCRIBE_CHANGES and client.state == 'new':
+                client.state = 'live'
+            else:
+                self._drop(client, f"sent an unexpected request {kind!r}, disconnected")
+                return
+
+    def _dispatch(self):
+        """Send out what publish() queued."""
+        while self._inbox:
+            target, data = self._inbox.popleft()
+            if target == 'snapshot':
+                waiting = [c for c in self._clients.values() if c.state == 'waiting']
+                if not waiting:
+                    continue
+                data = frame(SNAPSHOT, zlib.compress(data, 1))
+                for client in waiting:
+                    client.state = 'live'
+                    self._send(client, data, exempt=True)
+                continue
+            for client in [c for c in self._clients.values() if c.state == 'live']:
+                self._send(client, data)
+
+    def _send(self, client, data, exempt=False):
+        if not exempt and client.queued > CLIENT_BACKLOG:
+            self._drop(client, f"fell {client.queued // (1024 * 1024)} MB behind, disconnected")
+            return
+        if not client.pending:
+            self._selector.modify(client.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, client)
+        client.pending.append(memoryview(data))
+        client.queued += len(data)
+
+    def _write(self, client):
+        while client.pending:
+            chunk = client.pending[0]
+            try:
+                sent = client.sock.send(chunk)
+            except BlockingIOError:
+                return
+            except OSError:
+                self._drop(client, "connection lost")
+                return
+            client.queued -= sent
+            if sent < len(chunk):
+                client.pending[0] = chunk[sent:]
+                return
+            client.pending.popleft()
+        self._selector.modify(client.sock, selectors.EVENT_READ, client)
+
+    def _drop(self, client, reason=None):
+        if self._clients.pop(client.id, None) is None:
+            return
+        self._selector.unregister(client.sock)
+        client.sock.close()
+        if reason:
+            self._notices.append(f"Client {client.id} {reason} ({len(self._clients)} attached)")
+
+class _Client:
+    __slots__ = ('id', 'sock', 'state', 'inbuf', 'pending', 'queued')
+
+    def __init__(self, client_id, sock):
+        self.id = client_id
+        self.sock = sock
+        self.state = 'new'      # then 'waiting' for the snapshot, or 'live'
+        self.inbuf = bytearray()
+        self.pending = deque()  # memoryviews still to send
+        self.queued = 0
+
+class RemoteSnapshot:
+    """
+    What an attached client knows of the daemon's snapshot: the Snapshot
+    it was sent, if it asked for one, overlaid with the stat data of the
+    last RECENT_ENTRIES entries reported since (None for removed ones).
+    Enough for get(), which is all the logging needs.
+    """
+    def __init__(self, snapshot=None):
+        self.base = snapshot if snapshot is not None else Snapshot()
+        self.recent = OrderedDict()
+
+    def __len__(self):
+        return len(self.base)
+
+    def get(self, base, rel):
+        """Return (ino, size, mtime_ns) for one entry, or None."""
+        if (base, rel) in self.recent:
+            return self.recent[base, rel]
+        return self.base.get(base, rel)
+
+    def update(self, entry, stat):
+        self.recent[entry] = stat
+        self.recent.move_to_end(entry)
+        if len(self.recent) > RECENT_ENTRIES:
+            self.recent.popitem(last=False)
+
+class DaemonClient(threading.Thread):
+    """
+    Stands in for a ScanWorker, posting on 'results' what the daemon at
+    'path' publishes, as the same (worker, kind, payload) messages:
+    changes, stats, and the worker messages the server forwards (their
+    payloads as text). In addition:
+      ('attached', dict)   connected; the daemon's HELLO
+      ('detached', reason) connection failed or lost; the thread ends
+    With 'snapshot' the daemon's snapshot is requested first and
+    reported with a 'ready' message. The scan settings the GUIs assign
+    to a worker are accepted and ignored: they belong to the daemon.
+    'hooks' is reported after each poll as with ScanWorker.
+    """
+    def __init__(self, path, results, snapshot=True):
+        super().__init__(name="daemon-client", daemon=True)
+        self.path = path
+        self.results = results
+        self.want_snapshot = snapshot
+        self.snapshot = RemoteSnapshot()
+        self.hello = None
+        self.hooks = None
+        self.profile_path = None
+        self.params = self.interval = None
+        self._sock = None
+        self._closed = threading.Event()
+
+    def stop(self):
+        """Disconnect; the daemon goes on scanning for the others."""
+        self._closed.set()
+        sock = self._sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def run(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock = sock
+        try:
+            sock.connect(self.path)
+            with sock.makefile('rb') as stream:
+                kind, payload = self._read(stream)
+                hello = json.loads(payload) if kind == HELLO else {}
+                if hello.get('protocol') != PROTOCOL:
+                    raise ValueError("not a directory monitor daemon, or an incompatible one")
+                self.hello = hello
+                self._roots = hello['roots']
+                self.results.put((self, 'attached', hello))
+                sock.sendall(frame(SUBSCRIBE_SNAPSHOT if self.want_snapshot else SUBSCRIBE_CHANGES))
+                while not self._closed.is_set():
+                    kind, payload = self._read(stream)
+                    self._handle(kind, payload)
+        except (OSError, ValueError, zlib.error) as exc:
+            if not self._closed.is_set():
+                self.results.put((self, 'detached', exc))
+        finally:
+            sock.close()
+
+    @staticmethod
+    def _read(stream):
+        head = stream.read(_HEAD.size)
+        if len(head) < _HEAD.size:
+            raise ConnectionError("connection closed by the daemon")
+        kind, size = _HEAD.unpack(head)
+        if size > MAX_FRAME:
+            raise ValueError(f"frame of {size} bytes")
+        payload = stream.read(size)
+        if len(payload) < size:
+            raise ConnectionError("connection closed by the daemon")
+        return kind, payload
+
+    def _handle(self, kind, payload):
+        if kind == CHANGES:
+            self.results.put((self, 'changes', self._decode_changes(json.loads(payload))))
+        elif kind == STATS:
+            duration, roots = json.loads(payload)
+            stats = {}
+            for base, values in roots.items():
+                stats[base] = ScanStats()
+                for name in ScanStats.FIELDS:
+                    setattr(stats[base], name, values.get(name, 0))
+            self.results.put((self, 'stats', (stats, duration)))
+            if self.hooks is not None:
+                self.results.put((self, 'hooks', self.hooks.metrics()))
+        elif kind == MESSAGE:
+            message, value = json.loads(payload)
+            self.results.put((self, message, value))
+        elif kind == SNAPSHOT:
+            hello = self.hello
+            params = (self._roots, hello['recursive'], hello['hidden'],
+                      PathFilter(hello['include'], hello['exclude']))
+            snapshot = parse_snapshot(zlib.decompress(payload), params)
+            if snapshot is None:
+                raise ValueError("damaged snapshot")
+            self.snapshot = RemoteSnapshot(snapshot)
+            self.results.put((self, 'ready', len(snapshot)))
+
+    def _decode_changes(self, data):
+        roots = self._roots
+        snapshot = self.snapshot
+
+        def entry(item):
+            key = (roots[item[0]] if isinstance(item[0], int) else item[0], item[1])
+            snapshot.update(key, tuple(item[2:5]) if len(item) >= 5 else None)
+            return key
+
+        added, removed, modified, moved = data
+        moves = set()
+        for item in moved:
+            old = entry(item[:2])
+            moves.add((old, entry(item[2:])))
+        return ({entry(e) for e in added}, {entry(e) for e in removed},
+                {entry(e) for e in modified}, moves)
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+monitor_hashing.py
+
+Content verification for the "verify content" mode. A file the scan
+reports as modified is hashed and compared with the digest taken the
+last time it changed, so a touch, or a rewrite with the same bytes, is
+not reported. Digests live in an LRU cache keyed by (inode, size,
+mtime_ns) and capped in memory, so a file whose stat data did not change
+is never read twice. Files are hashed chunk by chunk, through mmap past
+MMAP_THRESHOLD. Standard library only.
+"""
+
+import os
+import time
+import hashlib
+from collections import OrderedDict
+
+from monitor_core import RACY_NS
+from monitor_sinks import StatLookup
+
+# Bytes hashed per update() call, and the size from which files are mmap'ed
+HASH_CHUNK = 1024 * 1024
+MMAP_THRESHOLD = 16 * 1024 * 1024
+
+# Default memory cap of the cache, and the rough cost of one cached file in it
+DEFAULT_CACHE_BYTES = 32 * 1024 * 1024
+_ENTRY_BYTES = 256
+
+def file_digest(path, size=None):
+    """16-byte BLAKE2b digest of the file at 'path' ('size': its st_size, if known)."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as fh:
+        if size is None:
+            size = os.fstat(fh.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            import mmap
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    for start in range(0, len(view), HASH_CHUNK):
+                        digest.update(view[start:start + HASH_CHUNK])
+                finally:
+                    view.release()
+        else:
+            for chunk in iter(lambda: fh.read(HASH_CHUNK), b''):
+                digest.update(chunk)
+    return digest.digest()
+
+class ContentVerifier:
+    """
+    Filters the modifications of scan_changes() style change tuples down
+    to files whose content changed. Hashing is lazy: a file is first read
+    when it is reported modified, so that first change always goes
+    through, and later ones are checked against its digest. Directories
+    are never hashed.
+
+    A file hashed within RACY_NS of its mtime may still have been
+    written to in the same timestamp tick, leaving the stat data as it
+    was; recheck() hashes such files once more on the next poll.
+
+    The cache holds at most 'max_bytes' worth of digests (a few hundred
+    bytes per file), the least recently used going first.
+    """
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_entries = max(max_bytes // _ENTRY_BYTES, 1)
+        self._digests = OrderedDict()  # (ino, size, mtime_ns) -> digest
+        self._last = OrderedDict()     # (base, rel) -> key of the file when last hashed
+        self._racy = {}                # (base, rel) -> key, hashed too soon after a write
+        self.hashed = 0                # files read and bytes hashed since start
+        self.hashed_bytes = 0
+        self.suppressed = 0            # modifications found to leave the content alone
+
+    def __len__(self):
+        return len(self._digests)
+
+    def confirm(self, changes, snapshot):
+        """
+        Return 'changes' without the modified files whose content is the
+        one hashed before; 'snapshot' holds their current stat data.
+        """
+        added, removed, modified, moved = changes
+        for entry in removed:
+            self._forget(entry)
+        for old, new in moved:
+            key = self._last.pop(old, None)
+            if key is not None:
+                self._last[new] = key
+        if not modified:
+            return changes
+        kept = set()
+        lookup = StatLookup()  # sorted, one name index per directory
+        for entry in sorted(modified):
+            if entry[1].endswith('/') or not self._same_content(entry, lookup(snapshot, *entry)):
+                kept.add(entry)
+            else:
+                self.suppressed += 1
+        return added, removed, kept, moved
+
+    def recheck(self, snapshot):
+        """
+        Hash again the files hashed too soon after being written whose
+        stat data has not changed since; returns those now different.
+        """
+        changed = set()
+        now = int(time.time() * 1e9)
+        lookup = StatLookup()
+        for entry, key in sorted(self._racy.items()):
+            if lookup(snapshot, *entry) != key:
+                del self._racy[entry]  # gone, or changed and reported by the scan
+                continue
+            before = self._digests.get(key)
+            digest = self._digest(entry, key, cached=False)
+            if key[2] < now - RACY_NS:
+                del self._racy[entry]  # hashed well after its last write: final
+            if digest is None:
+                continue
+            if before is not None and digest != before:
+                changed.add(entry)
+            self._remember(entry, key, digest)
+        return changed
+
+    def _same_content(self, entry, key):
+        """Whether the file, now with stat data 'key', still has the content hashed before."""
+        if key is None:
+            return False
+        old_key = self._last.get(entry)
+        before = self._digests.get(old_key) if old_key is not None else None
+        digest = self._digest(entry, key, cached=old_key != key)
+        if digest is None:
+            return False
+        self._remember(entry, key, digest)
+        return before is not None and digest == before
+
+    def _digest(self, entry, key, cached=True):
+        """Digest of the file for stat data 'key', from the cache if allowed; None if unreadable."""
+        if cached:
+            digest = self._digests.get(key)
+            if digest is not None:
+                self._digests.move_to_end(key)
+                return digest
+        base, rel = entry
+        try:
+            digest = file_digest(os.path.join(base, rel), key[1])
+        except (OSError, ValueError):
+            return None
+        self.hashed += 1
+        self.hashed_bytes += key[1]
+        if key[2] >= int(time.time() * 1e9) - RACY_NS:
+            self._racy[entry] = key
+        return digest
+
+    def _remember(self, entry, key, digest):
+        self._digests[key] = digest
+        self._digests.move_to_end(key)
+        self._last[entry] = key
+        self._last.move_to_end(entry)
+        while len(self._digests) > self.max_entries:
+            self._digests.popitem(last=False)
+        while len(self._last) > self.max_entries:
+            self._forget(next(iter(self._last)))
+
+    def _forget(self, entry):
+        self._last.pop(entry, None)
+        self._racy.pop(entry, None)
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""
+monitor_history.py
+
+Event history in an SQLite database, for questions such as "what changed
+under /data/incoming between 02:00 and 03:00" without going through the
+log files. HistorySink is one of EventLog's sinks, so events are written
+by its writer thread, a transaction per batch, never by the poll loop or
+the GUI; query_history() reads the database from any thread or process
+while that goes on. Standard library only, but sqlite3 is an optional
+part of it: this module is imported only when a history is used.
+"""
+
+import os
+import re
+import sys
+import time
+import heapq
+import sqlite3
+import logging
+from datetime import datetime
+
+from monitor_sinks import StatLookup
+
+# Events kept by default, in days (0: forever)
+DEFAULT_RETENTION_DAYS = 30
+
+# Events written per transaction at most; the writer also commits each
+# time it runs out of records
+HISTORY_BATCH = 5000
+
+# Expired events are deleted this often (s), at most PRUNE_CHUNK per
+# transaction and PRUNE_CHUNKS per go, so a long backlog of them is
+# worked off a little at a time
+PRUNE_INTERVAL = 3600.0
+PRUNE_CHUNK = 20000
+PRUNE_CHUNKS = 10
+
+# Rows query_history() returns unless told otherwise
+DEFAULT_QUERY_LIMIT = 1000
+
+# A folder with fewer events than this is searched through its paths;
+# one with more, through its root's events in time order (see _plan())
+SPARSE_EVENTS = 20000
+
+HISTORY_KINDS = ('added', 'removed', 'modified', 'moved')
+
+_SCHEMA_VERSION = 1
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS roots (
+    id   INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS events (
+    id        INTEGER PRIMARY KEY,
+    time_ms   INTEGER NOT NULL,
+    kind      TEXT NOT NULL,
+    root      INTEGER NOT NULL REFERENCES roots(id),
+    path      TEXT NOT NULL,
+    from_root INTEGER REFERENCES roots(id),
+    from_path TEXT,
+    size      INTEGER,
+    mtime_ns  INTEGER
+);
+CREATE INDEX IF NOT EXISTS events_by_path ON events (root, path, time_ms);
+CREATE INDEX IF NOT EXISTS events_by_time ON events (root, time_ms, path);
+"""
+
+def default_history_path():
+    from monitor_core import default_state_dir
+    return os.path.join(default_state_dir(), 'history.db')
+
+def _text(value):
+    """'value' as SQLite can store it: names that are not valid UTF-8 get backslash escapes."""
+    try:
+        value.encode('utf-8')
+        return value
+    except UnicodeEncodeError:
+        return value.encode('utf-8', 'surrogateescape').decode('utf-8', 'backslashreplace')
+
+def _connect(path, readonly=False):
+    if readonly:
+        db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        db = sqlite3.connect(path, check_same_thread=False)
+    db.execute("PRAGMA busy_timeout = 5000")
+    return db
+
+class HistorySink(logging.Handler):
+    """
+    Records every change logged (see change_extra()) as a row of the
+    events table in the SQLite database at 'path': time, kind, root and
+    relative path, the old root and path of moves, and the size and
+    mtime the snapshot holds. Rows are committed HISTORY_BATCH at a time
+    or when EventLog's writer runs out of records. Events older than
+    'retention_days' (0: kept forever) are pruned every PRUNE_INTERVAL
+    seconds. The database is opened straight away, so a bad path raises
+    OSError here.
+    """
+    def __init__(self, path, retention_days=DEFAULT_RETENTION_DAYS):
+        super().__init__()
+        self.path = os.path.abspath(path)
+        self.retention_days = retention_days
+        self._rows = []
+        self._root_ids = {}
+        self._lookup = StatLookup()
+        self._pruned_at = None  # monotonic time of the last pruning
+        try:
+            self._db = _connect(self.path)
+            version = self._db.execute("PRAGMA user_version").fetchone()[0]
+            if version not in (0, _SCHEMA_VERSION):
+                raise sqlite3.DatabaseError(f"history schema version {version} is not supported")
+            # WAL lets queries read while the writer commits
+            self._db.execute("PRAGMA journal_mode = WAL")
+            self._db.execute("PRAGMA synchronous = NORMAL")
+            self._db.executescript(_SCHEMA)
+            self._db.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+        except sqlite3.Error as exc:
+            raise OSError(f"{self.path}: {exc}") from exc
+
+    def emit(self, record):
+        change = getattr(record, 'change', None)
+        if change is None or self._db is None:
+            return
+        try:
+            kind, base, rel, origin = change
+            found = (self._lookup(getattr(record, 'snapshot', None), base, rel)
+                     if kind != 'removed' else None)
+            self._rows.append((
+                int(record.created * 1000), kind, self._root_id(base), _text(rel),
+                self._root_id(origin[0]) if origin else None,
+                _text(origin[1]) if origin else None,
+                found[1] if found else None, found[2] if found else None))
+            if len(self._rows) >= HISTORY_BATCH:
+                self._commit()
+        except Exception:
+            self.handleError(record)
+
+    def _root_id(self, base):
+        root_id = self._root_ids.get(base)
+        if root_id is None:
+            path = _text(base)
+            self._db.execute("INSERT OR IGNORE INTO roots (path) VALUES (?)", (path,))
+            root_id = self._db.execute("SELECT id FROM roots WHERE path = ?", (path,)).fetchone()[0]
+            self._root_ids[base] = root_id
+        return root_id
+
+    def _commit(self):
+        rows, self._rows = self._rows, []
+        with self._db:
+            self._db.executemany(
+                "INSERT INTO events (time_ms, kind, root, path, from_root, from_path, size, mtime_ns)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def flush(self):
+        with self.lock:
+            if self._db is None:
+                return
+            try:
+                if self._rows:
+                    self._commit()
+                now = time.monotonic()
+                if self.retention_days and (self._pruned_at is None
+                                            or now - self._pruned_at >= PRUNE_INTERVAL):
+                    self._pruned_at = now
+                    if self.prune() == PRUNE_CHUNK * PRUNE_CHUNKS:
+                        self._pruned_at -= PRUNE_INTERVAL  # more to do: again next time
+            except sqlite3.Error as exc:
+                sys.stderr.write(f"Event history not written to {self.path}: {exc}\n")
+
+    def prune(self, chunks=PRUNE_CHUNKS):
+        """Delete up to 'chunks' x PRUNE_CHUNK expired events; returns how many went."""
+        cutoff = int((time.time() - self.retention_days * 86400) * 1000)
+        deleted = 0
+        for _ in range(chunks):
+            with self._db:
+                count = self._db.execute(
+                    "DELETE FROM events WHERE id IN (SELECT id FROM events"
+                    " WHERE time_ms < ? ORDER BY time_ms LIMIT ?)",
+                    (cutoff, PRUNE_CHUNK)).rowcount
+            deleted += count
+            if count < PRUNE_CHUNK:
+                break
+        return deleted
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            if self._db is not None:
+                try:
+                    # Keeps the query planner's statistics current
+                    self._db.execute("PRAGMA optimize")
+                except sqlite3.Error:
+                    pass
+                self._db.close()
+                self._db = None
+        super().close()
+
+def query_history(path, since=None, until=None, under=None, kinds=None,
+                  limit=DEFAULT_QUERY_LIMIT):
+    """
+    Events in the history at 'path', newest first, as dicts with the keys
+    of the JSON events (time and mtime in seconds since the epoch): those
+    logged from 'since' to before 'until' (seconds since the epoch, None
+    for no bound), whose path is the directory or file 'under' or lies
+    below it (moves match on their new path), of one of 'kinds'. At most
+    'limit' are returned. Raises OSError if the history cannot be read.
+
+    Each root is searched on its own, through one of the two indexes (see
+    _plan()), and the results merged, so the time taken depends on the
+    events looked at, not on the size of the history. 'kinds' is not
+    indexed: asking only for a rare kind can mean a long search.
+    """
+    try:
+        db = _connect(path, readonly=True)
+    except sqlite3.Error as exc:
+        raise OSError(f"{path}: {exc}") from exc
+    try:
+        roots = dict(db.execute("SELECT id, path FROM roots"))
+        where, args = [], []
+        if since is not None:
+            where.append("time_ms >= ?")
+            args.append(int(since * 1000))
+        if until is not None:
+            where.append("time_ms < ?")
+            args.append(int(until * 1000))
+        if kinds:
+            where.append(f"kind IN ({', '.join('?' * len(kinds))})")
+            args += list(kinds)
+        target = os.path.realpath(under) if under is not None else None
+        found = []
+        for root_id, root in roots.items():
+            rel = _relative(root, target)
+            if rel is None:
+                continue
+            index, scope, scope_args = _plan(db, root_id, rel)
+            found.append(db.execute(
+                "SELECT time_ms, kind, root, path, from_root, from_path, size, mtime_ns"
+                f" FROM events INDEXED BY {index} WHERE root = ?{scope}"
+                + "".join(" AND " + term for term in where)
+                + " ORDER BY time_ms DESC LIMIT ?",
+                [root_id] + scope_args + args + [limit]).fetchall())
+    except sqlite3.Error as exc:
+        raise OSError(f"{path}: {exc}") from exc
+    finally:
+        db.close()
+    rows = heapq.merge(*found, key=lambda row: row[0], reverse=True)
+    return [{'time': time_ms / 1000, 'kind': kind, 'root': roots.get(root), 'path': rel,
+             'from_root': roots.get(from_root), 'from': from_path, 'size': size,
+             'mtime': mtime_ns / 1e9 if mtime_ns is not None else None}
+            for time_ms, kind, root, rel, from_root, from_path, size, mtime_ns
+            in list(rows)[:limit]]
+
+def _relative(root, target):
+    """
+    Path below 'root' of the absolute path 'target': '' for all of the
+    root (no target, the root itself or a folder containing it), None if
+    'target' is outside it.
+    """
+    if target is None or target == root or root.startswith(target.rstrip('/') + '/'):
+        return ''
+    if target.startswith(root.rstrip('/') + '/'):
+        return _text(target[len(root.rstrip('/')) + 1:])
+    return None
+
+def _plan(db, root_id, rel):
+    """
+    (index, SQL condition, arguments) selecting the events of one root
+    at or below 'rel'. A folder with few events is read from the
+    (root, path) index, all of them, then sorted. A busy one is read from
+    the (root, time) index, newest first and checking the paths on the
+    way, which stops as soon as enough have turned up.
+    """
+    if not rel:
+        return 'events_by_time', '', []
+    # One index range, from 'rel' up to 'rel0' ('0' follows '/'), less
+    # the siblings such as 'rel.txt' that sort inside it
+    scope = " AND path >= ? AND path < ? AND (path = ? OR substr(path, ?, 1) = '/')"
+    args = [rel, rel + '0', rel, len(rel) + 1]
+    count = db.execute(
+        "SELECT count(*) FROM (SELECT 1 FROM events INDEXED BY events_by_path"
+        f" WHERE root = ?{scope} LIMIT ?)", [root_id] + args + [SPARSE_EVENTS]).fetchone()[0]
+    return ('events_by_path' if count < SPARSE_EVENTS else 'events_by_time'), scope, args
+
+def event_time(event):
+    """The local time of a query_history() event as text, to the millisecond."""
+    stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(event['time']))
+    return f"{stamp}.{int(event['time'] * 1000) % 1000:03d}"
+
+def event_path(event):
+    """The full path of a query_history() event, 'old -> new' for moves."""
+    path = os.path.join(event['root'] or '', event['path'])
+    if event['kind'] == 'moved':
+        return os.path.join(event['from_root'] or '', event['from']) + " -> " + path
+    return path
+
+_AGO = re.compile(r'(\d+(?:\.\d+)?)\s*([smhd])$')
+_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+# What datetime.fromisoformat() (Python 3.7+) would read, 'T' turned into a space
+_ISO_FORMATS = ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d')
+
+def parse_time(text, now=None):
+    """
+    Seconds since the epoch for a time given as an ISO date and time
+    ('2025-06-01 02:00'), a time of today ('02:00', '02:00:30') or an
+    age ('90s', '15m', '2h', '7d' ago). Empty text gives None; anything
+    else raises ValueError.
+    """
+    text = text.strip()
+    if not text:
+        return None
+    now = time.time() if now is None else now
+    match = _AGO.match(text)
+    if match:
+        return now - float(match.group(1)) * _UNITS[match.group(2)]
+    if re.fullmatch(r'\d{1,2}:\d{2}(:\d{2})?', text):
+        today = datetime.fromtimestamp(now).date().isoformat()
+        text = f"{today} {text}"
+    for fmt in _ISO_FORMATS:
+        try:
+            return datetime.strptime(text.replace('T', ' ', 1), fmt).timestamp()
+        except ValueError:
+            pass
+    raise ValueError(f"not a time: {text!r} (use 2025-06-01 02:00, 02:00 or 2h)")
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+monitor_hooks.py
+
+Action hooks: run a shell command, or call a Python function, for each
+change whose kind and path match a hook. Jobs wait in a bounded queue
+and a fixed number of hook threads run them, never the scan worker or
+the GUI, each with a timeout. Standard library only.
+"""
+
+import os
+import time
+import signal
+import threading
+import subprocess
+from collections import deque
+
+from monitor_core import PathFilter
+
+HOOK_KINDS = ('any', 'added', 'removed', 'modified', 'moved')
+
+# What submit() does with a job when HOOK_QUEUE_SIZE jobs are waiting
+HOOK_POLICIES = ('drop-oldest', 'drop-new', 'block')
+
+DEFAULT_HOOK_WORKERS = 2
+DEFAULT_HOOK_TIMEOUT = 30.0
+HOOK_QUEUE_SIZE = 1000
+
+# Characters of a failing command's stderr kept in its failure message
+_STDERR_TAIL = 200
+
+class Hook:
+    """
+    Run 'action' for changes of 'kind' (one of HOOK_KINDS) whose path
+    relative to the watched folder matches 'pattern', a glob with the
+    filters' syntax (folders end in '/'; moves match on the new path).
+
+    A string action is run by the shell with the event in its environment:
+    DIRMON_KIND, DIRMON_ROOT, DIRMON_PATH (relative), DIRMON_FULLPATH and,
+    for moves, DIRMON_FROM_ROOT and DIRMON_FROM. Paths never go into the
+    command line itself, so odd file names cannot inject shell code. Any
+    other action is called with the event as a dict of the same values
+    (kind, root, path, fullpath, from_root, from).
+    """
+    def __init__(self, kind, pattern, action):
+        if kind not in HOOK_KINDS:
+            raise ValueError(f"unknown event kind: {kind!r}")
+        self.kind = kind
+        self.pattern = pattern
+        self.action = action
+        self._filter = PathFilter([pattern])
+
+    def __repr__(self):
+        return f"Hook({self.kind!r}, {self.pattern!r}, {self.action!r})"
+
+    def __str__(self):
+        action = self.action if isinstance(self.action, str) else getattr(
+            self.action, '__qualname__', repr(self.action))
+        return f"{self.kind:<8} {self.pattern}  →  {action}"
+
+    def matches(self, kind, rel):
+        return self.kind in ('any', kind) and self._filter.matches(rel)
+
+    def run(self, event, timeout):
+        """Run the action; raises on failure, subprocess.TimeoutExpired on timeout."""
+        if not isinstance(self.action, str):
+            self.action(event)
+            return
+        env = dict(os.environ)
+        for key, value in event.items():
+            if value is not None:
+                env['DIRMON_' + key.upper()] = value
+        # In a session of its own, so a timeout can kill what the shell started too
+        with subprocess.Popen(self.action, shell=True, env=env, start_new_session=True,
+                              stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.PIPE) as proc:
+            try:
+                _, stderr = proc.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                _kill_group(proc)
+                proc.wait()
+                raise
+        if proc.returncode != 0:
+            tail = stderr.decode('utf-8', 'replace').strip()[-_STDERR_TAIL:]
+            raise RuntimeError(f"exit status {proc.returncode}" + (f": {tail}" if tail else ""))
+
+def _kill_group(proc):
+    """Kill a command and, on POSIX, every process left in its process group."""
+    try:
+        if hasattr(os, 'killpg'):
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except ProcessLookupError:
+        pass  # all gone already
+
+class HookRunner:
+    """
+    Queue and run the hooks matching each change passed to submit() or
+    dispatch(), on 'workers' hook threads. At most 'max_queue' jobs wait;
+    past that 'policy' drops the oldest waiting job, drops the new one, or
+    blocks the caller until there is room (only sensible where the caller
+    may wait, as in the CLI). Commands still running after 'timeout'
+    seconds are killed, with the processes they started; a Python
+    callable cannot be interrupted, so one that overruns is counted as
+    timed out when it returns.
+
+    metrics() reports queue depth, running jobs and the latency, from
+    submit() to the end of the run, of the jobs finished since its last
+    call; failures() hands out the failure messages collected meanwhile.
+    """
+    def __init__(self, hooks, workers=DEFAULT_HOOK_WORKERS, timeout=DEFAULT_HOOK_TIMEOUT,
+                 max_queue=HOOK_QUEUE_SIZE, policy='drop-oldest'):
+        if policy not in HOOK_POLICIES:
+            raise ValueError(f"unknown backpressure policy: {policy!r}")
+        self.hooks = list(hooks)
+        self.workers = max(int(workers), 1)
+        self.timeout = timeout or None
+        self.max_queue = max_queue
+        self.policy = policy
+        self._jobs = deque()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._stopping = False
+        self._failures = deque(maxlen=100)
+        self.running = 0
+        self.totals = dict(ok=0, failed=0, timeout=0, dropped=0)
+        self._latency = []  # seconds, jobs finished since the last metrics()
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"hook-{i + 1}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        """Take no more jobs; the hook threads exit once the queue is empty."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+
+    def join(self, timeout=None):
+        """Wait up to 'timeout' seconds in all for the hook threads to exit."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+
+    def dispatch(self, added, removed, modified, moved):
+        """submit() every change of one (added, removed, modified, moved) tuple."""
+        for base, rel in sorted(added):
+            self.submit('added', base, rel)
+        for base, rel in sorted(removed):
+            self.submit('removed', base, rel)
+        for base, rel in sorted(modified):
+            self.submit('modified', base, rel)
+        for origin, (base, rel) in sorted(moved):
+            self.submit('moved', base, rel, origin)
+
+    def submit(self, kind, base, rel, origin=None):
+        """Queue a job for each hook matching the change."""
+        hooks = [hook for hook in self.hooks if hook.matches(kind, rel)]
+        if not hooks:
+            return
+        event = {'kind': kind, 'root': base, 'path': rel,
+                 'fullpath': os.path.join(base, rel.rstrip('/')),
+                 'from_root': origin[0] if origin else None,
+                 'from': origin[1] if origin else None}
+        now = time.monotonic()
+        with self._cond:
+            for hook in hooks:
+                if self._stopping:
+                    return
+                if len(self._jobs) >= self.max_queue:
+                    if self.policy == 'drop-new':
+                        self.totals['dropped'] += 1
+                        continue
+                    if self.policy == 'drop-oldest':
+                        self._jobs.popleft()
+                        self.totals['dropped'] += 1
+                    else:
+                        while len(self._jobs) >= self.max_queue and not self._stopping:
+                            self._cond.wait()
+                        if self._stopping:
+                            return
+                self._jobs.append((hook, event, now))
+                self._cond.notify()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._jobs and not self._stopping:
+                    self._cond.wait()
+                if not self._jobs:
+                    return
+                hook, event, queued = self._jobs.popleft()
+                self.running += 1
+                self._cond.notify_all()  # room for a blocked submit()
+            result, problem = 'ok', None
+            try:
+                started = time.monotonic()
+                hook.run(event, self.timeout)
+                if self.timeout and time.monotonic() - started > self.timeout:
+                    result, problem = 'timeout', f"took longer than {self.timeout:g}s"
+            except subprocess.TimeoutExpired:
+                result, problem = 'timeout', f"killed after {self.timeout:g}s"
+            except Exception as exc:
+                result, problem = 'failed', str(exc) or type(exc).__name__
+            if problem:
+                self._failures.append(f"Hook on {hook.kind} {hook.pattern}, {event['fullpath']}: {problem}")
+            with self._cond:
+                self.running -= 1
+                self.totals[result] += 1
+                self._latency.append(time.monotonic() - queued)
+
+    def metrics(self):
+        """
+        Dict of queued and running jobs, the running totals per outcome
+        (ok, failed, timeout, dropped), and the count, mean and maximum
+        latency in seconds of the jobs finished since the last call.
+        """
+        with self._cond:
+            latency, self._latency = self._latency, []
+            return dict(queued=len(self._jobs), running=self.running, totals=dict(self.totals),
+                        finished=len(latency),
+                        latency_avg_s=sum(latency) / len(latency) if latency else 0.0,
+                        latency_max_s=max(latency, default=0.0))
+
+    def failures(self):
+        """Failure messages collected since the last call."""
+        messages = []
+        while self._failures:
+            messages.append(self._failures.popleft())
+        return messages
@@ -0,0 +1,454 @@
+# -*- coding: utf-8 -*-
+"""
+monitor_inotify.py
+
+Event-driven backend for Linux, built on inotify(7) through ctypes so no
+third-party packages are needed. InotifyWatcher keeps a Snapshot like the
+one scan_directories() returns: kernel events mark the directories they
+touch, which are then listed again (or, for plain modifications, have
+just the named entries stat'ed), and the tables that changed are diffed
+into the (added, removed, modified, moved) sets compare_snapshots()
+returns.
+
+Directories that cannot be watched because the per-user watch limit
+(fs.inotify.max_user_watches) is reached are rescanned periodically with
+scan_directories() instead; an event queue overflow triggers a full
+rescan.
+"""
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+from monitor_core import (F_DESCEND, F_DIR, F_LISTED, F_MATCH, DirTable,
+                          diff_tables, list_directory, nested_roots, pair_moves,
+                          scan_directories, scan_subtree)
+
+# Event masks from <sys/inotify.h>
+IN_MODIFY      = 0x00000002
+IN_ATTRIB      = 0x00000004
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_Q_OVERFLOW  = 0x00004000
+IN_IGNORED     = 0x00008000
+IN_ONLYDIR     = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+
+_WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CREATE | IN_DELETE |
+               IN_MOVED_FROM | IN_MOVED_TO |
+               IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+
+# struct inotify_event { int wd; uint32_t mask, cookie, len; char name[]; }
+_EVENT = struct.Struct('iIII')
+_READ_SIZE = 64 * 1024
+
+_libc = None
+
+
+class InotifyUnavailable(OSError):
+    """inotify cannot be used on this system."""
+
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        if not sys.platform.startswith('linux'):
+            raise InotifyUnavailable("inotify is only available on Linux")
+        libc = None
+        for name in (None, ctypes.util.find_library('c')):
+            try:
+                candidate = ctypes.CDLL(name, use_errno=True)
+                candidate.inotify_init1
+            except (OSError, AttributeError):
+                continue
+            libc = candidate
+            break
+        if libc is None:
+            raise InotifyUnavailable("libc does not provide inotify_init1")
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_init1.restype = ctypes.c_int
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_add_watch.restype = ctypes.c_int
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        libc.inotify_rm_watch.restype = ctypes.c_int
+        _libc = libc
+    return _libc
+
+
+def inotify_available():
+    """Return True if the inotify backend can be used here."""
+    try:
+        _load_libc()
+    except InotifyUnavailable:
+        return False
+    return True
+
+
+class _Inotify:
+    """Minimal wrapper around one inotify file descriptor."""
+    def __init__(self):
+        self._libc = _load_libc()
+        fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise InotifyUnavailable(err, os.strerror(err))
+        self.fd = fd
+
+    def add_watch(self, path, mask):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout):
+        """Wait up to 'timeout' seconds and return all pending events."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        events = []
+        if not ready:
+            return events
+        while True:
+            try:
+                buf = os.read(self.fd, _READ_SIZE)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(buf):
+                wd, mask, cookie, length = _EVENT.unpack_from(buf, offset)
+                offset += _EVENT.size
+                name = os.fsdecode(buf[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                events.append((wd, mask, cookie, name))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class InotifyWatcher:
+    """
+    Keep a scan_directories() style Snapshot up to date from inotify events.
+
+    'params' is the (bases, recursive, include_hidden, path_filter) tuple
+    scan_directories() takes. Call start() for the baseline, then
+    poll() repeatedly; each call returns (added, removed, modified, moved)
+    for the events read, with the same entries compare_snapshots() would
+    report.
+    Paths that had to fall back to polling are appended to 'limited'.
+    Full rescans (start, resync, queue overflow) use 'workers' threads.
+    """
+    def __init__(self, params, cancel=None):
+        self._ino = _Inotify()
+        self.cancel = cancel
+        self.rescan_interval = 5.0
+        self.workers = 1
+        self.snapshot = None
+        self.limited = []
+        self._wds = {}       # wd -> (base, dir path, rel prefix)
+        self._dirs = {}      # dir path -> wd
+        self._polled = {}    # dir path -> (base, rel prefix), watch limit reached
+        self._before = {}    # (base, prefix) -> table before the current batch
+        self._next_rescan = 0.0
+        self._set_params(params)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._ino.close()
+
+    def _set_params(self, params):
+        bases, self.recursive, self.include_hidden, self.path_filter = params
+        self.bases = list(dict.fromkeys(os.path.realpath(b) for b in bases))
+        self.skip = frozenset(nested_roots(self.bases))
+
+    def _scan(self):
+        return scan_directories(self.bases, self.recursive, self.include_hidden,
+                                self.path_filter, self.cancel, previous=self.snapshot,
+                                workers=self.workers)
+
+    def start(self):
+        """Install the watches and return the baseline snapshot."""
+        # Watch first so nothing changing during the scan is missed
+        for base in self.bases:
+            self._watch_tree(base, base, '')
+        self.snapshot = self._scan()
+        self._next_rescan = time.monotonic() + self.rescan_interval
+        return self.snapshot
+
+    def poll(self, timeout):
+        """Process the events arriving within 'timeout' seconds."""
+        relist = set()      # (base, dir path, prefix) to list again
+        restat = {}         # (base, dir path, prefix) -> names to stat again
+        for wd, mask, cookie, name in self._ino.read(timeout):
+            if mask & IN_Q_OVERFLOW:
+                self._rescan_all()
+                continue
+            watch = self._wds.get(wd)
+            if watch is None:
+                continue
+            if mask & IN_IGNORED:
+                self._forget(wd)
+                continue
+            if not name or (not self.include_hidden and name.startswith('.')):
+                continue
+            base, dirpath, prefix = watch
+            structural = mask & (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO)
+            if prefix and structural:
+                # Entries added or removed change the directory's own mtime
+                parent = os.path.dirname(dirpath)
+                cut = prefix[:-1].rfind('/') + 1
+                restat.setdefault((base, parent, prefix[:cut]), set()).add(prefix[cut:-1])
+            if prefix and not self.recursive:
+                continue
+            if structural:
+                relist.add(watch)
+            else:
+                restat.setdefault(watch, set()).add(name)
+
+        # Parents first, so a directory removed with its parent is not listed
+        for base, path, prefix in sorted(relist, key=lambda w: len(w[2])):
+            self._refresh_dir(base, path, prefix)
+        for watch, names in restat.items():
+            if watch not in relist:
+                self._restat_entries(*watch, names)
+
+        if time.monotonic() >= self._next_rescan:
+            self._rescan_polled()
+            self._next_rescan = time.monotonic() + self.rescan_interval
+        return self._changes()
+
+    def resync(self, params):
+        """Apply new settings: rebuild watches and rescan everything."""
+        self._set_params(params)
+        for wd in list(self._wds):
+            self._ino.rm_watch(wd)
+        self._wds.clear()
+        self._dirs.clear()
+        self._polled.clear()
+        for base in self.bases:
+            self._watch_tree(base, base, '')
+        fresh = self._scan()
+        for base in self.snapshot.roots.keys() | fresh.roots.keys():
+            self._replace(base, '', fresh.roots.get(base, {}))
+        self.snapshot.key = fresh.key
+        return self._changes()
+
+    # -- watches ------------------------------------------------------------
+
+    def _watch_tree(self, base, path, prefix):
+        """
+        Watch 'path' and every directory below it. Non-recursive scans
+        only watch the base and its direct subdirectories, the latter just
+        to notice their own mtime changing. Other watched roots below
+        'path' are left to their own call, and a directory met twice
+        (bind mounts) is watched once.
+        """
+        stack = [(path, prefix)]
+        seen = set()
+        while stack:
+            path, prefix = stack.pop()
+            if path in self._dirs or path in self._polled or (prefix and path in self.skip):
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if (st.st_dev, st.st_ino) in seen:
+                continue
+            seen.add((st.st_dev, st.st_ino))
+            try:
+                wd = self._ino.add_watch(path, _WATCH_MASK)
+            except OSError as exc:
+                if exc.errno == errno.ENOSPC:
+                    # Out of watches: this subtree is rescanned instead
+                    self._polled[path] = (base, prefix)
+                    self.limited.append(path)
+                continue
+            # The kernel hands back the existing wd for an inode already
+            # watched, e.g. a directory moved within the tree
+            old = self._wds.get(wd)
+            if old is not None and self._dirs.get(old[1]) == wd:
+                del self._dirs[old[1]]
+            self._wds[wd] = (base, path, prefix)
+            self._dirs[path] = wd
+            if not self.recursive and prefix:
+                continue
+            try:
+                it = os.scandir(path)
+            except OSError:
+                continue
+            with it:
+                for entry in it:
+                    name = entry.name
+                    if not self.include_hidden and name.startswith('.'):
+                        continue
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    rel = prefix + name + '/'
+                    if is_dir and not self.path_filter.prunes(rel):
+                        stack.append((entry.path, rel))
+
+    def _forget(self, wd):
+        watch = self._wds.pop(wd, None)
+        if watch and self._dirs.get(watch[1]) == wd:
+            del self._dirs[watch[1]]
+
+    def _unwatch_below(self, path):
+        below = path + os.sep
+        for p in [p for p in self._dirs if p == path or p.startswith(below)]:
+            wd = self._dirs.pop(p)
+            self._wds.pop(wd, None)
+            self._ino.rm_watch(wd)
+        for p in [p for p in self._polled if p == path or p.startswith(below)]:
+            del self._polled[p]
+
+    # -- snapshot updates ---------------------------------------------------
+
+    def _swap(self, base, prefix, table):
+        """Install 'table' (None to remove) for one directory of 'base'."""
+        tables = self.snapshot.roots.setdefault(base, {})
+        self._before.setdefault((base, prefix), tables.get(prefix))
+        if table is None:
+            tables.pop(prefix, None)
+        else:
+            tables[prefix] = table
+
+    def _replace(self, base, prefix, found):
+        """Replace every table of 'base' at or below 'prefix' with 'found'."""
+        tables = self.snapshot.roots.get(base, {})
+        for p in [p for p in tables if p.startswith(prefix) and p not in found]:
+            self._swap(base, p, None)
+        for p, table in found.items():
+            if tables.get(p) is not table:
+                self._swap(base, p, table)
+
+    def _changes(self):
+        """Net changes since the last call; short-lived entries cancel out."""
+        added, removed, modified, identities = set(), set(), set(), {}
+        for (base, prefix), old in self._before.items():
+            new = self.snapshot.roots.get(base, {}).get(prefix)
+            diff_tables(base, prefix, old, new, added, removed, modified, identities)
+        self._before = {}
+        for base in [b for b, tables in self.snapshot.roots.items() if not tables]:
+            del self.snapshot.roots[base]
+        moved = pair_moves(added, removed, modified, identities)
+        return added, removed, modified, moved
+
+    def _subdirs(self, table, prefix):
+        """Map name -> inode of the entries of 'table' that get watches."""
+        if table is None:
+            return {}
+        if self.recursive:
+            wanted = F_DESCEND
+        elif not prefix:
+            wanted = F_DIR
+        else:
+            return {}
+        names = table.name_list()
+        return {names[i]: table.inos[i] for i, flag in enumerate(table.flags)
+                if flag & wanted and flag & (F_LISTED | F_DESCEND)}
+
+    def _refresh_dir(self, base, path, prefix):
+        """List one directory again and follow subdirectories coming and going."""
+        tables = self.snapshot.roots.get(base, {})
+        old = tables.get(prefix)
+        if prefix and old is None:
+            return  # went away with its parent, or never part of the scan
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+        table = None
+        if st is not None:
+            table, _ = list_directory(path, prefix, st, self.recursive,
+                                      self.include_hidden, self.path_filter, self.skip)
+        if table is None:
+            if not prefix:
+                self._replace(base, '', {})  # the base itself is gone
+            return  # otherwise the parent's events will drop it
+        self._swap(base, prefix, table)
+        before, after = self._subdirs(old, prefix), self._subdirs(table, prefix)
+        for name in before.keys() | after.keys():
+            sub, rel = os.path.join(path, name), prefix + name + '/'
+            ino = after.get(name)
+            # A directory lost its watch when it was deleted, even if the
+            # one replacing it got the same inode number
+            if ino == before.get(name) and (sub in self._dirs or sub in self._polled):
+                continue
+            if name in before:
+                self._unwatch_below(sub)
+                self._replace(base, rel, {})
+            if ino is not None:
+                self._watch_tree(base, sub, rel)
+                if self.recursive:
+                    # Entries may have been created before the watch existed
+                    self._rescan_subtree(base, sub, rel)
+
+    def _restat_entries(self, base, path, prefix, names):
+        """Refresh the stat data of some entries of an already listed directory."""
+        old = self.snapshot.roots.get(base, {}).get(prefix)
+        if old is None:
+            return
+        flags = bytearray(old.flags)
+        inos, sizes, mtimes = old.inos[:], old.sizes[:], old.mtimes[:]
+        count = old.count
+        for name in names:
+            i = old.index(name)
+            if i < 0 or not flags[i] & (F_MATCH | F_DESCEND):
+                continue
+            try:
+                st = os.stat(os.path.join(path, name))
+            except OSError:
+                continue  # a delete event for it is on its way
+            if flags[i] & F_MATCH and not flags[i] & F_LISTED:
+                flags[i] |= F_LISTED
+                count += 1
+            inos[i], sizes[i], mtimes[i] = st.st_ino, st.st_size, st.st_mtime_ns
+        table = DirTable(old.dev, old.ino, old.mtime_ns, old.listed_ns, old.names,
+                         bytes(flags), inos, sizes, mtimes, count)
+        self._swap(base, prefix, table)
+
+    def _rescan_subtree(self, base, path, prefix):
+        """Bring the tables at and below 'path' in line with a fresh scan."""
+        found = scan_subtree(base, path, prefix, self.recursive, self.include_hidden,
+                             self.path_filter, self.cancel, previous=self.snapshot,
+                             skip=self.skip)
+        self._replace(base, prefix, found.roots.get(base, {}))
+
+    def _rescan_polled(self):
+        for path, (base, prefix) in list(self._polled.items()):
+            self._rescan_subtree(base, path, prefix)
+        # A watched base that was deleted and recreated needs a new watch
+        for base in self.bases:
+            if base not in self._dirs and base not in self._polled and os.path.isdir(base):
+                self._watch_tree(base, base, '')
+                self._rescan_subtree(base, base, '')
+
+    def _rescan_all(self):
+        """Queue overflow: events were lost, rescan every base."""
+        for path in [p for p in self._dirs if not os.path.isdir(p)]:
+            self._forget(self._dirs[path])
+        for base in self.bases:
+            self._watch_tree(base, base, '')
+        fresh = self._scan()
+        for base in self.bases:
+            self._replace(base, '', fresh.roots.get(base, {}))
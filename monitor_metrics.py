@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+monitor_metrics.py
+
+Writes the scan worker's per-poll statistics (see monitor_core.ScanStats)
+to a file other tools can pick up, with the action hooks' queue depth
+and latency when there are hooks (see monitor_hooks): Prometheus text format when the name
+ends in '.prom', for node_exporter's textfile collector, or one JSON
+object per line otherwise. Standard library only.
+"""
+
+import os
+import json
+import time
+
+# ScanStats field, metric name and help text of the per-root gauges
+_GAUGES = (
+    ('dirs_listed', 'dirmon_dirs_listed', "Directories listed by the last poll."),
+    ('dirs_restat', 'dirmon_dirs_restat', "Unchanged directories whose entries the last poll re-stat'ed."),
+    ('visited', 'dirmon_entries_visited', "Entries looked at by the last poll."),
+    ('filtered', 'dirmon_entries_filtered', "Entries left out by the hidden flag or the globs in the last poll."),
+    ('stat_errors', 'dirmon_stat_errors', "Failed stat or listing calls in the last poll."),
+    ('scan_s', 'dirmon_scan_seconds', "Seconds the last poll waited on the scan."),
+    ('diff_s', 'dirmon_diff_seconds', "Seconds the last poll spent diffing."),
+    ('events', 'dirmon_poll_events', "Changes reported by the last poll."),
+)
+
+def _label(value):
+    # A path that is not valid UTF-8 holds surrogate escapes: write them as \udcXX
+    value = value.encode('utf-8', 'backslashreplace').decode('utf-8')
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class MetricsWriter:
+    """
+    Keeps running totals over the polls passed to record() and writes them
+    to 'path' after each one. A '.prom' file is replaced atomically and
+    holds the last poll's figures as gauges next to the totals; any other
+    file gets one line appended per poll.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.prometheus = path.endswith('.prom')
+        self.polls = 0
+        self.events = {}        # base -> events reported since start
+        self.stat_errors = {}   # base -> failed calls since start
+        self.last_stats = {}
+        self.last_duration = None
+        self.last_time = None
+        self.hooks = None       # last HookRunner.metrics()
+        self.hook_latency = [0, 0.0]  # jobs finished and their latency sum, since start
+
+    def record(self, stats, duration=None, hooks=None):
+        """
+        Account for one poll: 'stats' maps each base to its ScanStats and
+        'duration' is the poll's wall time in seconds. With the inotify
+        backend there is no poll to time; pass the events only, and None.
+        'hooks' is HookRunner.metrics() taken after the poll, if any.
+        """
+        if hooks is not None:
+            self.hooks = hooks
+            self.hook_latency[0] += hooks['finished']
+            self.hook_latency[1] += hooks['latency_avg_s'] * hooks['finished']
+        now = time.time()
+        for base, s in stats.items():
+            self.events[base] = self.events.get(base, 0) + s.events
+            self.stat_errors[base] = self.stat_errors.get(base, 0) + s.stat_errors
+        if duration is not None:
+            self.polls += 1
+            self.last_stats = stats
+            self.last_duration = duration
+            self.last_time = now
+        if self.prometheus:
+            self._write_prometheus()
+        else:
+            self._append_json(stats, duration, now)
+
+    def _append_json(self, stats, duration, now):
+        record = dict(time=round(now, 3), duration_s=duration,
+                      roots={base: s.as_dict() for base, s in stats.items()})
+        if self.hooks is not None:
+            record['hooks'] = self.hooks
+        with open(self.path, 'a', encoding='utf-8') as fh:
+            fh.write(json.dumps(record) + '\n')
+
+    def _write_prometheus(self):
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{labels} {value}")
+
+        def per_root(values):
+            return [(f'{{root="{_label(base)}"}}', v) for base, v in sorted(values.items())]
+
+        metric('dirmon_polls_total', 'counter', "Polls completed.", [('', self.polls)])
+        metric('dirmon_events_total', 'counter', "Changes reported.", per_root(self.events))
+        metric('dirmon_stat_errors_total', 'counter', "Failed stat or listing calls.",
+               per_root(self.stat_errors))
+        if self.last_duration is not None:
+            metric('dirmon_last_poll_timestamp_seconds', 'gauge', "When the last poll ended.",
+                   [('', round(self.last_time, 3))])
+            metric('dirmon_poll_duration_seconds', 'gauge', "Wall time of the last poll.",
+                   [('', round(self.last_duration, 6))])
+            for field, name, help_text in _GAUGES:
+                values = {base: getattr(s, field) for base, s in self.last_stats.items()}
+                if field.endswith('_s'):
+                    values = {base: round(v, 6) for base, v in values.items()}
+                metric(name, 'gauge', help_text, per_root(values))
+        if self.hooks is not None:
+            h = self.hooks
+            metric('dirmon_hook_queue_depth', 'gauge', "Hook jobs waiting for a hook thread.",
+                   [('', h['queued'])])
+            metric('dirmon_hook_running', 'gauge', "Hook jobs running.", [('', h['running'])])
+            metric('dirmon_hook_jobs_total', 'counter', "Hook jobs by outcome.",
+                   [(f'{{result="{k}"}}', v) for k, v in sorted(h['totals'].items())])
+            metric('dirmon_hook_latency_seconds', 'summary',
+                   "Seconds from queueing to the end of finished hook jobs.",
+                   [('_sum', round(self.hook_latency[1], 6)), ('_count', self.hook_latency[0])])
+            metric('dirmon_hook_latency_max_seconds', 'gauge',
+                   "Longest latency of the hook jobs finished since the last write.",
+                   [('', round(h['latency_max_s'], 6))])
+
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as fh:
+                fh.write('\n'.join(lines) + '\n')
+            os.replace(tmp, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
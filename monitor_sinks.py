@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+monitor_sinks.py
+
+Where logged events end up besides the GUI's log view. EventLog puts a
+QueueHandler on the root logger, and a listener thread writes every
+record to each sink, so a slow disk only ever holds up that thread.
+FileSink buffers its writes and rotates the file by size, JsonFormatter
+turns change events into JSON lines. log_changes() and handle_message()
+turn what a ScanWorker posts into those records, for the GUIs and the
+CLI alike. Standard library only.
+"""
+
+import os
+import json
+import queue
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+
+from monitor_core import F_DIR, F_LISTED
+
+LOG_FORMAT = "%(asctime)s %(levelname)-8s %(message)s"
+
+# Bytes a FileSink buffers between flushes, and rotated files kept
+WRITE_BUFFER = 64 * 1024
+DEFAULT_BACKUPS = 5
+
+# Text of each kind of change, and of the worker's messages as (level,
+# text) with '{}' the payload (a dict payload's keys are fields as well,
+# lists joined by commas); the Italian GUI passes its own
+CHANGE_LABELS = {'added': "+Added   ", 'removed': "-Removed ",
+                 'modified': "*Modified", 'moved': ">Moved   "}
+MESSAGES = {
+    'ready': (logging.INFO, "Baseline ready: {} entries"),
+    'restored': (logging.INFO, "Saved state restored: {} entries, checking for changes since"),
+    'state_error': (logging.WARNING, "Could not save state, continuing without it: {}"),
+    'error': (logging.ERROR, "Scan failed: {}"),
+    'fallback': (logging.WARNING, "inotify unavailable ({}), falling back to polling"),
+    'watch_limit': (logging.WARNING, "inotify watch limit reached, polling {}"),
+    'attached': (logging.INFO, "Attached to the daemon (pid {pid}, {backend}, "
+                               "every {interval:g}s) watching: {roots}"),
+    'detached': (logging.ERROR, "Daemon unavailable: {}"),
+    'profile': (logging.INFO, "Profile of one poll saved to {}"),
+    'metrics_error': (logging.WARNING, "Could not write metrics: {}"),
+}
+
+def change_extra(kind, base, rel, snapshot=None, origin=None):
+    """
+    The 'extra' argument for logging one change, so that JSON sinks can
+    write it as a structured event: 'kind' is added, removed, modified or
+    moved ('origin' then being the old (base, rel)). Size and mtime are
+    looked up in 'snapshot' when the record is written, not here.
+    """
+    return {'change': (kind, base, rel, origin), 'snapshot': snapshot}
+
+def log_changes(changes, snapshot=None, hooks=None, labels=CHANGE_LABELS):
+    """
+    Log one (added, removed, modified, moved) change set, each kind
+    sorted and with its text in 'labels', then hand it to 'hooks', a
+    HookRunner, if given. 'snapshot' holds the entries' stat data.
+    """
+    added, removed, modified, moved = changes
+    for base, rel in sorted(added):
+        logging.info(f"[{base}] {labels['added']}: {rel}",
+                     extra=change_extra('added', base, rel, snapshot))
+    for base, rel in sorted(removed):
+        logging.info(f"[{base}] {labels['removed']}: {rel}",
+                     extra=change_extra('removed', base, rel))
+    for base, rel in sorted(modified):
+        logging.info(f"[{base}] {labels['modified']}: {rel}",
+                     extra=change_extra('modified', base, rel, snapshot))
+    for origin, (base, rel) in sorted(moved):
+        old_base, old_rel = origin
+        if old_base != base:
+            old_rel = os.path.join(old_base, old_rel)
+        logging.info(f"[{base}] {labels['moved']}: {old_rel} -> {rel}",
+                     extra=change_extra('moved', base, rel, snapshot, origin))
+    if hooks is not None:
+        hooks.dispatch(added, removed, modified, moved)
+
+def handle_message(kind, payload, handlers, messages=MESSAGES):
+    """
+    Log one (kind, payload) message of a ScanWorker or DaemonClient with
+    its text in 'messages', then pass the payload to handlers[kind], if
+    there is one: 'changes' for instance, which only the caller knows
+    what to do with. Kinds in neither are ignored.
+    """
+    text = messages.get(kind)
+    if text is not None:
+        level, text = text
+        if isinstance(payload, dict):
+            fields = {key: ', '.join(value) if isinstance(value, list) else value
+                      for key, value in payload.items()}
+            logging.log(level, text.format(payload, **fields))
+        else:
+            logging.log(level, text.format(payload))
+    handler = handlers.get(kind)
+    if handler is not None:
+        handler(payload)
+
+class StatLookup:
+    """
+    (ino, size, mtime_ns) of a changed entry, as Snapshot.get() but with
+    the name index of the last directory looked in kept: changes come
+    sorted by path, so one directory's arrive together.
+    """
+    def __init__(self):
+        self._table = None
+        self._index = {}
+
+    def __call__(self, snapshot, base, rel):
+        if snapshot is None:
+            return None
+        if not hasattr(snapshot, 'roots'):
+            return snapshot.get(base, rel)  # an attached client's (see monitor_daemon)
+        is_dir = rel.endswith('/')
+        path = rel[:-1] if is_dir else rel
+        cut = path.rfind('/') + 1
+        table = snapshot.roots.get(base, {}).get(path[:cut])
+        if table is None:
+            return None
+        if table is not self._table:
+            self._table = table
+            self._index = {name: i for i, name in enumerate(table.name_list())}
+        i = self._index.get(path[cut:])
+        if i is None or not table.flags[i] & F_LISTED or bool(table.flags[i] & F_DIR) != is_dir:
+            return None
+        return table.inos[i], table.sizes[i], table.mtimes[i]
+
+def _iso(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat(timespec='milliseconds')
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per change: time, root, path, kind, is_dir, size and
+    mtime (None for removed entries), plus from_root/from for moves.
+    Records that are not changes become {time, level, message}.
+    """
+    def __init__(self):
+        super().__init__()
+        self._lookup = StatLookup()
+
+    def format(self, record):
+        change = getattr(record, 'change', None)
+        if change is None:
+            return json.dumps({'time': _iso(record.created), 'level': record.levelname,
+                               'message': record.getMessage()}, ensure_ascii=False)
+        kind, base, rel, origin = change
+        event = {'time': _iso(record.created), 'root': base, 'path': rel, 'kind': kind,
+                 'is_dir': rel.endswith('/'), 'size': None, 'mtime': None}
+        if origin is not None:
+            event['from_root'], event['from'] = origin
+        found = self._lookup(getattr(record, 'snapshot', None), base, rel) if kind != 'removed' else None
+        if found is not None:
+            event['size'] = found[1]
+            event['mtime'] = _iso(found[2] / 1e9)
+        return json.dumps(event, ensure_ascii=False)
+
+class FileSink(logging.Handler):
+    """
+    Appends formatted records to 'path' through a WRITE_BUFFER buffer,
+    flushed by EventLog's writer whenever it runs out of records. Past
+    'max_bytes' (0: never) the file is renamed to path.1, path.1 to
+    path.2 and so on, keeping 'backups' old files. The file is opened
+    straight away, so a bad path raises OSError here.
+    """
+    def __init__(self, path, max_bytes=0, backups=DEFAULT_BACKUPS, formatter=None):
+        super().__init__()
+        self.path = os.path.abspath(path)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.setFormatter(formatter or logging.Formatter(LOG_FORMAT))
+        self._fh = open(self.path, 'ab', buffering=WRITE_BUFFER)
+        self._size = self._fh.tell()
+
+    def emit(self, record):
+        try:
+            data = (self.format(record) + '\n').encode('utf-8', 'backslashreplace')
+            if self._fh is None:
+                return  # closed
+            if self.max_bytes and self._size and self._size + len(data) > self.max_bytes:
+                self._rotate()
+            self._fh.write(data)
+            self._size += len(data)
+        except Exception:
+            self.handleError(record)
+
+    def _rotate(self):
+        self._fh.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        self._fh = open(self.path, 'wb', buffering=WRITE_BUFFER)
+        self._size = 0
+
+    def flush(self):
+        with self.lock:
+            if self._fh is not None:
+                self._fh.flush()
+
+    def close(self):
+        with self.lock:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+        super().close()
+
+class _Listener(logging.handlers.QueueListener):
+    """QueueListener that flushes its handlers each time the queue runs dry."""
+    def dequeue(self, block):
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            if not block:
+                raise
+        for handler in self.handlers:
+            handler.flush()
+        return self.queue.get(block)
+
+class EventLog:
+    """
+    The root logger's set-up for one monitoring session. start() replaces
+    whatever handlers the root logger had with the 'direct' ones, called
+    in the logging thread (the GUI's view), and a QueueHandler feeding
+    the 'sinks' from a writer thread; stop() drains the queue, closes
+    every handler and detaches them, so the next start() begins afresh.
+    """
+    def __init__(self, direct=(), sinks=(), level=logging.INFO):
+        self.direct = list(direct)
+        self.sinks = list(sinks)
+        self.level = level
+        self._listener = None
+        self._handlers = []
+
+    def start(self):
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        formatter = logging.Formatter(LOG_FORMAT)
+        self._handlers = []
+        for handler in self.direct:
+            if handler.formatter is None:
+                handler.setFormatter(formatter)
+            self._handlers.append(handler)
+        if self.sinks:
+            records = queue.Queue()
+            self._listener = _Listener(records, *self.sinks, respect_handler_level=True)
+            self._listener.start()
+            self._handlers.append(logging.handlers.QueueHandler(records))
+        for handler in self._handlers:
+            root.addHandler(handler)
+        root.setLevel(self.level)
+        return self
+
+    def stop(self):
+        root = logging.getLogger()
+        for handler in self._handlers:
+            root.removeHandler(handler)
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+        for handler in self.direct + self.sinks:
+            handler.close()
+        self._handlers = []